@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Measures keystroke round trip latency and output throughput of the Console
+# RPC with many sessions open at once. Each VM's serial port is replaced by
+# a PTY pair whose other end echoes keystrokes and, when asked, floods the
+# console with output, so the numbers reflect the server's console path and
+# not the guest's.
+#
+# Usage: ./IGS_venv/bin/python3 bench/console_throughput.py --vms 8 --readers 4
+
+import argparse
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compute import compute
+from compute.console_hub import ConsoleHub
+from compute.generated import compute_pb2, compute_pb2_grpc
+
+FLOOD_REQUEST = b"\x06"
+
+# Stands in for VMManager, serving the consoles of the fake VMs.
+class PtyConsoles:
+
+    def __init__(self, hub, pty_paths):
+        self.hub = hub
+        self.pty_paths = pty_paths
+
+    def open_console(self, vm_name="", read_only=False):
+        return self.hub.open_session(vm_name, self.pty_paths[vm_name], read_only=read_only)
+
+def run_guest(master, flood_size):
+    chunk = b"x" * 65536
+    while True:
+        try:
+            data = os.read(master, 4096)
+        except OSError:
+            return
+        if (data == FLOOD_REQUEST):
+            for offset in range(0, flood_size, len(chunk)):
+                os.write(master, chunk[:flood_size - offset])
+        else:
+            os.write(master, data)
+
+def open_console(stub, vm_name, read_only=False):
+    inputs = queue.Queue()
+    inputs.put(compute_pb2.ConsoleInput(vm_name=vm_name, read_only=read_only))
+    responses = stub.Console(iter(inputs.get, None))
+    return inputs, responses
+
+def measure_latency(stub, vm_name, keystrokes):
+    inputs, responses = open_console(stub, vm_name)
+    latencies = []
+    try:
+        for _ in range(keystrokes):
+            start_time = time.monotonic()
+            inputs.put(compute_pb2.ConsoleInput(data=b"a"))
+            received = b""
+            while b"a" not in received:
+                received += next(responses).data
+            latencies.append(time.monotonic() - start_time)
+    finally:
+        inputs.put(None)
+        responses.cancel()
+    return latencies
+
+def measure_throughput(stub, vm_name, readers, flood_size):
+    consoles = [open_console(stub, vm_name, read_only=True) for _ in range(readers)]
+    # Attaching is asynchronous, the flood must not start before it is done.
+    time.sleep(0.5)
+
+    def drain(responses):
+        received = 0
+        while received < flood_size:
+            received += len(next(responses).data)
+        return received
+
+    with futures.ThreadPoolExecutor(max_workers=readers) as executor:
+        drains = [executor.submit(drain, responses) for _, responses in consoles]
+        inputs, responses = open_console(stub, vm_name)
+        start_time = time.monotonic()
+        inputs.put(compute_pb2.ConsoleInput(data=FLOOD_REQUEST))
+        received = sum(drain.result() for drain in drains)
+        duration = time.monotonic() - start_time
+
+    for console_inputs, console_responses in consoles + [(inputs, responses)]:
+        console_inputs.put(None)
+        console_responses.cancel()
+    return received, duration
+
+def main():
+    parser = argparse.ArgumentParser(description="Console latency and throughput benchmark")
+    parser.add_argument("--vms", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4, help="Read-only sessions per VM")
+    parser.add_argument("--keystrokes", type=int, default=200)
+    parser.add_argument("--megabytes", type=int, default=16, help="Output each VM floods its console with")
+    parser.add_argument("--port", type=int, default=50063)
+    args = parser.parse_args()
+
+    flood_size = args.megabytes * 1024 * 1024
+    pty_paths = {}
+    for i in range(args.vms):
+        master, slave = os.openpty()
+        pty_paths[f"vm{i}"] = os.ttyname(slave)
+        threading.Thread(target=run_guest, args=(master, flood_size), daemon=True).start()
+
+    hub = ConsoleHub()
+    hub.start()
+    servicer = compute.VMMServicer(max_consoles=args.vms * (args.readers + 1))
+    servicer.vm_manager = PtyConsoles(hub, pty_paths)
+
+    srv = grpc.server(futures.ThreadPoolExecutor(max_workers=args.vms * (args.readers + 2)))
+    compute_pb2_grpc.add_vmmServicer_to_server(servicer, srv)
+    srv.add_insecure_port(f"[::]:{args.port}")
+    srv.start()
+    channel = grpc.insecure_channel(f"localhost:{args.port}")
+    stub = compute_pb2_grpc.vmmStub(channel)
+
+    try:
+        with futures.ThreadPoolExecutor(max_workers=args.vms) as executor:
+            latencies = sum(executor.map(lambda vm_name: measure_latency(stub, vm_name, args.keystrokes),
+                pty_paths), [])
+        latencies.sort()
+        print(f"Keystroke round trip over {args.vms} concurrent sessions: "
+            f"p50 {statistics.median(latencies) * 1000:.2f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+        with futures.ThreadPoolExecutor(max_workers=args.vms) as executor:
+            results = list(executor.map(
+                lambda vm_name: measure_throughput(stub, vm_name, args.readers, flood_size), pty_paths))
+        received = sum(result[0] for result in results)
+        duration = max(result[1] for result in results)
+        print(f"Output to {args.vms * args.readers} readers on {args.vms} VMs: "
+            f"{received / duration / (1024 * 1024):.1f} MiB/s in total")
+    finally:
+        channel.close()
+        srv.stop(None)
+        hub.stop()
+
+if __name__ == "__main__":
+    main()
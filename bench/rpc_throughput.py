@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Measures how CreateVM/DeleteVM throughput and GetVMS latency scale with the
+# number of server workers. qemu-img, ip, ovs-vsctl and iptables are replaced
+# by fake binaries that only sleep, so the numbers reflect the server's
+# concurrency and not the host's disks or network.
+#
+# Usage: sudo ./IGS_venv/bin/python3 bench/rpc_throughput.py --workers 1 2 4 8
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+from compute.generated import compute_pb2, compute_pb2_grpc
+
+FAKE_TOOLS = ["qemu-img", "ip", "ovs-vsctl", "iptables"]
+
+def install_fake_binaries(bin_dir, delay):
+    for tool in FAKE_TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write(f"#!/bin/sh\nsleep {delay}\nexit 0\n")
+        os.chmod(path, 0o755)
+
+    sudo_path = os.path.join(bin_dir, "sudo")
+    with open(sudo_path, "w") as f:
+        f.write("#!/bin/sh\nexec \"$@\"\n")
+    os.chmod(sudo_path, 0o755)
+
+    os.environ["PATH"] = f"{bin_dir}:{os.environ['PATH']}"
+
+def run_round(workers, ops, clients, port):
+    srv = server.build_server(max_workers=workers, port=port)
+    srv.start()
+
+    channel = grpc.insecure_channel(f"localhost:{port}")
+    stub = compute_pb2_grpc.vmmStub(channel)
+
+    created = []
+    created_lock = threading.Lock()
+    list_latencies = []
+    done = threading.Event()
+
+    def create_and_delete(_):
+        vm_name = stub.CreateVM(compute_pb2.CreateVMRequest()).vm_name
+        if (vm_name == ""):
+            return
+        with created_lock:
+            created.append(vm_name)
+        stub.DeleteVM(compute_pb2.DeleteVMRequest(vm_name=vm_name))
+
+    def poll_vms():
+        while not done.is_set():
+            start = time.perf_counter()
+            stub.GetVMS(compute_pb2.GetVMSRequest(status="all"))
+            list_latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    poller = threading.Thread(target=poll_vms, daemon=True)
+    poller.start()
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(create_and_delete, range(ops)))
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    poller.join()
+    channel.close()
+    srv.stop(None)
+
+    if (len(created) != ops):
+        print(f"Only {len(created)}/{ops} VMs were created, is the base image present?")
+
+    p50 = statistics.median(list_latencies) * 1000 if list_latencies else 0.0
+    return ops / elapsed, p50
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataplane RPC throughput benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ops", type=int, default=32)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.05,
+        help="Seconds each fake binary sleeps")
+    parser.add_argument("--port", type=int, default=50061)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as bin_dir:
+        install_fake_binaries(bin_dir, args.delay)
+
+        print(f"{'workers':>8} {'create+delete/s':>16} {'GetVMS p50 ms':>14}")
+        for workers in args.workers:
+            rate, p50 = run_round(workers, args.ops, args.clients, args.port)
+            print(f"{workers:>8} {rate:>16.2f} {p50:>14.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Compares how long a VM takes until its guest agent answers when it is
+# booted cold with StartVM and when it is restored from a pre-booted
+# template with CreateVMFromTemplate. Unlike rpc_throughput.py this needs
+# the real QEMU, the image and KVM, since both paths are dominated by them.
+#
+# Usage: sudo ./IGS_venv/bin/python3 bench/template_restore.py --rounds 10
+
+import argparse
+import os
+import statistics
+import sys
+
+import grpc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+from compute.generated import compute_pb2, compute_pb2_grpc
+
+def cold_boot(stub, instance_type, image):
+    vm_name = stub.CreateVM(compute_pb2.CreateVMRequest(instance_type=instance_type, image=image)).vm_name
+    if (vm_name == ""):
+        raise Exception("CreateVM failed, is the image present?")
+
+    try:
+        request = compute_pb2.StartVMsRequest(vm_names=[vm_name], wait_for="agent")
+        response = next(stub.StartVMs(request))
+        if (not response.success):
+            raise Exception(f"StartVM failed: {response.error}")
+        return response.time_to_ready
+    finally:
+        stub.DeleteVM(compute_pb2.DeleteVMRequest(vm_name=vm_name))
+
+def template_restore(stub, instance_type, image):
+    request = compute_pb2.CreateVMFromTemplateRequest(instance_type=instance_type, image=image)
+    response = stub.CreateVMFromTemplate(request)
+    try:
+        if (response.error != ""):
+            raise Exception(f"CreateVMFromTemplate failed: {response.error}")
+        if (not response.from_template):
+            raise Exception("CreateVMFromTemplate booted cold, the template is not usable")
+        return response.time_to_ready
+    finally:
+        if (response.vm_name != ""):
+            stub.DeleteVM(compute_pb2.DeleteVMRequest(vm_name=response.vm_name))
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:>10} {statistics.median(samples):>10.3f} {p95:>10.3f} {samples[0]:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Template restore versus cold boot benchmark")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--instance-type", default="micro")
+    parser.add_argument("--image", default="")
+    parser.add_argument("--port", type=int, default=50062)
+    args = parser.parse_args()
+
+    srv = server.build_server(port=args.port)
+    srv.start()
+    channel = grpc.insecure_channel(f"localhost:{args.port}")
+    stub = compute_pb2_grpc.vmmStub(channel)
+
+    try:
+        request = compute_pb2.BuildTemplateRequest(image=args.image, instance_type=args.instance_type)
+        response = stub.BuildTemplate(request)
+        if (response.error != ""):
+            print(f"Failed to build template: {response.error}")
+            return
+        print(f"Template {response.name}: {response.state_size // (1024 * 1024)} MiB of state, "
+            f"built in {response.duration:.1f}s\n")
+
+        cold = [cold_boot(stub, args.instance_type, args.image) for _ in range(args.rounds)]
+        restored = [template_restore(stub, args.instance_type, args.image) for _ in range(args.rounds)]
+
+        print(f"{'seconds':>10} {'p50':>10} {'p95':>10} {'min':>10}")
+        summarize("cold boot", cold)
+        summarize("template", restored)
+    finally:
+        channel.close()
+        srv.stop(None)
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,23 @@ def print_compute_commands():
     print("Press 7 to get a VM's status")
     print("Press 8 to connect to a VM over serial")
     print("Press 9 to connect to a VM over SSH")
+    print("Press 10 to create multiple VMs")
+    print("Press 11 to show warm pool stats")
+    print("Press 12 to start all VMs that are down")
+    print("Press 13 to show host capacity")
+    print("Press 14 to list cached images")
+    print("Press 15 to pull an image")
+    print("Press 16 to build a base image from a cloud image")
+    print("Press 17 to hibernate a VM")
+    print("Press 18 to restore a hibernated VM")
+    print("Press 19 to clone a VM")
+    print("Press 20 to build a pre-booted template")
+    print("Press 21 to create a VM from a template")
+    print("Press 22 to migrate a VM to another server")
+    print("Press 23 to watch VM status changes")
+    print("Press 24 to list VMs with their details")
+    print("Press 25 to follow the console log of a VM")
+    print("Press 26 to run a command on VMs")
 
 def print_network_commands():
     print("\nThere are currently no network commands")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import threading
+
+from prometheus_client import Gauge
+
+CAPACITY_TOTAL = Gauge('igs_capacity_total', 'Allocatable host capacity', ['resource'])
+CAPACITY_COMMITTED = Gauge('igs_capacity_committed', 'Host capacity committed to VMs', ['resource'])
+CAPACITY_FREE = Gauge('igs_capacity_free', 'Host capacity still free for new VMs', ['resource'])
+
+RESOURCES = ["vcpus", "memory_mib"]
+
+def host_memory_mib(meminfo_path="/proc/meminfo"):
+    with open(meminfo_path, "r") as mf:
+        for line in mf:
+            if (line.startswith("MemTotal:")):
+                return int(line.split()[1]) // 1024
+    return 0
+
+class CapacityManager:
+
+    def __init__(self): ...
+    def reserve(self, vm_name, resources): ...
+    def release(self, vm_name): ...
+    def get_capacity(self): ...
+
+    def _update_metrics(self): ...
+
+    # Every VM that exists on the host, running or not, holds its instance
+    # type's resources so that starting it later can never overcommit the
+    # host beyond the configured ratios.
+    def __init__(self, cpu_overcommit=1.0, memory_overcommit=1.0, reserved_memory_mib=1024,
+                 host_vcpus=None, host_memory=None):
+        host_vcpus = host_vcpus if host_vcpus != None else (os.cpu_count() or 1)
+        host_memory = host_memory if host_memory != None else host_memory_mib()
+
+        self.total = {
+            "vcpus": int(host_vcpus * cpu_overcommit),
+            "memory_mib": int(max(host_memory - reserved_memory_mib, 0) * memory_overcommit),
+        }
+        self.committed = {resource: 0 for resource in RESOURCES}
+        self._reservations = {}
+        self._lock = threading.Lock()
+        self._update_metrics()
+
+    def reserve(self, vm_name, resources, force=False):
+        with self._lock:
+            if (vm_name in self._reservations):
+                return True
+
+            if (not force):
+                for resource in RESOURCES:
+                    if (self.committed[resource] + resources[resource] > self.total[resource]):
+                        return False
+
+            self._reservations[vm_name] = {resource: resources[resource] for resource in RESOURCES}
+            for resource in RESOURCES:
+                self.committed[resource] += resources[resource]
+
+        self._update_metrics()
+        return True
+
+    def release(self, vm_name):
+        with self._lock:
+            resources = self._reservations.pop(vm_name, None)
+            if (resources == None):
+                return
+            for resource in RESOURCES:
+                self.committed[resource] -= resources[resource]
+
+        self._update_metrics()
+
+    def get_capacity(self):
+        with self._lock:
+            return [{
+                "resource": resource,
+                "total": self.total[resource],
+                "committed": self.committed[resource],
+                "free": self.total[resource] - self.committed[resource],
+            } for resource in RESOURCES]
+
+    def _update_metrics(self):
+        for capacity in self.get_capacity():
+            CAPACITY_TOTAL.labels(resource=capacity["resource"]).set(capacity["total"])
+            CAPACITY_COMMITTED.labels(resource=capacity["resource"]).set(capacity["committed"])
+            CAPACITY_FREE.labels(resource=capacity["resource"]).set(capacity["free"])
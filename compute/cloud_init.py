@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import re
+import struct
+import threading
+import time
+
+SECTOR_SIZE = 2048
+
+USER_DATA_TEMPLATE = "compute/provisioning/vm_config/user-data"
+TEMPLATE_FIELDS = ["SSH_KEY", "MAC_ADDRESS", "IP_ADDRESS"]
+
+_template_cache = {}
+_template_cache_lock = threading.Lock()
+
+class CloudInitTemplate:
+
+    def __init__(self): ...
+    def render(self, values): ...
+
+    # The template is split once into literal text and field names so that
+    # rendering is a single join instead of one replace pass per field.
+    def __init__(self, template_path=USER_DATA_TEMPLATE, fields=TEMPLATE_FIELDS):
+        with open(template_path, "r") as tf:
+            data = tf.read()
+
+        field_regex = re.compile("(" + "|".join(re.escape(f) for f in fields) + ")")
+        self.fields = set(fields)
+        self.segments = field_regex.split(data)
+
+    def render(self, values):
+        parts = []
+        for segment in self.segments:
+            if (segment in self.fields):
+                parts.append(values.get(segment, segment))
+            else:
+                parts.append(segment)
+        return "".join(parts)
+
+def get_template(template_path=USER_DATA_TEMPLATE):
+    mtime = os.stat(template_path).st_mtime_ns
+
+    with _template_cache_lock:
+        cached = _template_cache.get(template_path)
+        if (cached != None and cached[0] == mtime):
+            return cached[1]
+
+    template = CloudInitTemplate(template_path)
+
+    with _template_cache_lock:
+        _template_cache[template_path] = (mtime, template)
+
+    return template
+
+def render_user_data(ssh_key="", mac_address="", ip_address=""):
+    return get_template().render({
+        "SSH_KEY": f"- {ssh_key}",
+        "MAC_ADDRESS": mac_address,
+        "IP_ADDRESS": ip_address,
+    })
+
+def render_meta_data(instance_id, hostname="ubuntu"):
+    return f"instance-id: {instance_id}\nlocal-hostname: {hostname}\n"
+
+def _both_16(value):
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+def _both_32(value):
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+def _pad(data, length, fill=b" "):
+    return data[:length] + fill * (length - len(data[:length]))
+
+def _joliet_pad(text, length):
+    data = text.encode("utf-16-be")[:length]
+    return data + b"\x00 " * ((length - len(data)) // 2) + b" " * ((length - len(data)) % 2)
+
+def _dir_datetime(now):
+    return bytes([now.tm_year - 1900, now.tm_mon, now.tm_mday,
+                  now.tm_hour, now.tm_min, now.tm_sec, 0])
+
+def _volume_datetime(now):
+    return time.strftime("%Y%m%d%H%M%S00", now).encode() + b"\x00"
+
+def _dir_record(identifier, extent, size, now, is_dir=False):
+    pad = b"\x00" if (len(identifier) % 2 == 0) else b""
+    record_len = 33 + len(identifier) + len(pad)
+    return (bytes([record_len, 0]) + _both_32(extent) + _both_32(size) +
+            _dir_datetime(now) + bytes([2 if is_dir else 0, 0, 0]) +
+            _both_16(1) + bytes([len(identifier)]) + identifier + pad)
+
+def _path_table(extent, big_endian=False):
+    fmt = ">" if big_endian else "<"
+    return bytes([1, 0]) + struct.pack(f"{fmt}I", extent) + struct.pack(f"{fmt}H", 1) + b"\x00\x00"
+
+def _iso9660_name(name):
+    base, _, ext = name.upper().partition(".")
+    base = re.sub(r"[^A-Z0-9_]", "_", base)[:8]
+    ext = re.sub(r"[^A-Z0-9_]", "_", ext)[:3]
+    return f"{base}.{ext};1".encode()
+
+def _volume_descriptor(vd_type, volume_id, total_sectors, path_table_l, path_table_m,
+                       root_record, now, joliet=False):
+    text = (lambda s, n: _joliet_pad(s, n)) if joliet else (lambda s, n: _pad(s.encode(), n))
+
+    vd = bytes([vd_type]) + b"CD001" + bytes([1, 0])
+    vd += text("LINUX", 32)
+    vd += text(volume_id, 32)
+    vd += b"\x00" * 8
+    vd += _both_32(total_sectors)
+    vd += _pad(b"%/E" if joliet else b"", 32, b"\x00")
+    vd += _both_16(1) + _both_16(1) + _both_16(SECTOR_SIZE)
+    vd += _both_32(10)
+    vd += struct.pack("<I", path_table_l) + struct.pack("<I", 0)
+    vd += struct.pack(">I", path_table_m) + struct.pack(">I", 0)
+    vd += root_record
+    vd += text("", 128) + text("", 128) + text("", 128) + text("IGS", 128)
+    vd += text("", 37) + text("", 37) + text("", 37)
+    vd += _volume_datetime(now) + _volume_datetime(now)
+    vd += b"0" * 16 + b"\x00" + _volume_datetime(now)
+    vd += bytes([1, 0])
+    return _pad(vd, SECTOR_SIZE, b"\x00")
+
+# Builds an ISO9660 image with Joliet names, which is what cloud-init's
+# NoCloud datasource expects when volume_id is "cidata".
+def build_seed_iso(files, volume_id="cidata"):
+    now = time.gmtime()
+    names = sorted(files.keys())
+
+    pvd_sector = 16
+    svd_sector = 17
+    terminator_sector = 18
+    path_tables = [19, 20, 21, 22]
+    primary_root_sector = 23
+    joliet_root_sector = 24
+
+    extents = {}
+    next_sector = 25
+    for name in names:
+        extents[name] = next_sector
+        next_sector += max(1, (len(files[name]) + SECTOR_SIZE - 1) // SECTOR_SIZE)
+    total_sectors = next_sector
+
+    def root_directory(root_sector, file_ids):
+        records = _dir_record(b"\x00", root_sector, SECTOR_SIZE, now, is_dir=True)
+        records += _dir_record(b"\x01", root_sector, SECTOR_SIZE, now, is_dir=True)
+        for file_id, name in sorted(file_ids):
+            records += _dir_record(file_id, extents[name], len(files[name]), now)
+        return _pad(records, SECTOR_SIZE, b"\x00")
+
+    primary_root = root_directory(primary_root_sector, [(_iso9660_name(n), n) for n in names])
+    joliet_root = root_directory(joliet_root_sector, [(n.encode("utf-16-be"), n) for n in names])
+
+    image = bytearray(SECTOR_SIZE * 16)
+    image += _volume_descriptor(1, volume_id, total_sectors, path_tables[0], path_tables[1],
+        _dir_record(b"\x00", primary_root_sector, SECTOR_SIZE, now, is_dir=True), now)
+    image += _volume_descriptor(2, volume_id, total_sectors, path_tables[2], path_tables[3],
+        _dir_record(b"\x00", joliet_root_sector, SECTOR_SIZE, now, is_dir=True), now, joliet=True)
+    image += _pad(bytes([255]) + b"CD001" + bytes([1]), SECTOR_SIZE, b"\x00")
+
+    for root_sector in [primary_root_sector, joliet_root_sector]:
+        image += _pad(_path_table(root_sector), SECTOR_SIZE, b"\x00")
+        image += _pad(_path_table(root_sector, big_endian=True), SECTOR_SIZE, b"\x00")
+
+    image += primary_root
+    image += joliet_root
+
+    for name in names:
+        data = files[name]
+        sectors = max(1, (len(data) + SECTOR_SIZE - 1) // SECTOR_SIZE)
+        image += _pad(data, sectors * SECTOR_SIZE, b"\x00")
+
+    return bytes(image)
+
+def write_file(path, data, mode=0o644):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
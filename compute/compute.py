@@ -4,14 +4,15 @@
 
 # SPDX-License-Identifier: BSD-3-Clause
 
+import json
 import time
-import socket
 import select
 import sys
 import threading
-import os
 import subprocess
 
+import grpc
+
 from .generated import compute_pb2, compute_pb2_grpc
 from network.generated import network_pb2, network_pb2_grpc
 
@@ -40,14 +41,51 @@ def pick_vm(stub=None, status=None, action=""):
 
     return vm_names[vm_num]
 
+def pick_instance_type(stub=None):
+    response = stub.GetInstanceTypes(compute_pb2.GetInstanceTypesRequest())
+    instance_types = response.instance_types
+
+    print("Input the instance type of the VM (default micro):")
+    for i in range(1, len(instance_types) + 1):
+        it = instance_types[i-1]
+        print(f"{i}: {it.name} ({it.vcpus} vCPUs, {it.memory_mib} MiB)")
+
+    choice = input("\n")
+    print("")
+    if (choice.isdigit() and 0 < int(choice) <= len(instance_types)):
+        return instance_types[int(choice) - 1].name
+
+    return "micro"
+
+def pick_image(stub=None):
+    response = stub.GetImages(compute_pb2.GetImagesRequest())
+    images = [image for image in response.images if image.format != "iso"]
+    if (len(images) <= 1):
+        return ""
+
+    print("Input the image of the VM (default base image):")
+    for i in range(1, len(images) + 1):
+        print(f"{i}: {images[i-1].name}")
+
+    choice = input("\n")
+    print("")
+    if (choice.isdigit() and 0 < int(choice) <= len(images)):
+        return images[int(choice) - 1].name
+
+    return ""
+
 def process_compute_command(cmd="", compute_stub=None, network_stub=None):
     print("")
     if (cmd == "1"):
-        request = compute_pb2.CreateVMRequest()
+        instance_type = pick_instance_type(stub=compute_stub)
+        image = pick_image(stub=compute_stub)
+
+        request = compute_pb2.CreateVMRequest(instance_type=instance_type, image=image)
         response = compute_stub.CreateVM(request)
         if(response.vm_name == ""):
             print(f"Failed to create VM. You must first create the base ubuntu image in order to generate a VM based off of it.")
             print(f"Please follow the creating_base_ubuntu_image guide in the documentation.")
+            print(f"If the image exists, the host may not have enough free capacity for a {instance_type} VM.")
         else:
             print(f"VM Created: {response.vm_name}")
 
@@ -116,42 +154,36 @@ def process_compute_command(cmd="", compute_stub=None, network_stub=None):
         if (vm_name == ""):
             return
 
-        request = compute_pb2.StartPTYConnectionRequest(vm_name=vm_name)
-        response = compute_stub.StartPTYConnection(request)
-
-        print("Connecting to server\n")
-
-        time.sleep(1)
+        stop = threading.Event()
+        logged_out = threading.Event()
 
-        client = socket.socket()
-        client.connect(("0.0.0.0", 9001))
-
-        client.send(b"\n")
+        def console_input():
+            yield compute_pb2.ConsoleInput(vm_name=vm_name, data=b"\n")
+            while not stop.is_set():
+                fds, _, _ = select.select([sys.stdin], [], [], 0.1)
+                if (fds):
+                    data = sys.stdin.buffer.read1(4096)
+                    if data:
+                        yield compute_pb2.ConsoleInput(data=data)
+            yield compute_pb2.ConsoleInput(data=b"exit\n\n")
+            logged_out.set()
 
         print("Connected to server, patching you into the VM\n")
 
-        continue_processing = True
-        while continue_processing:
-            try:
-                fds, _, _ = select.select([sys.stdin, client], [], [], 0.1)
-                for fd in fds:
-                    if fd is sys.stdin:
-                        data = sys.stdin.buffer.read1(1024)
-                        if data:
-                            client.send(data)
-
-                    else:
-                        data = client.recv(1024)
-                        if data:
-                            sys.stdout.buffer.write(data)
-                        sys.stdout.buffer.flush()
-
-            except KeyboardInterrupt:
-                client.send(b"exit\n\n")
-                print("\n")
-                continue_processing = False
-
-        client.close()
+        responses = compute_stub.Console(console_input())
+        try:
+            for response in responses:
+                sys.stdout.buffer.write(response.data)
+                sys.stdout.buffer.flush()
+        except KeyboardInterrupt:
+            stop.set()
+            logged_out.wait(1.0)
+            print("\n")
+        except grpc.RpcError as e:
+            print(f"\nConsole closed: {e.details()}\n")
+        finally:
+            stop.set()
+            responses.cancel()
 
     elif (cmd == "9"):
         vm_name = pick_vm(stub=compute_stub, status=5, action="connect to over SSH")
@@ -169,33 +201,396 @@ def process_compute_command(cmd="", compute_stub=None, network_stub=None):
         print("Run the following command in another shell or this one after exiting the dataplane client:\n")
         print(' '.join(ssh_command))
 
+    elif (cmd == "10"):
+        count = int(input("How many VMs do you want to create?\n"))
+        instance_type = pick_instance_type(stub=compute_stub)
+        image = pick_image(stub=compute_stub)
+
+        request = compute_pb2.CreateVMsRequest(count=count, instance_type=instance_type, image=image)
+        created = 0
+        for response in compute_stub.CreateVMs(request):
+            if (response.success):
+                created += 1
+                print(f"VM Created: {response.vm_name} ({response.duration:.2f}s)")
+            else:
+                print(f"Failed to create VM {response.vm_name}: {response.error}")
+
+        print(f"\nCreated {created}/{count} VMs")
+
+    elif (cmd == "11"):
+        response = compute_stub.GetWarmPoolStats(compute_pb2.GetWarmPoolStatsRequest())
+        if (len(response.pools) == 0):
+            print("The warm pool is not enabled")
+            return
+
+        for pool in response.pools:
+            print(f"{pool.instance_type}: {pool.size}/{pool.target} ready, {pool.hits} hits, {pool.misses} misses")
+
+    elif (cmd == "12"):
+        request = compute_pb2.GetVMSRequest(status="down")
+        vm_names = list(compute_stub.GetVMS(request).vm_names)
+        if (len(vm_names) == 0):
+            print("No VMs to start")
+            return
+
+        request = compute_pb2.StartVMsRequest(vm_names=vm_names, wait_for="qmp")
+        for response in compute_stub.StartVMs(request):
+            if (response.success):
+                print(f"VM Started: {response.vm_name} (ready in {response.time_to_ready:.2f}s)")
+            else:
+                print(f"Failed to start VM {response.vm_name}: {response.error}")
+
+    elif (cmd == "13"):
+        response = compute_stub.GetCapacity(compute_pb2.GetCapacityRequest())
+        for capacity in response.resources:
+            print(f"{capacity.resource}: {capacity.committed}/{capacity.total} committed, {capacity.free} free")
+
+    elif (cmd == "14"):
+        response = compute_stub.GetImages(compute_pb2.GetImagesRequest())
+        if (len(response.images) == 0):
+            print("No images cached")
+            return
+
+        for image in response.images:
+            print(f"{image.name}: {image.format}, {image.size // (1024 * 1024)} MiB, sha256 {image.sha256[:12]}")
+
+    elif (cmd == "15"):
+        name = input("Image name (e.g. ubuntu-24.04-cloud):\n")
+        url = input("Image URL (leave empty for a known image):\n")
+        sha256 = input("SHA-256 (optional):\n") if url else ""
+        print("")
+
+        request = compute_pb2.PullImageRequest(name=name, url=url, sha256=sha256)
+        response = compute_stub.PullImage(request)
+        if (response.error != ""):
+            print(f"Failed to pull image {name}: {response.error}")
+        else:
+            print(f"Image pulled: {response.name} (sha256 {response.sha256[:12]})")
+
+    elif (cmd == "16"):
+        name = input("Name of the new base image (e.g. ubuntu-24.04):\n")
+        source = input("Cloud image to build it from (default ubuntu-24.04-cloud):\n") or "ubuntu-24.04-cloud"
+        print("")
+
+        request = compute_pb2.BuildImageRequest(name=name, source=source)
+        build_id = compute_stub.BuildImage(request).build_id
+
+        while True:
+            builds = compute_stub.GetImageBuilds(compute_pb2.GetImageBuildsRequest()).builds
+            build = next(build for build in builds if build.build_id == build_id)
+            print(f"\r{build.state} {build.stage} {build.progress:5.1f}%".ljust(40), end="", flush=True)
+            if (build.state in ["done", "failed"]):
+                break
+            time.sleep(1)
+        print("")
+
+        if (build.state == "failed"):
+            print(f"Failed to build image {name}: {build.error}")
+        else:
+            print(f"Image built: {name} ({build.duration:.0f}s)")
+
+    elif (cmd == "17"):
+        vm_name = pick_vm(stub=compute_stub, status="running", action="hibernate")
+        if (vm_name == ""):
+            return
+        response = compute_stub.HibernateVM(compute_pb2.HibernateVMRequest(vm_name=vm_name))
+        if (response.error != ""):
+            print(f"Failed to hibernate VM {vm_name}: {response.error}")
+        else:
+            print(f"VM Hibernated: {vm_name} ({response.memory_size // (1024 * 1024)} MiB of memory saved "
+                f"as {response.state_size // (1024 * 1024)} MiB in {response.duration:.2f}s)")
+
+    elif (cmd == "18"):
+        vm_name = pick_vm(stub=compute_stub, status="hibernated", action="restore")
+        if (vm_name == ""):
+            return
+        response = compute_stub.RestoreVM(compute_pb2.RestoreVMRequest(vm_name=vm_name))
+        if (response.error != ""):
+            print(f"Failed to restore VM {vm_name}: {response.error}")
+        else:
+            print(f"VM Restored: {vm_name} ({response.state_size // (1024 * 1024)} MiB "
+                f"loaded in {response.duration:.2f}s)")
+
+    elif (cmd == "19"):
+        source_vm = pick_vm(stub=compute_stub, status="all", action="clone")
+        if (source_vm == ""):
+            return
+        count = int(input("How many clones do you want to create?\n"))
+
+        request = compute_pb2.CloneVMRequest(source_vm=source_vm, count=count)
+        created = 0
+        for response in compute_stub.CloneVM(request):
+            if (response.success):
+                created += 1
+                print(f"VM Cloned: {response.vm_name} ({response.duration:.2f}s)")
+            else:
+                print(f"Failed to clone VM {response.vm_name or source_vm}: {response.error}")
+
+        print(f"\nCreated {created}/{count} clones of {source_vm}")
+
+    elif (cmd == "20"):
+        instance_type = pick_instance_type(stub=compute_stub)
+        image = pick_image(stub=compute_stub)
+        print("Booting the template VM, this takes a minute or two\n")
+
+        request = compute_pb2.BuildTemplateRequest(image=image, instance_type=instance_type)
+        response = compute_stub.BuildTemplate(request)
+        if (response.error != ""):
+            print(f"Failed to build template: {response.error}")
+        else:
+            print(f"Template built: {response.name} (cold boot {response.boot_time:.2f}s, "
+                f"{response.state_size // (1024 * 1024)} MiB of state)")
+
+    elif (cmd == "21"):
+        templates = compute_stub.GetTemplates(compute_pb2.GetTemplatesRequest()).templates
+        for template in templates:
+            print(f"{template.name}: cold boot {template.boot_time:.2f}s, "
+                f"{template.state_size // (1024 * 1024)} MiB of state")
+        if (len(templates) == 0):
+            print("No templates yet, the first VM boots cold while its template is built")
+        print("")
+
+        instance_type = pick_instance_type(stub=compute_stub)
+        image = pick_image(stub=compute_stub)
+
+        request = compute_pb2.CreateVMFromTemplateRequest(instance_type=instance_type, image=image)
+        response = compute_stub.CreateVMFromTemplate(request)
+        if (response.error != ""):
+            print(f"Failed to create VM: {response.error}")
+        elif (response.from_template):
+            print(f"VM Restored: {response.vm_name} (ready in {response.time_to_ready:.2f}s, "
+                f"cold boot {response.cold_boot_time:.2f}s)")
+        else:
+            print(f"VM Booted: {response.vm_name} (ready in {response.time_to_ready:.2f}s)")
+
+    elif (cmd == "22"):
+        vm_name = pick_vm(stub=compute_stub, status="running", action="migrate")
+        if (vm_name == ""):
+            return
+        target_endpoint = input("Enter the target server (host:port): ").strip()
+        request = compute_pb2.MigrateVMRequest(vm_name=vm_name, target_endpoint=target_endpoint)
+        response = compute_stub.MigrateVM(request)
+        if (response.error != ""):
+            print(f"Failed to migrate VM {vm_name}: {response.error}")
+        else:
+            print(f"VM Migrated: {vm_name} to {target_endpoint} ({response.transferred // (1024 * 1024)} MiB "
+                f"in {response.duration:.2f}s, {response.downtime_ms}ms downtime)")
+
+    elif (cmd == "23"):
+        print("Watching VMs, press ctrl-c to stop\n")
+        try:
+            for event in compute_stub.WatchVMs(compute_pb2.WatchVMsRequest()):
+                if (event.type == "SYNCED"):
+                    print("")
+                elif (event.type != "RESET"):
+                    print(f"{event.type:<8} {event.vm_name} {event.status}")
+        except KeyboardInterrupt:
+            print("")
+
+    elif (cmd == "24"):
+        request = compute_pb2.DescribeVMsRequest(status=input("Enter a status to list, or nothing for all: ").strip())
+        print(f"\n{'name':<38} {'status':<14} {'ip address':<16} {'type':<8} {'pid':>8}  disks")
+        while True:
+            response = compute_stub.DescribeVMs(request)
+            for vm in response.vms:
+                print(f"{vm.name:<38} {vm.status:<14} {vm.ip_address:<16} {vm.instance_type:<8} "
+                    f"{vm.pid or '':>8}  {','.join(vm.disks)}")
+            if (response.next_page_token == ""):
+                break
+            request.page_token = response.next_page_token
+        print("")
+
+    elif (cmd == "25"):
+        vm_name = pick_vm(stub=compute_stub, status="all", action="read the console log of")
+        if (vm_name == ""):
+            return
+
+        request = compute_pb2.GetConsoleLogRequest(vm_name=vm_name, tail=64 * 1024, follow=True)
+        print("Following the console log, press ctrl-c to stop\n")
+        responses = compute_stub.GetConsoleLog(request)
+        try:
+            for chunk in responses:
+                sys.stdout.buffer.write(chunk.data)
+                sys.stdout.buffer.flush()
+        except KeyboardInterrupt:
+            responses.cancel()
+            print("\n")
+
+    elif (cmd == "26"):
+        vm_names = [vm_name.strip() for vm_name in input("Enter VM names separated by commas, or nothing for all "
+            "running VMs: ").split(",") if vm_name.strip()]
+        if (len(vm_names) == 0):
+            vm_names = compute_stub.GetVMS(compute_pb2.GetVMSRequest(status="running")).vm_names
+        script = input("Enter the command to run: ")
+        print("")
+
+        request = compute_pb2.ExecVMsRequest(vm_names=vm_names, script=script)
+        for response in compute_stub.ExecVMs(request):
+            if (not response.success):
+                print(f"{response.vm_name}: failed: {response.error}\n")
+                continue
+            print(f"{response.vm_name}: exit code {response.exit_code} in {response.duration:.2f}s")
+            sys.stdout.buffer.write(response.stdout + response.stderr)
+            print("")
+
     else:
         print("Exiting")
 
+# Every watcher and console session holds a server thread for as long as
+# it is connected, so the number of them is bounded separately from the
+# unary RPCs.
+DEFAULT_MAX_WATCHERS = 64
+DEFAULT_MAX_CONSOLES = 32
+
 class VMMServicer(compute_pb2_grpc.vmmServicer):
 
-    def __init__(self):
-        self.server_socket = None
+    def __init__(self, max_watchers=DEFAULT_MAX_WATCHERS, max_consoles=DEFAULT_MAX_CONSOLES):
+        self._watchers = threading.BoundedSemaphore(max_watchers)
+        self._consoles = threading.BoundedSemaphore(max_consoles)
 
-    def setup_vm_manager(self, network_manager):
-        self.vm_manager = VMManager(network_manager=network_manager)
+    def setup_vm_manager(self, network_manager, **options):
+        self.vm_manager = VMManager(network_manager=network_manager, **options)
 
     def GetVMS(self, request, context):
         response = self.vm_manager.get_vms(request.status)
         return compute_pb2.GetVMSResponse(vm_names=response)
 
     def CreateVM(self, request, context):
-        response = self.vm_manager.create_vm()
+        response = self.vm_manager.create_vm(instance_type=request.instance_type or "micro",
+            image=request.image)
+        if (response != "" and len(request.labels) > 0):
+            self.vm_manager.set_vm_labels(vm_name=response, labels=dict(request.labels))
         return compute_pb2.CreateVMResponse(vm_name=response)
 
+    def CreateVMs(self, request, context):
+        for result in self.vm_manager.create_vms(count=request.count, instance_type=request.instance_type,
+                image=request.image):
+            yield compute_pb2.CreateVMsResponse(vm_name=result["vm_name"],
+                success=(result["error"] == ""), error=result["error"],
+                duration=result["duration"])
+
+    def GetWarmPoolStats(self, request, context):
+        pools = [compute_pb2.WarmPoolStats(**stats) for stats in self.vm_manager.get_warm_pool_stats()]
+        return compute_pb2.GetWarmPoolStatsResponse(pools=pools)
+
+    def GetInstanceTypes(self, request, context):
+        instance_types = [compute_pb2.InstanceType(name=it["name"], vcpus=it["vcpus"],
+            memory_mib=it["memory_mib"]) for it in self.vm_manager.get_instance_types()]
+        return compute_pb2.GetInstanceTypesResponse(instance_types=instance_types)
+
+    def GetCapacity(self, request, context):
+        resources = [compute_pb2.ResourceCapacity(**capacity) for capacity in self.vm_manager.get_capacity()]
+        return compute_pb2.GetCapacityResponse(resources=resources)
+
+    def GetImages(self, request, context):
+        images = [compute_pb2.Image(name=image["name"], sha256=image["sha256"], format=image["format"],
+            size=image["size"]) for image in self.vm_manager.get_images()]
+        return compute_pb2.GetImagesResponse(images=images)
+
+    def PullImage(self, request, context):
+        try:
+            image = self.vm_manager.pull_image(request.name, url=request.url, sha256=request.sha256,
+                image_format=request.format or "qcow2")
+        except Exception as e:
+            return compute_pb2.PullImageResponse(name=request.name, error=str(e))
+        return compute_pb2.PullImageResponse(name=image["name"], sha256=image["sha256"])
+
+    def BuildImage(self, request, context):
+        build_id = self.vm_manager.build_image(request.name, request.source)
+        return compute_pb2.BuildImageResponse(build_id=build_id)
+
+    def GetImageBuilds(self, request, context):
+        builds = [compute_pb2.ImageBuild(build_id=build["build_id"], name=build["name"],
+            source=build["source"], state=build["state"], stage=build["stage"],
+            progress=build["progress"], error=build["error"], duration=build["duration"])
+            for build in self.vm_manager.get_image_builds()]
+        return compute_pb2.GetImageBuildsResponse(builds=builds)
+
+    def HibernateVM(self, request, context):
+        result = self.vm_manager.hibernate_vm(vm_name=request.vm_name)
+        return compute_pb2.HibernateVMResponse(**result)
+
+    def RestoreVM(self, request, context):
+        result = self.vm_manager.restore_vm(vm_name=request.vm_name)
+        return compute_pb2.RestoreVMResponse(**result)
+
+    def CloneVM(self, request, context):
+        for result in self.vm_manager.clone_vms(source_vm=request.source_vm, count=request.count or 1,
+                instance_type=request.instance_type):
+            yield compute_pb2.CloneVMResponse(vm_name=result["vm_name"],
+                success=(result["error"] == ""), error=result["error"],
+                duration=result["duration"])
+
+    def BuildTemplate(self, request, context):
+        result = self.vm_manager.build_template(image=request.image, instance_type=request.instance_type)
+        return compute_pb2.BuildTemplateResponse(**result)
+
+    def GetTemplates(self, request, context):
+        templates = [compute_pb2.Template(name=template["name"], image=template["image"],
+            instance_type=template["instance_type"], boot_time=template["boot_time"],
+            state_size=template["state_size"]) for template in self.vm_manager.get_templates()]
+        return compute_pb2.GetTemplatesResponse(templates=templates)
+
+    def DeleteTemplate(self, request, context):
+        response = self.vm_manager.delete_template(name=request.name)
+        return compute_pb2.DeleteTemplateResponse(name=response)
+
+    def CreateVMFromTemplate(self, request, context):
+        result = self.vm_manager.create_vm_from_template(instance_type=request.instance_type,
+            image=request.image)
+        return compute_pb2.CreateVMFromTemplateResponse(**result)
+
+    def MigrateVM(self, request, context):
+        result = self.vm_manager.migrate_vm(vm_name=request.vm_name, target_endpoint=request.target_endpoint)
+        return compute_pb2.MigrateVMResponse(**result)
+
+    def PrepareMigration(self, request, context):
+        result = self.vm_manager.prepare_incoming_migration(vm_record=json.loads(request.vm_record),
+            files=dict(request.files), backing_file=request.backing_file,
+            backing_format=request.backing_format, disk_size=request.disk_size)
+        return compute_pb2.PrepareMigrationResponse(**result)
+
+    def FinishMigration(self, request, context):
+        error = self.vm_manager.finish_incoming_migration(vm_name=request.vm_name, success=request.success,
+            running=request.running)
+        return compute_pb2.FinishMigrationResponse(error=error)
+
+    def WatchVMs(self, request, context):
+        if (not self._watchers.acquire(blocking=False)):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many watchers")
+
+        try:
+            for event in self.vm_manager.watch_vms(resource_version=request.resource_version,
+                    is_active=context.is_active):
+                yield compute_pb2.VMEvent(**event)
+        finally:
+            self._watchers.release()
+
+    def DescribeVMs(self, request, context):
+        vms, next_page_token = self.vm_manager.describe_vms(status=request.status, labels=dict(request.labels),
+            page_token=request.page_token, page_size=request.page_size)
+        return compute_pb2.DescribeVMsResponse(vms=[compute_pb2.VMRecord(**vm) for vm in vms],
+            next_page_token=next_page_token)
+
+    def SetVMLabels(self, request, context):
+        success = self.vm_manager.set_vm_labels(vm_name=request.vm_name, labels=dict(request.labels))
+        return compute_pb2.SetVMLabelsResponse(success=success)
+
     def DeleteVM(self, request, context):
         response = self.vm_manager.delete_vm(vm_name=request.vm_name)
         return compute_pb2.DeleteVMResponse(vm_name=request.vm_name)
 
     def StartVM(self, request, context):
-        response = self.vm_manager.start_vm(vm_name=request.vm_name)
+        response = self.vm_manager.start_vm(vm_name=request.vm_name, wait_for=request.wait_for or "qmp")
         return compute_pb2.StartVMResponse(vm_name=request.vm_name)
 
+    def StartVMs(self, request, context):
+        for result in self.vm_manager.start_vms(vm_names=list(request.vm_names),
+                                                wait_for=request.wait_for or "qmp"):
+            yield compute_pb2.StartVMsResponse(vm_name=result["vm_name"],
+                success=(result["error"] == ""), error=result["error"],
+                time_to_ready=result["time_to_ready"])
+
     def ShutdownVM(self, request, context):
         response = self.vm_manager.shutdown_vm(vm_name=request.vm_name)
         return compute_pb2.ShutdownVMResponse(vm_name=request.vm_name)
@@ -212,46 +607,69 @@ class VMMServicer(compute_pb2_grpc.vmmServicer):
         response = self.vm_manager.get_vm_status(vm_name=request.vm_name)
         return compute_pb2.GetVMStatusResponse(vm_status=response)
 
-    def run_pty_connection(self, client, pty_path):
-        pty = os.open(pty_path, os.O_RDWR | os.O_NONBLOCK)
-        while True:
-            try:
-                fds, _, _ = select.select([client, pty], [], [], 0.1)
-                for fd in fds:
-                    if fd is client:
-                        data = client.recv(1024)
-                        if data:
-                            os.write(pty, data)
-                    else:
-                        data = os.read(pty, 1024)
-                        if data:
-                            client.send(data)
-            except:
-                break
-
-    def StartPTYConnection(self, request, context):
-        vm_conn = self.vm_manager._vms[request.vm_name]["instance"]
-
-        def pty_server():
-            if (self.server_socket== None):
-                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                server.bind(("0.0.0.0", 9001))
-                server.listen(1)
-                self.server_socket = server
-
-            try:
-                print("Waiting for connection from client\n")
-                client, addr = self.server_socket.accept()
-                print("Accepted connection\n")
-                self.run_pty_connection(client, vm_conn.serial_conn)
-
-            except socket.error:
-                pass
-
-        thread = threading.Thread(target=pty_server)
-        thread.daemon = True
-        thread.start()
-
-        return compute_pb2.StartPTYConnectionResponse(vm_name=request.vm_name)
+    # The first message names the VM, later ones carry keystrokes. Output is
+    # sent as it arrives, batched into one message per wakeup.
+    def Console(self, request_iterator, context):
+        if (not self._consoles.acquire(blocking=False)):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many console sessions")
+
+        session = None
+        try:
+            request = next(request_iterator, None)
+            if (request == None):
+                return
+            session = self.vm_manager.open_console(vm_name=request.vm_name, read_only=request.read_only)
+            if (session == None):
+                context.abort(grpc.StatusCode.FAILED_PRECONDITION, f"VM {request.vm_name} is not running")
+            # Ends the session as soon as the client goes away instead of
+            # after the next read times out.
+            context.add_callback(session.close)
+            if (request.data):
+                session.write(request.data)
+
+            input_thread = threading.Thread(target=self._forward_console_input, args=(request_iterator, session),
+                name="console-input", daemon=True)
+            input_thread.start()
+
+            while context.is_active():
+                data = session.read(timeout=1.0)
+                if (data == None):
+                    break
+                if (data):
+                    yield compute_pb2.ConsoleOutput(data=data)
+
+            if (session.error != ""):
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, session.error)
+        finally:
+            if (session != None):
+                session.close()
+            self._consoles.release()
+
+    def GetConsoleLog(self, request, context):
+        if (request.follow and not self._consoles.acquire(blocking=False)):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many console sessions")
+
+        try:
+            for chunk in self.vm_manager.get_console_log(vm_name=request.vm_name, offset=request.offset,
+                    tail=request.tail, follow=request.follow, is_active=context.is_active):
+                yield compute_pb2.ConsoleLogChunk(**chunk)
+        finally:
+            if (request.follow):
+                self._consoles.release()
+
+    def ExecVMs(self, request, context):
+        for result in self.vm_manager.exec_vms(vm_names=list(request.vm_names), labels=dict(request.labels),
+                script=request.script, input_data=request.input, timeout=request.timeout or 60.0,
+                is_active=context.is_active):
+            yield compute_pb2.ExecVMsResponse(vm_name=result["vm_name"], success=(result["error"] == ""),
+                error=result["error"], exit_code=result["exit_code"], stdout=result["stdout"],
+                stderr=result["stderr"], duration=result["duration"])
+
+    def _forward_console_input(self, request_iterator, session):
+        try:
+            for request in request_iterator:
+                if (request.data):
+                    session.write(request.data)
+        except Exception:
+            pass
 
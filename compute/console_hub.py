@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import collections
+import errno
+import os
+import selectors
+import threading
+import tty
+
+# Serial output is read in chunks of up to this size, and a session's
+# unread output is sent to its client as one message.
+CONSOLE_READ_SIZE = 64 * 1024
+
+# Output a session may have queued before it counts as fallen behind.
+CONSOLE_MAX_BACKLOG = 1024 * 1024
+
+# Serial output kept in memory per VM, and the size of each file it is
+# spilled to when spilling is enabled.
+CONSOLE_LOG_SIZE = 256 * 1024
+CONSOLE_LOG_FILE_SIZE = 4 * 1024 * 1024
+
+class ConsoleLog:
+
+    def __init__(self): ...
+    def append(self, data): ...
+    def read(self, offset, max_size): ...
+    def wait(self, offset, timeout): ...
+    def end(self): ...
+    def close(self): ...
+
+    def _spill(self, data): ...
+
+    # The last size bytes of a VM's serial output in a ring buffer that is
+    # allocated once. Offsets count every byte since the log was created,
+    # so a reader can continue from where it left off and tell how much it
+    # missed. With spill_path set, the output is also appended to that file
+    # and rotated through up to files files of file_size bytes each.
+    def __init__(self, size=CONSOLE_LOG_SIZE, spill_path="", files=0, file_size=CONSOLE_LOG_FILE_SIZE):
+        self._buffer = bytearray(size)
+        self._size = size
+        self._end = 0
+        self._cond = threading.Condition()
+        self.closed = False
+        self._spill_path = spill_path if files > 0 else ""
+        self._files = files
+        self._file_size = file_size
+        self._spill_file = None
+
+    def append(self, data):
+        with self._cond:
+            kept = memoryview(data)[-self._size:]
+            start = (self._end + len(data) - len(kept)) % self._size
+            first = min(len(kept), self._size - start)
+            self._buffer[start:start + first] = kept[:first]
+            self._buffer[:len(kept) - first] = kept[first:]
+            self._end += len(data)
+            self._cond.notify_all()
+
+        if (self._spill_path != ""):
+            self._spill(data)
+
+    # Returns up to max_size bytes starting at offset, or at the oldest byte
+    # still kept if offset is older, with the offsets they span.
+    def read(self, offset, max_size=CONSOLE_READ_SIZE):
+        with self._cond:
+            start = min(max(offset, self._end - self._size, 0), self._end)
+            end = min(self._end, start + max_size)
+            ring_start = start % self._size
+            first = min(end - start, self._size - ring_start)
+            data = bytes(self._buffer[ring_start:ring_start + first]) + bytes(self._buffer[:end - start - first])
+            return data, start, end
+
+    def wait(self, offset, timeout=1.0):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._end > offset or self.closed, timeout)
+
+    def end(self):
+        with self._cond:
+            return self._end
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if (self._spill_file != None):
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _spill(self, data):
+        try:
+            if (self._spill_file != None and self._spill_file.tell() + len(data) > self._file_size):
+                self._spill_file.close()
+                self._spill_file = None
+                for i in range(self._files - 1, 0, -1):
+                    previous = f"{self._spill_path}.{i - 1}" if i > 1 else self._spill_path
+                    if (os.path.exists(previous)):
+                        os.replace(previous, f"{self._spill_path}.{i}")
+            if (self._spill_file == None):
+                self._spill_file = open(self._spill_path, "ab")
+            self._spill_file.write(data)
+            self._spill_file.flush()
+        except OSError as e:
+            print(f"Failed to spill console log to {self._spill_path}: {e}")
+            self._spill_path = ""
+
+class ConsoleSession:
+
+    def __init__(self): ...
+    def read(self, timeout): ...
+    def write(self, data): ...
+    def close(self): ...
+
+    def _push(self, data): ...
+    def _end(self, error): ...
+
+    def __init__(self, hub, vm_name, pty_path, read_only=False, max_backlog=CONSOLE_MAX_BACKLOG):
+        self.vm_name = vm_name
+        self.pty_path = pty_path
+        self.read_only = read_only
+        self.error = ""
+        self.closed = False
+        self._hub = hub
+        self._max_backlog = max_backlog
+        self._chunks = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    # Returns all output that arrived since the last read as one chunk, b""
+    # if there was none within timeout, or None once the session has ended.
+    def read(self, timeout=1.0):
+        with self._cond:
+            self._cond.wait_for(lambda: self._chunks or self.closed, timeout)
+            if (self._chunks):
+                data = b"".join(self._chunks)
+                self._chunks.clear()
+                self._size = 0
+                return data
+            return None if self.closed else b""
+
+    def write(self, data):
+        if (not self.read_only and not self.closed):
+            self._hub.write(self, data)
+
+    def close(self):
+        self._hub.close_session(self)
+
+    def _push(self, data):
+        with self._cond:
+            if (self.closed):
+                return
+            if (self._size + len(data) > self._max_backlog):
+                self._end("Console reader fell behind")
+                return
+            self._chunks.append(data)
+            self._size += len(data)
+            self._cond.notify_all()
+
+    def _end(self, error=""):
+        with self._cond:
+            if (not self.closed):
+                self.closed = True
+                self.error = error
+            self._cond.notify_all()
+
+class ConsoleHub:
+
+    def __init__(self): ...
+    def start(self): ...
+    def stop(self): ...
+    def open_session(self, vm_name, pty_path, read_only): ...
+    def close_session(self, session): ...
+    def write(self, session, data): ...
+    def attach_vm(self, vm_name, pty_path, spill_path): ...
+    def get_log(self, vm_name): ...
+    def remove_vm(self, vm_name): ...
+
+    def _call_soon(self, func, *args): ...
+    def _open_console(self, vm_name, pty_path): ...
+    def _attach_vm(self, vm_name, pty_path): ...
+    def _remove_console(self, vm_name): ...
+    def _attach(self, session): ...
+    def _detach(self, session): ...
+    def _queue_input(self, session, data): ...
+    def _close_console(self, console, error): ...
+    def _read_console(self, console): ...
+    def _write_console(self, console): ...
+    def _run(self): ...
+
+    # Every VM's serial PTY is opened once and served by a single epoll
+    # loop, however many sessions are attached to it. Output is read in
+    # large chunks and handed to each session of the VM, and input from any
+    # session is queued and written to the PTY as it drains. Only the loop
+    # thread touches PTYs and the selector; other threads hand it work
+    # through _call_soon.
+    #
+    # Running VMs are attached with attach_vm, which keeps their PTY open
+    # and drained into a ConsoleLog while nobody is connected, so the guest
+    # never blocks on a full PTY and its boot output is kept. Each log uses
+    # log_size bytes of memory, whatever the VM writes.
+    def __init__(self, read_size=CONSOLE_READ_SIZE, max_backlog=CONSOLE_MAX_BACKLOG, log_size=CONSOLE_LOG_SIZE,
+                 log_files=0, log_file_size=CONSOLE_LOG_FILE_SIZE):
+        self._read_size = read_size
+        self._max_backlog = max_backlog
+        self._log_size = log_size
+        self._log_files = log_files
+        self._log_file_size = log_file_size
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._consoles = {}
+        self._calls = collections.deque()
+        self._wakeup_r, self._wakeup_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if (self._thread != None):
+            return
+
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="console-hub", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._call_soon(lambda: None)
+
+    def open_session(self, vm_name, pty_path, read_only=False):
+        session = ConsoleSession(self, vm_name, pty_path, read_only=read_only, max_backlog=self._max_backlog)
+        self._call_soon(self._attach, session)
+        return session
+
+    def close_session(self, session):
+        session._end()
+        self._call_soon(self._detach, session)
+
+    def write(self, session, data):
+        self._call_soon(self._queue_input, session, bytes(data))
+
+    # Returns the VM's log, which outlives the PTY so that the output of a
+    # VM that stopped can still be read and continues when it is started
+    # again.
+    def attach_vm(self, vm_name, pty_path, spill_path=""):
+        with self._logs_lock:
+            log = self._logs.get(vm_name)
+            if (log == None):
+                log = ConsoleLog(self._log_size, spill_path=spill_path, files=self._log_files,
+                    file_size=self._log_file_size)
+                self._logs[vm_name] = log
+        self._call_soon(self._attach_vm, vm_name, pty_path)
+        return log
+
+    def get_log(self, vm_name):
+        with self._logs_lock:
+            return self._logs.get(vm_name)
+
+    def remove_vm(self, vm_name):
+        with self._logs_lock:
+            log = self._logs.pop(vm_name, None)
+        self._call_soon(self._remove_console, vm_name)
+        if (log != None):
+            self._call_soon(log.close)
+
+    def _call_soon(self, func, *args):
+        self._calls.append((func, args))
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _open_console(self, vm_name, pty_path):
+        console = self._consoles.get(vm_name)
+        if (console != None and console["pty_path"] == pty_path):
+            return console
+        if (console != None):
+            # The VM was started again and got a new PTY.
+            self._close_console(console, "")
+
+        fd = os.open(pty_path, os.O_RDWR | os.O_NONBLOCK | os.O_NOCTTY | os.O_CLOEXEC)
+        # Raw mode keeps the line discipline from buffering input until a
+        # newline, echoing it a second time or rewriting line endings.
+        tty.setraw(fd)
+        console = {"vm_name": vm_name, "pty_path": pty_path, "fd": fd, "sessions": set(),
+            "input": bytearray(), "pinned": False}
+        self._consoles[vm_name] = console
+        self._selector.register(fd, selectors.EVENT_READ, console)
+        return console
+
+    def _attach_vm(self, vm_name, pty_path):
+        if (self.get_log(vm_name) == None):
+            return
+
+        try:
+            self._open_console(vm_name, pty_path)["pinned"] = True
+        except OSError as e:
+            print(f"Failed to open the serial console of vm {vm_name}: {e}")
+
+    def _remove_console(self, vm_name):
+        console = self._consoles.get(vm_name)
+        if (console != None):
+            self._close_console(console, "")
+
+    def _attach(self, session):
+        if (session.closed):
+            return
+
+        try:
+            console = self._open_console(session.vm_name, session.pty_path)
+        except OSError as e:
+            session._end(f"Failed to open the serial console: {e}")
+            return
+
+        console["sessions"].add(session)
+
+    def _detach(self, session):
+        console = self._consoles.get(session.vm_name)
+        if (console == None or session not in console["sessions"]):
+            return
+
+        console["sessions"].discard(session)
+        if (len(console["sessions"]) == 0 and not console["pinned"]):
+            self._close_console(console, "")
+
+    def _queue_input(self, session, data):
+        console = self._consoles.get(session.vm_name)
+        if (console == None or session not in console["sessions"]):
+            return
+
+        if (len(console["input"]) == 0):
+            self._selector.modify(console["fd"], selectors.EVENT_READ | selectors.EVENT_WRITE, console)
+        console["input"] += data
+
+    def _close_console(self, console, error):
+        self._selector.unregister(console["fd"])
+        os.close(console["fd"])
+        del self._consoles[console["vm_name"]]
+        for session in console["sessions"]:
+            session._end(error)
+
+    # Reads until the PTY is drained or a few chunks have been read, so one
+    # busy console cannot hold up the others, and hands the output to every
+    # session as a single chunk.
+    def _read_console(self, console):
+        chunks = []
+        closed = False
+        try:
+            for _ in range(4):
+                data = os.read(console["fd"], self._read_size)
+                if (data == b""):
+                    raise OSError(errno.EIO, "serial console closed")
+                chunks.append(data)
+                if (len(data) < self._read_size):
+                    break
+        except BlockingIOError:
+            pass
+        except OSError:
+            # EIO once QEMU closes its end, e.g. when the VM stops.
+            closed = True
+
+        if (chunks):
+            data = b"".join(chunks)
+            log = self.get_log(console["vm_name"])
+            if (log != None):
+                log.append(data)
+            for session in list(console["sessions"]):
+                session._push(data)
+        if (closed):
+            self._close_console(console, "")
+
+    def _write_console(self, console):
+        try:
+            written = os.write(console["fd"], console["input"])
+            del console["input"][:written]
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close_console(console, "")
+            return
+
+        if (len(console["input"]) == 0):
+            self._selector.modify(console["fd"], selectors.EVENT_READ, console)
+
+    def _run(self):
+        while not self._stopped:
+            for key, events in self._selector.select():
+                if (key.fd == self._wakeup_r):
+                    try:
+                        while os.read(self._wakeup_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                console = key.data
+                if (events & selectors.EVENT_READ):
+                    self._read_console(console)
+                if (events & selectors.EVENT_WRITE and self._consoles.get(console["vm_name"]) is console):
+                    self._write_console(console)
+
+            while self._calls:
+                func, args = self._calls.popleft()
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Failed to run console hub call: {e}")
+
+        for console in list(self._consoles.values()):
+            self._close_console(console, "")
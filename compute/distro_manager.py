@@ -12,9 +12,33 @@ from tqdm import tqdm
 import subprocess
 import shutil
 
+from .image_store import ImageStore
+from .image_builder import convert_image
+
+DEFAULT_IMAGE = "ubuntu-22.04.5"
+
+# Images that can be pulled by name. Their checksums are looked up in the
+# SHA256SUMS file published next to them.
+DISTRO_IMAGES = {
+    "ubuntu-22.04.5-iso": {
+        "url": "https://releases.ubuntu.com/22.04.5/ubuntu-22.04.5-live-server-amd64.iso",
+        "format": "iso",
+    },
+    "ubuntu-22.04-cloud": {
+        "url": "https://cloud-images.ubuntu.com/releases/22.04/release/ubuntu-22.04-server-cloudimg-amd64.img",
+        "format": "qcow2",
+    },
+    "ubuntu-24.04-cloud": {
+        "url": "https://cloud-images.ubuntu.com/releases/24.04/release/ubuntu-24.04-server-cloudimg-amd64.img",
+        "format": "qcow2",
+    },
+}
+
 class DistroManager:
 
     def __init__(self): ...
+    def pull_image(self, name, url, sha256, image_format): ...
+    def fetch_checksum(self, url): ...
     def download_ubuntu_iso(self, version): ...
     def verify_ubuntu_image(self, version): ...
     def generate_ubuntu_image(self, version): ...
@@ -23,33 +47,55 @@ class DistroManager:
         self.iso_location = "/IGS/compute/isos"
         self.image_location = "/IGS/compute/images"
         os.makedirs(self.iso_location, exist_ok=True)
+        self.image_store = ImageStore(self.image_location)
+
+    # Pulls one of DISTRO_IMAGES by name, or any url under the given name.
+    def pull_image(self, name, url="", sha256="", image_format="qcow2"):
+        if (url == ""):
+            if (name not in DISTRO_IMAGES):
+                raise ValueError(f"Unknown image: {name}")
+            url = DISTRO_IMAGES[name]["url"]
+            image_format = DISTRO_IMAGES[name]["format"]
+            sha256 = self.fetch_checksum(url)
+
+        return self.image_store.add_image(name, url, sha256=sha256 or None, image_format=image_format)
+
+    def fetch_checksum(self, url):
+        base_url, _, fname = url.rpartition("/")
+        response = requests.get(f"{base_url}/SHA256SUMS", timeout=30)
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            checksum, _, checksum_fname = line.partition(" ")
+            if (checksum_fname.strip().lstrip("*") == fname):
+                return checksum
+
+        raise ValueError(f"No checksum published for {url}")
 
     def download_ubuntu_iso(self, version="22.04.5"):
-        base_url = f"https://releases.ubuntu.com"
         iso_fname = f"ubuntu-{version}-live-server-amd64.iso"
-        iso_url = f"{base_url}/{version}/{iso_fname}"
-        iso_path = f"{self.iso_location}/ubuntu/{iso_fname}"
-
-        if os.path.exists(f"{self.iso_location}/ubuntu/ubuntu-{version}-live-server-amd64.iso"):
-            return
+        iso_url = f"https://releases.ubuntu.com/{version}/{iso_fname}"
 
-        os.makedirs(self.iso_location + "/ubuntu/", exist_ok=True)
+        iso = self.image_store.get_image(f"ubuntu-{version}-iso")
+        if (iso != None):
+            return iso["path"]
 
         print(f"Downloading Ubuntu {version} iso from {iso_url}")
         print(f"Please wait...\n")
 
-        subprocess.run([
-            'curl', '-L', '-o', iso_path,
-            '--progress-bar',
-            iso_url
-        ], check=True)
+        iso = self.pull_image(f"ubuntu-{version}-iso", url=iso_url,
+            sha256=self.fetch_checksum(iso_url), image_format="iso")
 
         print("\nFinished downloading Ubuntu iso")
+        return iso["path"]
 
+    # Base images generated before the image store existed are imported into
+    # it the first time they are needed.
     def verify_ubuntu_image(self, version="22.04.5"):
-        #self.download_ubuntu_iso(version=version)
+        if (self.image_store.get_image(f"ubuntu-{version}") != None):
+            return 0
 
         if os.path.exists(f"{self.image_location}/ubuntu_{version}_base.qcow2"):
+            self.image_store.import_image(f"ubuntu-{version}", f"{self.image_location}/ubuntu_{version}_base.qcow2")
             return 0
 
         #self.generate_ubuntu_image(version=version)
@@ -72,12 +118,15 @@ class DistroManager:
             print(f"Failed to create disk: {e}")
             return False
 
+        iso = self.image_store.get_image(f"ubuntu-{version}-iso")
+        iso_path = iso["path"] if iso != None else f"{self.iso_location}/ubuntu/ubuntu-{version}-live-server-amd64.iso"
+
         os.makedirs("iso_mount", exist_ok=True)
 
         mount_iso_cmd = [
             "mount",
             "-o", "loop",
-            f"{self.iso_location}/ubuntu/ubuntu-22.04.5-live-server-amd64.iso", f"iso_mount"
+            iso_path, f"iso_mount"
         ]
         subprocess.run(mount_iso_cmd)
 
@@ -89,7 +138,7 @@ class DistroManager:
             "-cpu", "host",
             "-serial", "mon:stdio",
             "-drive", f"file={image_path},format=qcow2",
-            "-drive", f"file=/IGS/compute/isos/ubuntu/ubuntu-22.04.5-live-server-amd64.iso,media=cdrom",
+            "-drive", f"file={iso_path},media=cdrom",
             "-net", "nic", "-net", "user",
             "-kernel", "iso_mount/casper/vmlinuz",
             "-initrd", "iso_mount/casper/initrd",
@@ -115,15 +164,9 @@ class DistroManager:
 
         print("Compressing the Ubuntu base image. Please wait, this will take a while..\n")
 
-        compress_ubuntu_base_image_cmd = [
-            "qemu-img",
-            "convert",
-            "-c",
-            "-O", "qcow2",
-            f"{image_path}", f"{self.image_location}/compressed_ubuntu"
-        ]
-        subprocess.run(compress_ubuntu_base_image_cmd)
+        convert_image(image_path, f"{self.image_location}/compressed_ubuntu")
 
         shutil.move(f"{self.image_location}/compressed_ubuntu", f"{image_path}")
+        self.image_store.import_image(f"ubuntu-{version}", image_path)
 
         return 0
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import base64
+import json
+import random
+import socket
+import threading
+import time
+
+# Guest files are read and written in chunks of this size, the agent holds
+# each chunk in memory base64 encoded.
+GUEST_FILE_CHUNK_SIZE = 1024 * 1024
+
+# Sent before a guest-sync-delimited, it makes the agent drop any partial
+# request it is still parsing. The agent sends it back before the reply.
+SYNC_DELIMITER = b"\xff"
+
+class GuestAgentError(Exception):
+    pass
+
+class GuestAgentClient:
+
+    def __init__(self): ...
+    def connect(self, timeout): ...
+    def close(self): ...
+    def is_connected(self): ...
+
+    def submit(self, cmd, arguments): ...
+    def wait(self, waiter, timeout): ...
+    def execute(self, cmd, arguments, timeout): ...
+
+    def _sync(self, timeout): ...
+    def _send(self, message, prefix): ...
+    def _reader(self): ...
+
+    # One connection is kept per VM, QEMU accepts only one client on the
+    # agent's socket at a time. Requests carry an id and are written without
+    # waiting for earlier replies, the agent answers them in order and the
+    # reader thread hands every reply to the request with its id.
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._sock = None
+        self._rfile = None
+        self._send_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._reader_thread = None
+        self._connected = False
+        self._synced = False
+
+    def connect(self, timeout=5.0):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise GuestAgentError(f"Failed to connect to {self.socket_path}: {e}")
+
+        sock.settimeout(None)
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+        self._connected = True
+        self._reader_thread = threading.Thread(target=self._reader,
+            name=f"qga-{self.socket_path}", daemon=True)
+        self._reader_thread.start()
+
+    def close(self):
+        self._connected = False
+        if (self._sock != None):
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+    def is_connected(self):
+        return self._connected
+
+    def submit(self, cmd, arguments=None):
+        if (not self._connected):
+            raise GuestAgentError(f"Not connected to {self.socket_path}")
+
+        with self._pending_lock:
+            self._next_id += 1
+            request_id = self._next_id
+            waiter = {"id": request_id, "cmd": cmd, "event": threading.Event(), "reply": None}
+            self._pending[request_id] = waiter
+
+        message = {"execute": cmd, "id": request_id}
+        if (arguments):
+            message["arguments"] = arguments
+        try:
+            self._send(message)
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise GuestAgentError(f"Failed to send {cmd}: {e}")
+
+        return waiter
+
+    def wait(self, waiter, timeout=10.0):
+        try:
+            if (not waiter["event"].wait(timeout)):
+                # The agent may have restarted and lost the request half
+                # read, the next command syncs with it first.
+                self._synced = False
+                raise GuestAgentError(f"Timed out waiting for {waiter['cmd']}")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(waiter["id"], None)
+
+        reply = waiter["reply"]
+        if (reply == None):
+            raise GuestAgentError(f"Connection closed while waiting for {waiter['cmd']}")
+        if ("error" in reply):
+            raise GuestAgentError(f"{waiter['cmd']} failed: {reply['error'].get('desc', reply['error'])}")
+
+        return reply.get("return")
+
+    def execute(self, cmd, arguments=None, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        if (not self._synced):
+            self._sync(timeout)
+        return self.wait(self.submit(cmd, arguments), max(deadline - time.monotonic(), 0))
+
+    # Replies to requests from an earlier connection, or to ones that timed
+    # out, can still be queued in the channel. They carry ids nobody waits
+    # for and are dropped, the sync only has to reset the agent's parser and
+    # show that the agent is answering.
+    def _sync(self, timeout):
+        with self._sync_lock:
+            if (self._synced):
+                return
+
+            sync_id = random.randint(1, 0x7fffffff)
+            with self._pending_lock:
+                waiter = {"id": f"sync-{sync_id}", "cmd": "guest-sync-delimited", "event": threading.Event(),
+                    "reply": None}
+                self._pending[waiter["id"]] = waiter
+
+            try:
+                self._send({"execute": "guest-sync-delimited", "arguments": {"id": sync_id},
+                    "id": waiter["id"]}, prefix=SYNC_DELIMITER)
+            except OSError as e:
+                with self._pending_lock:
+                    self._pending.pop(waiter["id"], None)
+                raise GuestAgentError(f"Failed to sync with the guest agent: {e}")
+
+            if (self.wait(waiter, timeout) != sync_id):
+                raise GuestAgentError("Guest agent answered the sync with a different id")
+            self._synced = True
+
+    def _send(self, message, prefix=b""):
+        data = prefix + json.dumps(message).encode() + b"\n"
+        with self._send_lock:
+            self._sock.sendall(data)
+
+    # Replies are single JSON objects terminated by a newline, so whole lines
+    # are read however large a reply is. A partial reply left over from an
+    # agent that restarted ends up in front of the next one, the delimiter
+    # before a sync reply marks where the valid data starts and other lines
+    # that do not parse are skipped.
+    def _reader(self):
+        try:
+            for line in self._rfile:
+                try:
+                    message = json.loads(line.rsplit(SYNC_DELIMITER, 1)[-1])
+                except ValueError:
+                    continue
+                if (not isinstance(message, dict)):
+                    continue
+
+                with self._pending_lock:
+                    waiter = self._pending.get(message.get("id"))
+                if (waiter != None):
+                    waiter["reply"] = message
+                    waiter["event"].set()
+        except (OSError, ValueError):
+            pass
+
+        self._connected = False
+        with self._pending_lock:
+            for waiter in self._pending.values():
+                waiter["event"].set()
+
+class GuestAgentManager:
+
+    def __init__(self): ...
+    def get_client(self, vm_name, timeout): ...
+    def remove(self, vm_name): ...
+    def close(self): ...
+
+    def execute(self, vm_name, cmd, arguments, timeout): ...
+    def ping(self, vm_name, timeout): ...
+    def exec_command(self, vm_name, path, args, input_data, timeout): ...
+    def read_file(self, vm_name, path, timeout): ...
+    def write_file(self, vm_name, path, data, timeout): ...
+
+    def _close_file(self, client, handle): ...
+
+    # Connections are opened on first use and kept until the VM goes away or
+    # QEMU closes them, a VM that restarted is reconnected on the next
+    # command.
+    def __init__(self, run_location):
+        self._run_location = run_location
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, vm_name, timeout=5.0):
+        with self._lock:
+            client = self._clients.get(vm_name)
+            if (client != None and client.is_connected()):
+                return client
+
+            client = GuestAgentClient(f"{self._run_location}/{vm_name}_qga.sock")
+            client.connect(timeout)
+            self._clients[vm_name] = client
+            return client
+
+    def remove(self, vm_name):
+        with self._lock:
+            client = self._clients.pop(vm_name, None)
+        if (client != None):
+            client.close()
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    def execute(self, vm_name, cmd, arguments=None, timeout=10.0):
+        return self.get_client(vm_name, timeout).execute(cmd, arguments, timeout)
+
+    def ping(self, vm_name, timeout=1.0):
+        try:
+            self.execute(vm_name, "guest-ping", timeout=timeout)
+            return True
+        except GuestAgentError:
+            return False
+
+    # Runs path in the guest and returns its exit code and output. Status is
+    # polled with a growing interval, short commands finish within a few
+    # milliseconds and long ones do not keep the agent busy.
+    def exec_command(self, vm_name, path, args=None, input_data=b"", timeout=60.0):
+        deadline = time.monotonic() + timeout
+        arguments = {"path": path, "arg": args or [], "capture-output": True}
+        if (input_data):
+            arguments["input-data"] = base64.b64encode(input_data).decode()
+        pid = self.execute(vm_name, "guest-exec", arguments, timeout)["pid"]
+
+        interval = 0.01
+        while True:
+            status = self.execute(vm_name, "guest-exec-status", {"pid": pid},
+                max(deadline - time.monotonic(), 0.1))
+            if (status["exited"]):
+                return {
+                    "exit_code": status.get("exitcode", -status.get("signal", 0)),
+                    "stdout": base64.b64decode(status.get("out-data", "")),
+                    "stderr": base64.b64decode(status.get("err-data", "")),
+                }
+            if (time.monotonic() + interval > deadline):
+                raise GuestAgentError(f"Timed out waiting for {path} to finish")
+            time.sleep(interval)
+            interval = min(interval * 2, 0.5)
+
+    def read_file(self, vm_name, path, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        client = self.get_client(vm_name)
+        handle = client.execute("guest-file-open", {"path": path, "mode": "r"}, timeout)
+        try:
+            chunks = []
+            while True:
+                result = client.execute("guest-file-read", {"handle": handle, "count": GUEST_FILE_CHUNK_SIZE},
+                    max(deadline - time.monotonic(), 0.1))
+                chunks.append(base64.b64decode(result.get("buf-b64", "")))
+                if (result["eof"] or result["count"] == 0):
+                    return b"".join(chunks)
+        finally:
+            self._close_file(client, handle)
+
+    # The chunks are written back to back and their replies collected at the
+    # end, so a large file costs one round trip rather than one per chunk.
+    def write_file(self, vm_name, path, data, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        client = self.get_client(vm_name)
+        handle = client.execute("guest-file-open", {"path": path, "mode": "w"}, timeout)
+        try:
+            writes = [client.submit("guest-file-write",
+                {"handle": handle, "buf-b64": base64.b64encode(data[offset:offset + GUEST_FILE_CHUNK_SIZE]).decode()})
+                for offset in range(0, len(data), GUEST_FILE_CHUNK_SIZE)]
+            written = sum(client.wait(write, max(deadline - time.monotonic(), 0))["count"] for write in writes)
+            if (written != len(data)):
+                raise GuestAgentError(f"Wrote {written} of {len(data)} bytes to {path}")
+            client.execute("guest-file-flush", {"handle": handle}, max(deadline - time.monotonic(), 0.1))
+        finally:
+            self._close_file(client, handle)
+
+    def _close_file(self, client, handle):
+        try:
+            client.execute("guest-file-close", {"handle": handle})
+        except GuestAgentError as e:
+            print(f"Failed to close guest file: {e}")
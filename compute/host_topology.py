@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import re
+
+def parse_cpulist(cpulist):
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if (part == ""):
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def format_cpulist(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if (ranges and ranges[-1][1] == cpu - 1):
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{first}-{last}" if first != last else f"{first}" for first, last in ranges)
+
+def _read(path, default=""):
+    try:
+        with open(path, "r") as sf:
+            return sf.read().strip()
+    except OSError:
+        return default
+
+# Reads the NUMA nodes of the host from sysfs as
+# {node_id: {"cores": [[cpu, sibling, ...], ...], "hugepages": {size_kb: total}}}.
+# Each core lists the hardware threads that share it. Hosts without NUMA
+# support are reported as a single node holding every online CPU.
+def discover_topology(sysfs_root="/sys"):
+    node_root = os.path.join(sysfs_root, "devices/system/node")
+    cpu_root = os.path.join(sysfs_root, "devices/system/cpu")
+
+    node_cpus = {}
+    if (os.path.isdir(node_root)):
+        for entry in os.listdir(node_root):
+            match = re.fullmatch(r"node(\d+)", entry)
+            if (match):
+                node_cpus[int(match.group(1))] = parse_cpulist(_read(os.path.join(node_root, entry, "cpulist")))
+    if (len(node_cpus) == 0):
+        node_cpus[0] = parse_cpulist(_read(os.path.join(cpu_root, "online"), "0"))
+
+    topology = {}
+    for node_id, cpus in sorted(node_cpus.items()):
+        cores = {}
+        for cpu in cpus:
+            siblings = parse_cpulist(_read(os.path.join(cpu_root, f"cpu{cpu}/topology/thread_siblings_list"), str(cpu)))
+            core = tuple(sorted(sibling for sibling in siblings if sibling in cpus) or [cpu])
+            cores[core] = list(core)
+
+        hugepages = {}
+        hugepage_root = os.path.join(node_root, f"node{node_id}/hugepages")
+        if (os.path.isdir(hugepage_root)):
+            for entry in os.listdir(hugepage_root):
+                match = re.fullmatch(r"hugepages-(\d+)kB", entry)
+                if (match):
+                    hugepages[int(match.group(1))] = int(_read(os.path.join(hugepage_root, entry, "nr_hugepages"), "0"))
+
+        topology[node_id] = {"cores": sorted(cores.values()), "hugepages": hugepages}
+
+    return topology
+
+def free_hugepages(node_id, size_kb, sysfs_root="/sys"):
+    return int(_read(os.path.join(sysfs_root,
+        f"devices/system/node/node{node_id}/hugepages/hugepages-{size_kb}kB/free_hugepages"), "0"))
+
+# Maps hugepage sizes in kB to the hugetlbfs mount that serves them. Mounts
+# without a pagesize option use the default hugepage size of the host.
+def hugepage_mounts(proc_root="/proc"):
+    default_size = 0
+    for line in _read(os.path.join(proc_root, "meminfo")).splitlines():
+        if (line.startswith("Hugepagesize:")):
+            default_size = int(line.split()[1])
+
+    mounts = {}
+    for line in _read(os.path.join(proc_root, "mounts")).splitlines():
+        fields = line.split()
+        if (len(fields) < 4 or fields[2] != "hugetlbfs"):
+            continue
+
+        size_kb = default_size
+        for option in fields[3].split(","):
+            if (option.startswith("pagesize=")):
+                size = option[len("pagesize="):].upper()
+                size_kb = int(size[:-1]) * {"K": 1, "M": 1024, "G": 1024 * 1024}[size[-1]]
+        if (size_kb and size_kb not in mounts):
+            mounts[size_kb] = fields[1]
+
+    return mounts
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent import futures
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+MIN_SEGMENT_SIZE = 8 * CHUNK_SIZE
+STATE_SAVE_INTERVAL = 16 * CHUNK_SIZE
+
+IMAGE_FORMATS = ["qcow2", "raw", "iso"]
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ImageStore:
+
+    def __init__(self): ...
+    def get_image(self, name): ...
+    def get_images(self): ...
+    def add_image(self, name, url, sha256, image_format, segments): ...
+    def import_image(self, name, path, image_format): ...
+
+    def _register(self, name, sha256, image_format, url): ...
+    def _save_catalog(self): ...
+    def _download(self, url, sha256, segments): ...
+    def _download_stream(self, url, partial_path): ...
+    def _download_ranges(self, url, size, partial_path, segments): ...
+    def _fetch_range(self, url, partial_path, state, index): ...
+    def _sync_segment(self, state, index, fd, done): ...
+    def _save_download_state(self, state): ...
+
+    # Images are stored once per content hash under blobs/sha256 and the
+    # catalog maps image names onto those hashes, so the same image pulled
+    # under two names, or from two mirrors, is only kept once.
+    def __init__(self, location="/IGS/compute/images"):
+        self.location = location
+        self.blob_location = f"{location}/blobs/sha256"
+        self.partial_location = f"{location}/partial"
+        self.catalog_path = f"{location}/catalog.json"
+        self._images = {}
+        self._lock = threading.Lock()
+        self._downloads = {}
+        self._session = requests.Session()
+
+        os.makedirs(self.blob_location, exist_ok=True)
+        os.makedirs(self.partial_location, exist_ok=True)
+        if (os.path.exists(self.catalog_path)):
+            with open(self.catalog_path, "r") as cf:
+                self._images = json.load(cf)
+
+    def get_image(self, name):
+        with self._lock:
+            image = self._images.get(name)
+            if (image == None):
+                return None
+            return dict(image, path=f"{self.blob_location}/{image['sha256']}")
+
+    def get_images(self):
+        with self._lock:
+            names = sorted(self._images)
+        return [self.get_image(name) for name in names]
+
+    # Downloads url into the store unless an image with the same hash is
+    # already cached. sha256 is checked while the download is running, and
+    # an interrupted download picks up from where it stopped.
+    def add_image(self, name, url, sha256=None, image_format="qcow2", segments=4):
+        if (image_format not in IMAGE_FORMATS):
+            raise ValueError(f"Unknown image format: {image_format}")
+
+        sha256 = sha256.lower() if sha256 else None
+        if (sha256 == None or not os.path.exists(f"{self.blob_location}/{sha256}")):
+            # Concurrent pulls of the same content share one download.
+            key = sha256 or url
+            with self._lock:
+                download_lock = self._downloads.setdefault(key, threading.Lock())
+            with download_lock:
+                if (sha256 == None or not os.path.exists(f"{self.blob_location}/{sha256}")):
+                    sha256 = self._download(url, sha256, segments)
+
+        return self._register(name, sha256, image_format, url)
+
+    # Adds a local file to the store. The blob is a hard link where possible
+    # so that existing overlays backed by the original path stay valid.
+    def import_image(self, name, path, image_format="qcow2"):
+        sha256 = sha256_file(path)
+        blob_path = f"{self.blob_location}/{sha256}"
+        if (not os.path.exists(blob_path)):
+            try:
+                os.link(path, blob_path)
+            except OSError:
+                shutil.copyfile(path, f"{blob_path}.tmp")
+                os.replace(f"{blob_path}.tmp", blob_path)
+
+        return self._register(name, sha256, image_format, "")
+
+    def _register(self, name, sha256, image_format, url):
+        with self._lock:
+            self._images[name] = {
+                "name": name,
+                "sha256": sha256,
+                "format": image_format,
+                "size": os.path.getsize(f"{self.blob_location}/{sha256}"),
+                "url": url,
+            }
+            self._save_catalog()
+        return self.get_image(name)
+
+    def _save_catalog(self):
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, "w") as cf:
+            json.dump(self._images, cf, separators=(",", ":"))
+            cf.flush()
+            os.fsync(cf.fileno())
+        os.replace(tmp_path, self.catalog_path)
+
+    # Range requests fill the file from several connections at once while
+    # the hash follows the contiguous prefix that has been written so far,
+    # so verification finishes right after the last byte arrives.
+    def _download(self, url, sha256, segments):
+        partial_name = sha256 or hashlib.sha256(url.encode()).hexdigest()
+        partial_path = f"{self.partial_location}/{partial_name}"
+
+        response = self._session.head(url, allow_redirects=True, timeout=30)
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length", "0"))
+        url = response.url
+
+        if (size > 0 and response.headers.get("Accept-Ranges", "").lower() == "bytes"):
+            digest = self._download_ranges(url, size, partial_path, max(1, min(segments, size // MIN_SEGMENT_SIZE)))
+        else:
+            digest = self._download_stream(url, partial_path)
+
+        if (sha256 != None and digest != sha256):
+            os.remove(partial_path)
+            if (os.path.exists(f"{partial_path}.json")):
+                os.remove(f"{partial_path}.json")
+            raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+
+        os.replace(partial_path, f"{self.blob_location}/{digest}")
+        if (os.path.exists(f"{partial_path}.json")):
+            os.remove(f"{partial_path}.json")
+        return digest
+
+    def _download_stream(self, url, partial_path):
+        digest = hashlib.sha256()
+        with self._session.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(partial_path, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+        return digest.hexdigest()
+
+    def _download_ranges(self, url, size, partial_path, segments):
+        state_path = f"{partial_path}.json"
+        state = None
+        if (os.path.exists(state_path) and os.path.exists(partial_path)):
+            with open(state_path, "r") as sf:
+                state = json.load(sf)
+            if (state["url"] != url or state["size"] != size):
+                state = None
+
+        if (state == None):
+            segment_size = -(-size // segments)
+            state = {
+                "url": url,
+                "size": size,
+                "segments": [[start, min(start + segment_size, size), 0] for start in range(0, size, segment_size)],
+            }
+            with open(partial_path, "wb") as f:
+                f.truncate(size)
+
+        state["lock"] = threading.Condition()
+        state["path"] = state_path
+        state["synced"] = [done for _, _, done in state["segments"]]
+        state["error"] = None
+
+        digest = hashlib.sha256()
+        hashed = 0
+        fd = os.open(partial_path, os.O_RDONLY)
+        try:
+            with futures.ThreadPoolExecutor(max_workers=len(state["segments"])) as executor:
+                fetches = [executor.submit(self._fetch_range, url, partial_path, state, index)
+                    for index in range(len(state["segments"]))]
+
+                while hashed < size:
+                    with state["lock"]:
+                        while True:
+                            written = 0
+                            for start, end, done in state["segments"]:
+                                written = start + done
+                                if (start + done < end):
+                                    break
+                            if (written > hashed or state["error"] != None):
+                                break
+                            state["lock"].wait()
+                        if (state["error"] != None):
+                            raise state["error"]
+
+                    while hashed < written:
+                        chunk = os.pread(fd, min(CHUNK_SIZE, written - hashed), hashed)
+                        digest.update(chunk)
+                        hashed += len(chunk)
+
+                for fetch in fetches:
+                    fetch.result()
+        finally:
+            os.close(fd)
+
+        return digest.hexdigest()
+
+    def _fetch_range(self, url, partial_path, state, index):
+        start, end, done = state["segments"][index]
+        if (start + done >= end):
+            return
+
+        fd = os.open(partial_path, os.O_WRONLY)
+        try:
+            headers = {"Range": f"bytes={start + done}-{end - 1}"}
+            with self._session.get(url, headers=headers, stream=True, timeout=30) as response:
+                if (response.status_code != 206):
+                    raise Exception(f"Server ignored the range request for {url}")
+
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    chunk = chunk[:end - start - done]
+                    os.pwrite(fd, chunk, start + done)
+                    done += len(chunk)
+
+                    with state["lock"]:
+                        state["segments"][index][2] = done
+                        state["lock"].notify_all()
+                        if (state["error"] != None):
+                            break
+
+                    if (done - state["synced"][index] >= STATE_SAVE_INTERVAL):
+                        self._sync_segment(state, index, fd, done)
+
+            if (start + done < end and state["error"] == None):
+                raise Exception(f"Connection closed early while downloading {url}")
+        except Exception as e:
+            with state["lock"]:
+                if (state["error"] == None):
+                    state["error"] = e
+                state["lock"].notify_all()
+            raise
+        finally:
+            self._sync_segment(state, index, fd, done)
+            os.close(fd)
+
+    def _sync_segment(self, state, index, fd, done):
+        os.fdatasync(fd)
+        with state["lock"]:
+            state["synced"][index] = done
+            self._save_download_state(state)
+
+    # Only progress that has been synced to disk is recorded, so a resumed
+    # download never skips bytes that were lost in a crash.
+    def _save_download_state(self, state):
+        segments = [[start, end, synced] for (start, end, _), synced in zip(state["segments"], state["synced"])]
+
+        tmp_path = f"{state['path']}.tmp"
+        with open(tmp_path, "w") as sf:
+            json.dump({"url": state["url"], "size": state["size"], "segments": segments}, sf)
+        os.replace(tmp_path, state["path"])
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import re
+import threading
+
+MEMORY_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+def parse_memory_mib(size):
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+    if (not match):
+        raise ValueError(f"Invalid memory size: {size}")
+    return int(float(match.group(1)) * MEMORY_UNITS[(match.group(2) or "M").upper()])
+
+# Parses the QEMU -readconfig format used by the instance configs into
+# {section: {key: value}}. Repeated sections such as [drive] keep the last one.
+def parse_qemu_config(content):
+    sections = {}
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if (line == "" or line.startswith("#")):
+            continue
+
+        match = re.fullmatch(r"\[([^\]\s]+)(?:\s+\"[^\"]*\")?\]", line)
+        if (match):
+            section = sections.setdefault(match.group(1), {})
+            continue
+
+        key, sep, value = line.partition("=")
+        if (sep and section != None):
+            section[key.strip()] = value.strip().strip('"')
+
+    return sections
+
+def config_resources(content):
+    sections = parse_qemu_config(content)
+    return {
+        "vcpus": int(sections.get("smp-opts", {}).get("cpus", "1")),
+        "memory_mib": parse_memory_mib(sections.get("memory", {}).get("size", "128M")),
+    }
+
+class InstanceCatalog:
+
+    def __init__(self): ...
+    def get(self, instance_type): ...
+    def get_instance_types(self): ...
+    def render_config(self, instance_type, vm_name, disk_path, accel): ...
+
+    def _load(self): ...
+
+    # Instance configs are read and parsed once and reloaded only when the
+    # directory changes, e.g. when a new instance type is added.
+    def __init__(self, location="conf/instances"):
+        self.location = location
+        self._instance_types = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, instance_type):
+        self._load()
+        with self._lock:
+            return self._instance_types.get(instance_type)
+
+    def get_instance_types(self):
+        self._load()
+        with self._lock:
+            return sorted(self._instance_types.values(),
+                key=lambda it: (it["vcpus"], it["memory_mib"], it["name"]))
+
+    # accel overrides the accelerator of the instance type, e.g. tcg on hosts
+    # without KVM.
+    def render_config(self, instance_type, vm_name, disk_path, accel=""):
+        content = self.get(instance_type)["template"]
+        content = content.replace("GNAME", vm_name)
+        content = content.replace("FPATH", disk_path)
+        if (accel):
+            content = re.sub(r'accel = "[^"]*"', f'accel = "{accel}"', content)
+        return content
+
+    def _load(self):
+        mtime = os.stat(self.location).st_mtime_ns
+        if (mtime == self._mtime):
+            return
+
+        instance_types = {}
+        for fname in os.listdir(self.location):
+            if (not fname.endswith(".conf")):
+                continue
+
+            name = fname[:-len(".conf")]
+            try:
+                with open(f"{self.location}/{fname}", "r") as cfile:
+                    content = cfile.read()
+                instance_types[name] = dict(config_resources(content), name=name, template=content)
+            except Exception as e:
+                print(f"Failed to load instance type {name}: {e}")
+
+        with self._lock:
+            self._instance_types = instance_types
+            self._mtime = mtime
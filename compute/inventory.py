@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import json
+import os
+import threading
+
+class Inventory:
+
+    def __init__(self): ...
+    def exists(self): ...
+    def load(self): ...
+
+    def get_vms(self): ...
+    def get_vm(self, vm_name): ...
+    def put_vm(self, record): ...
+    def remove_vm(self, vm_name): ...
+
+    def _append(self, entry): ...
+    def _compact(self): ...
+
+    # The inventory is a JSON snapshot plus a journal of JSON lines. Every
+    # mutation appends one line, and the journal is folded back into the
+    # snapshot once it holds more entries than there are VMs.
+    def __init__(self, location="/IGS/compute"):
+        self.snapshot_path = f"{location}/inventory.json"
+        self.journal_path = f"{location}/inventory.journal"
+        self._vms = {}
+        self._journal_entries = 0
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path)
+
+    def load(self):
+        with self._lock:
+            self._vms = {}
+            self._journal_entries = 0
+
+            if (os.path.exists(self.snapshot_path)):
+                with open(self.snapshot_path, "r") as sf:
+                    self._vms = json.load(sf)
+
+            if (os.path.exists(self.journal_path)):
+                with open(self.journal_path, "r") as jf:
+                    for line in jf:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            break
+
+                        if (entry["op"] == "put"):
+                            self._vms[entry["vm"]["name"]] = entry["vm"]
+                        elif (entry["op"] == "remove"):
+                            self._vms.pop(entry["name"], None)
+                        self._journal_entries += 1
+
+            self._compact()
+
+            return dict(self._vms)
+
+    def get_vms(self):
+        with self._lock:
+            return dict(self._vms)
+
+    def get_vm(self, vm_name):
+        with self._lock:
+            vm_record = self._vms.get(vm_name)
+            return dict(vm_record) if vm_record != None else None
+
+    def put_vm(self, record):
+        with self._lock:
+            self._vms[record["name"]] = dict(record)
+            self._append({"op": "put", "vm": record})
+
+    def remove_vm(self, vm_name):
+        with self._lock:
+            if (self._vms.pop(vm_name, None) == None):
+                return
+            self._append({"op": "remove", "name": vm_name})
+
+    def _append(self, entry):
+        if (self._journal == None):
+            self._journal = open(self.journal_path, "a")
+
+        self._journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_entries += 1
+
+        if (self._journal_entries > len(self._vms) + 64):
+            self._compact()
+
+    def _compact(self):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as sf:
+            json.dump(self._vms, sf, separators=(",", ":"))
+            sf.flush()
+            os.fsync(sf.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        if (self._journal != None):
+            self._journal.close()
+        self._journal = open(self.journal_path, "w")
+        self._journal_entries = 0
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import threading
+import uuid
+from collections import deque
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+from cryptography.hazmat.backends import default_backend
+
+KEY_TYPES = ["rsa", "ed25519"]
+
+def generate_keypair(key_type="rsa"):
+    if (key_type == "ed25519"):
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.OpenSSH
+    else:
+        private_key = rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+
+    private_key_str = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=private_format,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode('utf-8')
+
+    public_key_str = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.OpenSSH,
+        format=serialization.PublicFormat.OpenSSH
+    ).decode('utf-8')
+
+    return private_key_str, public_key_str
+
+class KeyPool:
+
+    def __init__(self): ...
+    def start(self): ...
+    def stop(self): ...
+
+    def get_keypair(self): ...
+    def size(self): ...
+
+    def _load_spool(self): ...
+    def _refill(self): ...
+
+    def __init__(self, key_type="rsa", size=32, refill_threshold=8,
+                 spool_location="/IGS/compute/keys"):
+        if (key_type not in KEY_TYPES):
+            raise ValueError(f"Unsupported SSH key type: {key_type}")
+
+        self.key_type = key_type
+        self.pool_size = size
+        self.refill_threshold = refill_threshold
+        self.spool_location = f"{spool_location}/{key_type}"
+        self.hits = 0
+        self.misses = 0
+
+        self._keys = deque()
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        os.makedirs(self.spool_location, mode=0o700, exist_ok=True)
+        self._load_spool()
+
+    def start(self):
+        if (self._thread != None):
+            return
+
+        self._thread = threading.Thread(target=self._refill, name="key-pool", daemon=True)
+        self._thread.start()
+        self._refill_needed.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._refill_needed.set()
+
+    def size(self):
+        with self._lock:
+            return len(self._keys)
+
+    def get_keypair(self):
+        with self._lock:
+            key = self._keys.popleft() if self._keys else None
+            remaining = len(self._keys)
+            if (key == None):
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if (remaining <= self.refill_threshold):
+            self._refill_needed.set()
+
+        if (key == None):
+            return generate_keypair(self.key_type)
+
+        key_id, private_key_str, public_key_str = key
+        try:
+            os.remove(f"{self.spool_location}/{key_id}")
+            os.remove(f"{self.spool_location}/{key_id}.pub")
+        except Exception as e:
+            print(f"Failed to remove key {key_id} from the spool: {e}")
+
+        return private_key_str, public_key_str
+
+    def _load_spool(self):
+        for fname in sorted(os.listdir(self.spool_location)):
+            if (fname.endswith(".pub")):
+                continue
+
+            key_path = f"{self.spool_location}/{fname}"
+            try:
+                with open(key_path, "r") as kf:
+                    private_key_str = kf.read()
+                with open(f"{key_path}.pub", "r") as kf:
+                    public_key_str = kf.read()
+            except FileNotFoundError:
+                os.remove(key_path)
+                continue
+
+            self._keys.append((fname, private_key_str, public_key_str))
+
+    def _refill(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except Exception:
+            pass
+
+        while not self._stopped.is_set():
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+
+            while (not self._stopped.is_set() and self.size() < self.pool_size):
+                private_key_str, public_key_str = generate_keypair(self.key_type)
+
+                key_id = str(uuid.uuid4())
+                key_path = f"{self.spool_location}/{key_id}"
+                try:
+                    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, "w") as kf:
+                        kf.write(private_key_str)
+                    with open(f"{key_path}.pub", "w") as kf:
+                        kf.write(public_key_str)
+                except Exception as e:
+                    print(f"Failed to spool SSH key: {e}")
+                    break
+
+                with self._lock:
+                    self._keys.append((key_id, private_key_str, public_key_str))
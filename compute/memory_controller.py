@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import threading
+
+import psutil
+from prometheus_client import Counter, Gauge
+
+from .qmp import QMPError
+
+HOST_MEMORY_AVAILABLE = Gauge('igs_host_memory_available_bytes', 'Host memory available for new allocations')
+HOST_MEMORY_PRESSURE = Gauge('igs_host_memory_pressure', 'Host memory PSI averaged over 10s', ['kind'])
+MEMORY_CONTROLLER_STATE = Gauge('igs_memory_controller_state', 'Current memory controller state', ['state'])
+BALLOON_TARGET = Gauge('igs_balloon_target_bytes', 'Memory the controller last asked the guest balloon for', ['vm'])
+BALLOON_ACTUAL = Gauge('igs_balloon_actual_bytes', 'Memory currently available to the guest', ['vm'])
+BALLOON_ADJUSTMENTS = Counter('igs_balloon_adjustments', 'Balloon resizes issued by the memory controller', ['direction'])
+KSM_PAGES_TO_SCAN = Gauge('igs_ksm_pages_to_scan', 'KSM pages scanned per wakeup')
+KSM_PAGES_SHARING = Gauge('igs_ksm_pages_sharing', 'Guest pages currently deduplicated by KSM')
+
+MIB = 1024 * 1024
+
+CONTROLLER_STATES = ["pressure", "steady", "relaxed"]
+
+# KSM scan rate per controller state. Scanning costs CPU, so it only runs
+# hard when memory is short.
+KSM_PAGES_TO_SCAN_BY_STATE = {"pressure": 2000, "steady": 500, "relaxed": 100}
+
+DEFAULT_BALLOON_FLOOR = "50%"
+
+# Errors QEMU reports for a VM started without a balloon device.
+NO_BALLOON_ERRORS = ["DeviceNotActive", "DeviceNotFound"]
+
+def parse_balloon_floors(spec=""):
+    floors = {}
+    for entry in spec.split(","):
+        if (entry.strip() == ""):
+            continue
+        instance_type, _, floor = entry.partition("=")
+        floors[instance_type.strip()] = floor.strip()
+    return floors
+
+# A floor is either a size in MiB or a percentage of the guest's memory.
+def floor_bytes(floor, memory_mib):
+    if (floor.endswith("%")):
+        return int(memory_mib * float(floor[:-1]) / 100) * MIB
+    return min(int(floor), memory_mib) * MIB
+
+def read_memory_pressure(proc_root="/proc"):
+    pressure = {"some": 0.0, "full": 0.0}
+    try:
+        with open(f"{proc_root}/pressure/memory", "r") as pf:
+            for line in pf:
+                fields = line.split()
+                pressure[fields[0]] = float(dict(field.split("=") for field in fields[1:])["avg10"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return pressure
+
+class MemoryController:
+
+    def __init__(self): ...
+    def start(self): ...
+    def stop(self): ...
+    def adjust(self): ...
+
+    def _host_state(self): ...
+    def _balloon_target(self, state, vm, actual, guest_available): ...
+    def _tune_ksm(self, state): ...
+    def _run(self): ...
+
+    # vms_func returns the running VMs as dicts with vm_name, qmp, memory_mib
+    # and instance_type. Every interval the controller reads host memory and
+    # PSI and resizes guest balloons: shrinking guests that have memory to
+    # spare while the host is under pressure, never below their instance
+    # type's floor, and giving memory back once the pressure is gone.
+    def __init__(self, vms_func, floors=None, interval=5.0, low_watermark=0.10, high_watermark=0.25,
+                 psi_threshold=10.0, proc_root="/proc", ksm_root="/sys/kernel/mm/ksm"):
+        self._vms_func = vms_func
+        self._floors = dict(floors or {})
+        self._interval = interval
+        self._low_watermark = low_watermark
+        self._high_watermark = high_watermark
+        self._psi_threshold = psi_threshold
+        self._proc_root = proc_root
+        self._ksm_root = ksm_root
+        self._vm_names = set()
+        self._skipped_vms = set()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if (self._thread != None):
+            return
+
+        self._thread = threading.Thread(target=self._run, name="memory-controller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    # Runs one round of the controller and returns the balloon targets it
+    # set as {vm_name: bytes}.
+    def adjust(self):
+        state = self._host_state()
+        self._tune_ksm(state)
+
+        targets = {}
+        vm_names = set()
+        for vm in self._vms_func():
+            vm_names.add(vm["vm_name"])
+            if (vm["vm_name"] in self._skipped_vms):
+                continue
+            try:
+                actual = vm["qmp"].execute("query-balloon")["actual"]
+                stats = vm["qmp"].execute("qom-get",
+                    {"path": "/machine/peripheral/balloon0", "property": "guest-stats"})
+                guest_available = stats["stats"].get("stat-available-memory", -1)
+
+                BALLOON_ACTUAL.labels(vm=vm["vm_name"]).set(actual)
+                target = self._balloon_target(state, vm, actual, guest_available)
+                if (abs(target - actual) < MIB):
+                    continue
+
+                vm["qmp"].execute("balloon", {"value": target})
+                targets[vm["vm_name"]] = target
+                BALLOON_TARGET.labels(vm=vm["vm_name"]).set(target)
+                BALLOON_ADJUSTMENTS.labels(direction="inflate" if target < actual else "deflate").inc()
+            except Exception as e:
+                # VMs started without a balloon device keep failing, so they
+                # are only reported once. Any other error, e.g. a QMP timeout,
+                # is retried on the next round, a balloon left inflated would
+                # otherwise keep the guest squeezed.
+                print(f"Failed to adjust balloon of vm {vm['vm_name']}: {e}")
+                if (isinstance(e, QMPError) and e.error_class in NO_BALLOON_ERRORS):
+                    self._skipped_vms.add(vm["vm_name"])
+
+        for vm_name in self._vm_names - vm_names:
+            for gauge in [BALLOON_ACTUAL, BALLOON_TARGET]:
+                try:
+                    gauge.remove(vm_name)
+                except KeyError:
+                    pass
+        self._vm_names = vm_names
+        self._skipped_vms &= vm_names
+
+        return targets
+
+    def _host_state(self):
+        memory = psutil.virtual_memory()
+        pressure = read_memory_pressure(self._proc_root)
+
+        HOST_MEMORY_AVAILABLE.set(memory.available)
+        for kind, avg10 in pressure.items():
+            HOST_MEMORY_PRESSURE.labels(kind=kind).set(avg10)
+
+        available = memory.available / memory.total
+        if (available < self._low_watermark or pressure["some"] > self._psi_threshold):
+            state = "pressure"
+        elif (available > self._high_watermark and pressure["some"] < self._psi_threshold / 2):
+            state = "relaxed"
+        else:
+            state = "steady"
+
+        for controller_state in CONTROLLER_STATES:
+            MEMORY_CONTROLLER_STATE.labels(state=controller_state).set(int(controller_state == state))
+        return state
+
+    # Balloons move by at most a tenth of the guest's memory per round and
+    # always leave the guest some headroom, so a busy guest is never squeezed
+    # into swapping. Guests without balloon stats are left alone under
+    # pressure since there is no telling what they can spare.
+    def _balloon_target(self, state, vm, actual, guest_available):
+        memory = vm["memory_mib"] * MIB
+        floor = floor_bytes(self._floors.get(vm["instance_type"], DEFAULT_BALLOON_FLOOR), vm["memory_mib"])
+        step = vm["memory_mib"] // 10 * MIB
+        headroom = max(64 * MIB, actual // 10)
+
+        if (state == "pressure"):
+            if (guest_available < 0):
+                return actual
+            spare = max(guest_available - headroom, 0)
+            return max(floor, actual - min(step, spare))
+
+        if (state == "relaxed" or (0 <= guest_available < headroom)):
+            return min(memory, actual + step)
+
+        return actual
+
+    def _tune_ksm(self, state):
+        pages_to_scan = KSM_PAGES_TO_SCAN_BY_STATE[state]
+        try:
+            for name, value in [("run", 1), ("pages_to_scan", pages_to_scan)]:
+                path = f"{self._ksm_root}/{name}"
+                with open(path, "r") as kf:
+                    if (kf.read().strip() == str(value)):
+                        continue
+                with open(path, "w") as kf:
+                    kf.write(str(value))
+
+            KSM_PAGES_TO_SCAN.set(pages_to_scan)
+            with open(f"{self._ksm_root}/pages_sharing", "r") as kf:
+                KSM_PAGES_SHARING.set(int(kf.read().strip()))
+        except (OSError, ValueError):
+            pass
+
+    def _run(self):
+        # Balloon adjustments are not latency critical, so the controller
+        # runs at a lower priority than the threads serving RPCs.
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except Exception:
+            pass
+
+        while not self._stopped.wait(self._interval):
+            try:
+                self.adjust()
+            except Exception as e:
+                print(f"Failed to run memory controller: {e}")
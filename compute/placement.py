@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import threading
+
+from .host_topology import discover_topology, free_hugepages, hugepage_mounts, parse_cpulist
+
+class PlacementEngine:
+
+    def __init__(self): ...
+    def place(self, vm_name, vcpus, memory_mib): ...
+    def adopt(self, vm_name, cpus, mem_path, memory_mib): ...
+    def release(self, vm_name): ...
+    def get_placement(self, vm_name): ...
+
+    def _record(self, vm_name, node_id, cpus, hugepage_size_kb, memory_mib): ...
+    def _free_cores(self, node_id): ...
+    def _pick_cpus(self, node_id, vcpus): ...
+    def _pick_hugepage_size(self, node_id, memory_mib): ...
+
+    # Every VM gets dedicated host CPUs from a single NUMA node and, when the
+    # node has enough free hugepages, hugepage backed memory bound to it.
+    # reserved_cpus are kept for the host and never handed to VMs.
+    def __init__(self, sysfs_root="/sys", proc_root="/proc", reserved_cpus=""):
+        self.sysfs_root = sysfs_root
+        self._topology = discover_topology(sysfs_root)
+        self._mounts = hugepage_mounts(proc_root)
+        self._reserved_cpus = set(parse_cpulist(reserved_cpus))
+        self._used_cpus = set()
+        self._used_hugepages = {}
+        self._placements = {}
+        self._lock = threading.Lock()
+
+    # Returns {"node", "cpus", "hugepage_size_kb", "hugepages", "mem_path"}, or
+    # None when no single node has enough free CPUs left for the VM.
+    def place(self, vm_name, vcpus, memory_mib):
+        with self._lock:
+            if (vm_name in self._placements):
+                return self._placements[vm_name]
+
+            # Nodes that can back the VM with hugepages come first, then the
+            # node the VM fills most tightly so that large VMs still find a
+            # node with enough free cores later on.
+            best = None
+            for node_id in self._topology:
+                cpus = self._pick_cpus(node_id, vcpus)
+                if (cpus == None):
+                    continue
+                hugepage_size_kb = self._pick_hugepage_size(node_id, memory_mib)
+                free_cpus = sum(len(core) for core in self._free_cores(node_id))
+                rank = (hugepage_size_kb == 0, free_cpus - vcpus, node_id)
+                if (best == None or rank < best[0]):
+                    best = (rank, node_id, cpus, hugepage_size_kb)
+
+            if (best == None):
+                return None
+
+            _, node_id, cpus, hugepage_size_kb = best
+            return self._record(vm_name, node_id, cpus, hugepage_size_kb, memory_mib)
+
+    # Records the placement of a VM that was already running before the
+    # server started, e.g. when reattaching to it.
+    def adopt(self, vm_name, cpus, mem_path="", memory_mib=0):
+        hugepage_size_kb = next((size_kb for size_kb, mount in self._mounts.items() if mount == mem_path), 0)
+        with self._lock:
+            if (vm_name in self._placements):
+                return self._placements[vm_name]
+
+            node_id = next((node_id for node_id, node in self._topology.items()
+                if set(cpus) <= set(cpu for core in node["cores"] for cpu in core)), None)
+            if (node_id == None):
+                return None
+            return self._record(vm_name, node_id, sorted(cpus), hugepage_size_kb, memory_mib)
+
+    def release(self, vm_name):
+        with self._lock:
+            placement = self._placements.pop(vm_name, None)
+            if (placement == None):
+                return
+
+            self._used_cpus.difference_update(placement["cpus"])
+            if (placement["hugepages"]):
+                key = (placement["node"], placement["hugepage_size_kb"])
+                self._used_hugepages[key] -= placement["hugepages"]
+
+    def get_placement(self, vm_name):
+        with self._lock:
+            return self._placements.get(vm_name)
+
+    def _record(self, vm_name, node_id, cpus, hugepage_size_kb, memory_mib):
+        hugepages = 0
+        if (hugepage_size_kb):
+            hugepages = memory_mib * 1024 // hugepage_size_kb
+            key = (node_id, hugepage_size_kb)
+            self._used_hugepages[key] = self._used_hugepages.get(key, 0) + hugepages
+
+        self._used_cpus.update(cpus)
+        placement = {
+            "node": node_id,
+            "cpus": cpus,
+            "hugepage_size_kb": hugepage_size_kb,
+            "hugepages": hugepages,
+            "mem_path": self._mounts.get(hugepage_size_kb, ""),
+        }
+        self._placements[vm_name] = placement
+        return placement
+
+    def _free_cores(self, node_id):
+        cores = []
+        for core in self._topology[node_id]["cores"]:
+            free = [cpu for cpu in core if cpu not in self._used_cpus and cpu not in self._reserved_cpus]
+            if (free):
+                cores.append((len(free) == len(core), free))
+        return cores
+
+    # Whole cores are handed out first so that siblings serve the same VM.
+    # The remainder goes to cores that are already partly used, tightest fit
+    # first, and only then splits a free core.
+    def _pick_cpus(self, node_id, vcpus):
+        cores = self._free_cores(node_id)
+        if (sum(len(free) for _, free in cores) < vcpus):
+            return None
+
+        cpus = []
+        remaining = vcpus
+        leftover = []
+        for whole, free in cores:
+            if (whole and len(free) <= remaining):
+                cpus.extend(free)
+                remaining -= len(free)
+            else:
+                leftover.append((whole, free))
+
+        leftover.sort(key=lambda core: (core[0], len(core[1]) < remaining, len(core[1])))
+        for _, free in leftover:
+            if (remaining == 0):
+                break
+            cpus.extend(free[:remaining])
+            remaining -= len(free[:remaining])
+
+        return sorted(cpus)
+
+    # The largest hugepage size that evenly divides the guest memory and of
+    # which the node still has enough pages free, or 0 for regular pages.
+    def _pick_hugepage_size(self, node_id, memory_mib):
+        hugepages = self._topology[node_id]["hugepages"]
+        for size_kb in sorted(hugepages, reverse=True):
+            if (size_kb not in self._mounts or (memory_mib * 1024) % size_kb != 0):
+                continue
+
+            needed = memory_mib * 1024 // size_kb
+            reserved = self._used_hugepages.get((node_id, size_kb), 0)
+            available = min(hugepages[size_kb] - reserved,
+                free_hugepages(node_id, size_kb, self.sysfs_root))
+            if (needed <= available):
+                return size_kb
+
+        return 0
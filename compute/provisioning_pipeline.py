@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import queue
+import threading
+import time
+from concurrent import futures
+
+class ProvisioningPipeline:
+
+    def __init__(self): ...
+    def run(self, contexts): ...
+
+    def _submit(self, stage_num, ctx): ...
+    def _run_stage(self, stage_num, ctx): ...
+    def _fail(self, ctx, stage_name, error): ...
+
+    # stages is a list of (name, function, workers). Every context flows
+    # through the stages in order and each stage has its own worker pool, so
+    # a batch takes about as long as its slowest stage rather than the sum.
+    def __init__(self, stages, failure_handler=None):
+        self._stages = stages
+        self._failure_handler = failure_handler
+        self._executors = []
+        self._results = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def run(self, contexts):
+        self._results = queue.Queue()
+        self._futures = {}
+        self._executors = [
+            futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"provision-{name}")
+            for name, _, workers in self._stages
+        ]
+
+        try:
+            for ctx in contexts:
+                ctx["error"] = ""
+                ctx["stage_times"] = {}
+                ctx["start_time"] = time.monotonic()
+                self._submit(0, ctx)
+
+            for _ in range(len(contexts)):
+                ctx = self._results.get()
+                ctx["duration"] = time.monotonic() - ctx["start_time"]
+                yield ctx
+
+        finally:
+            # When the caller stops early, contexts still waiting for a stage
+            # are cancelled and cleaned up here, so that their taps, IPs and
+            # reservations are not left behind. Contexts in a stage are
+            # cleaned up by it once they cannot be handed to the next one.
+            with self._lock:
+                for executor in self._executors:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                cancelled = [ctx for ctx, future in self._futures.values() if future.cancelled()]
+                self._futures = {}
+
+            for ctx in cancelled:
+                self._fail(ctx, "cancelled", "provisioning was stopped")
+
+    # Submitting under the lock means a context is either recorded before
+    # the executors are shut down or fails to submit afterwards.
+    def _submit(self, stage_num, ctx):
+        with self._lock:
+            future = self._executors[stage_num].submit(self._run_stage, stage_num, ctx)
+            self._futures[id(ctx)] = (ctx, future)
+
+    def _run_stage(self, stage_num, ctx):
+        stage_name, stage_func, _ = self._stages[stage_num]
+
+        stage_start = time.monotonic()
+        try:
+            stage_func(ctx)
+        except Exception as e:
+            self._fail(ctx, stage_name, e)
+            return
+        ctx["stage_times"][stage_name] = time.monotonic() - stage_start
+
+        if (stage_num + 1 == len(self._stages)):
+            self._results.put(ctx)
+            return
+
+        try:
+            self._submit(stage_num + 1, ctx)
+        except RuntimeError as e:
+            self._fail(ctx, stage_name, e)
+
+    def _fail(self, ctx, stage_name, error):
+        ctx["error"] = f"{stage_name}: {error}"
+
+        if (self._failure_handler != None):
+            try:
+                self._failure_handler(ctx)
+            except Exception as e:
+                print(f"Failed to clean up after provisioning error: {e}")
+
+        self._results.put(ctx)
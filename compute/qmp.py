@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import json
+import socket
+import threading
+import time
+
+# error_class is the class QEMU gave the error, e.g. DeviceNotActive, and
+# empty for errors of the connection itself.
+class QMPError(Exception):
+
+    def __init__(self, message, error_class=""):
+        super().__init__(message)
+        self.error_class = error_class
+
+class QMPClient:
+
+    def __init__(self): ...
+    def connect(self, timeout, alive): ...
+    def close(self): ...
+    def is_connected(self): ...
+
+    def execute(self, cmd, arguments, timeout): ...
+
+    def _send(self, message): ...
+    def _read_message(self): ...
+    def _reader(self): ...
+
+    # event_handler is called from the reader thread with every QMP event and
+    # close_handler once the connection is gone, so neither may block on a
+    # command sent through this client.
+    def __init__(self, socket_path, event_handler=None, close_handler=None):
+        self.socket_path = socket_path
+        self.greeting = None
+        self._event_handler = event_handler
+        self._close_handler = close_handler
+        self._sock = None
+        self._rfile = None
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._reader_thread = None
+        self._connected = False
+
+    # alive is polled while the socket does not exist yet, so a QEMU that
+    # exits during startup fails the connect straight away.
+    def connect(self, timeout=5.0, alive=None):
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if (alive != None and not alive()):
+                    raise QMPError(f"Process exited before {self.socket_path} was ready")
+                if (time.monotonic() >= deadline):
+                    raise QMPError(f"Timed out connecting to {self.socket_path}")
+                time.sleep(0.01)
+
+        sock.settimeout(max(deadline - time.monotonic(), 0.1))
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+
+        try:
+            self.greeting = self._read_message()
+            if (self.greeting == None or "QMP" not in self.greeting):
+                raise QMPError(f"Unexpected QMP greeting: {self.greeting}")
+
+            self._send({"execute": "qmp_capabilities", "id": "capabilities"})
+            while True:
+                reply = self._read_message()
+                if (reply == None):
+                    raise QMPError("Connection closed during QMP negotiation")
+                if (reply.get("id") == "capabilities"):
+                    break
+            if ("error" in reply):
+                raise QMPError(reply["error"].get("desc", "qmp_capabilities failed"))
+
+        except (OSError, ValueError) as e:
+            self._rfile.close()
+            sock.close()
+            raise QMPError(f"QMP negotiation failed: {e}")
+
+        sock.settimeout(None)
+        self._connected = True
+        self._reader_thread = threading.Thread(target=self._reader,
+            name=f"qmp-{self.socket_path}", daemon=True)
+        self._reader_thread.start()
+
+        return self.greeting
+
+    def close(self):
+        self._connected = False
+        if (self._sock != None):
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+
+    def is_connected(self):
+        return self._connected
+
+    def execute(self, cmd, arguments=None, timeout=5.0):
+        if (not self._connected):
+            raise QMPError(f"Not connected to {self.socket_path}")
+
+        with self._pending_lock:
+            self._next_id += 1
+            request_id = self._next_id
+            waiter = {"event": threading.Event(), "reply": None}
+            self._pending[request_id] = waiter
+
+        message = {"execute": cmd, "id": request_id}
+        if (arguments):
+            message["arguments"] = arguments
+
+        try:
+            self._send(message)
+            if (not waiter["event"].wait(timeout)):
+                raise QMPError(f"Timed out waiting for {cmd}")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+        reply = waiter["reply"]
+        if (reply == None):
+            raise QMPError(f"Connection closed while waiting for {cmd}")
+        if ("error" in reply):
+            raise QMPError(reply["error"].get("desc", f"{cmd} failed"), reply["error"].get("class", ""))
+
+        return reply.get("return")
+
+    def _send(self, message):
+        data = json.dumps(message).encode() + b"\n"
+        with self._send_lock:
+            self._sock.sendall(data)
+
+    # QMP replies and events are each a single JSON object terminated by a
+    # newline, so reading whole lines never splits or truncates a message.
+    def _read_message(self):
+        line = self._rfile.readline()
+        if (not line):
+            return None
+        return json.loads(line)
+
+    def _reader(self):
+        try:
+            while True:
+                message = self._read_message()
+                if (message == None):
+                    break
+
+                if ("event" in message):
+                    if (self._event_handler != None):
+                        try:
+                            self._event_handler(message)
+                        except Exception as e:
+                            print(f"Failed to handle QMP event {message['event']}: {e}")
+                    continue
+
+                with self._pending_lock:
+                    waiter = self._pending.get(message.get("id"))
+                if (waiter != None):
+                    waiter["reply"] = message
+                    waiter["event"].set()
+
+        except (OSError, ValueError):
+            pass
+
+        self._connected = False
+        with self._pending_lock:
+            for waiter in self._pending.values():
+                waiter["event"].set()
+
+        if (self._close_handler != None):
+            self._close_handler()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import json
+import os
+import threading
+
+def template_name(image, instance_type):
+    return f"{image}.{instance_type}"
+
+class TemplateStore:
+
+    def __init__(self): ...
+    def get_template(self, name): ...
+    def get_templates(self): ...
+    def put_template(self, template): ...
+    def remove_template(self, name): ...
+
+    def _save_catalog(self): ...
+
+    # A template is a VM that was booted once from an image and saved, its
+    # disk as a read-only snapshot and its device and memory state next to
+    # it. The catalog records what each template was built from so that it
+    # can be dropped once the image or instance type changes.
+    def __init__(self, location="/IGS/compute/templates"):
+        self.location = location
+        self.catalog_path = f"{location}/catalog.json"
+        self._templates = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.location, exist_ok=True)
+        if (os.path.exists(self.catalog_path)):
+            with open(self.catalog_path, "r") as cf:
+                self._templates = json.load(cf)
+
+    def get_template(self, name):
+        with self._lock:
+            template = self._templates.get(name)
+            return dict(template) if template != None else None
+
+    def get_templates(self):
+        with self._lock:
+            return [dict(self._templates[name]) for name in sorted(self._templates)]
+
+    def put_template(self, template):
+        with self._lock:
+            self._templates[template["name"]] = dict(template)
+            self._save_catalog()
+
+    def remove_template(self, name):
+        with self._lock:
+            if (self._templates.pop(name, None) == None):
+                return
+            self._save_catalog()
+
+    def _save_catalog(self):
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, "w") as cf:
+            json.dump(self._templates, cf, separators=(",", ":"))
+            cf.flush()
+            os.fsync(cf.fileno())
+        os.replace(tmp_path, self.catalog_path)
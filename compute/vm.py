@@ -20,7 +20,8 @@ class VM:
     def __init__(self): ...
 
     def __init__(self, vm_name, disk_location, tap_intf=None, hv_conn=None,
-                 serial_conn=None, ip_address=None, mac_address=None):
+                 serial_conn=None, ip_address=None, mac_address=None, pid=None,
+                 instance_type=None):
         self.name = vm_name
         self.disk_location = disk_location
         self.tap_intf = tap_intf
@@ -28,3 +29,5 @@ class VM:
         self.serial_conn = serial_conn
         self.ip_address = ip_address
         self.mac_address = mac_address
+        self.pid = pid
+        self.instance_type = instance_type
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import collections
+import itertools
+import threading
+import time
+
+VM_EVENT_TYPES = ["ADDED", "MODIFIED", "DELETED"]
+
+class VMEventLog:
+
+    def __init__(self): ...
+    def publish(self, event_type, vm_name, status): ...
+    def snapshot(self): ...
+    def events_since(self, resource_version): ...
+    def wait(self, resource_version, timeout): ...
+
+    # Every change to a VM's status is recorded once with a resource version
+    # that grows by one per event, and the last history events are kept so
+    # that watchers which disconnected can pick up from the last version
+    # they saw. Watchers share the log and only wake up when it grows, so
+    # more of them cost no extra work on the VM operations publishing events.
+    def __init__(self, history=4096):
+        self._events = collections.deque(maxlen=history)
+        self._statuses = {}
+        self._cond = threading.Condition()
+        # Versions start at the current time in milliseconds, so they keep
+        # growing across server restarts and a version from before a
+        # restart is never mistaken for a newer one.
+        self._version = int(time.time() * 1000)
+
+    def publish(self, event_type, vm_name, status=""):
+        with self._cond:
+            # A VM's last status change can race with its deletion, it is
+            # dropped rather than bringing the VM back.
+            if (event_type == "MODIFIED" and self._statuses.get(vm_name, status) == status):
+                return
+            if (event_type == "DELETED"):
+                self._statuses.pop(vm_name, None)
+            else:
+                self._statuses[vm_name] = status
+
+            self._version += 1
+            self._events.append({
+                "type": event_type,
+                "vm_name": vm_name,
+                "status": status,
+                "resource_version": self._version,
+            })
+            self._cond.notify_all()
+
+    # Returns the current resource version and the status of every VM as of
+    # that version.
+    def snapshot(self):
+        with self._cond:
+            return self._version, dict(self._statuses)
+
+    # Returns the events after resource_version, or None when some of them
+    # are no longer kept and the watcher has to start from a snapshot.
+    def events_since(self, resource_version):
+        with self._cond:
+            if (resource_version > self._version):
+                return None
+            if (resource_version == self._version):
+                return []
+
+            first_version = self._events[0]["resource_version"] if self._events else self._version + 1
+            if (resource_version < first_version - 1):
+                return None
+            return list(itertools.islice(self._events, resource_version - first_version + 1, None))
+
+    def wait(self, resource_version, timeout=1.0):
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version > resource_version, timeout)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import bisect
+import collections
+import threading
+
+class VMIndex:
+
+    def __init__(self): ...
+    def add(self, vm_name, status, labels): ...
+    def remove(self, vm_name): ...
+    def set_status(self, vm_name, status): ...
+    def set_labels(self, vm_name, labels): ...
+    def get_labels(self, vm_name): ...
+    def query(self, status, labels, page_token, page_size): ...
+
+    def _set_status(self, vm_name, status): ...
+    def _set_labels(self, vm_name, labels): ...
+    def _discard(self, index, key, vm_name): ...
+
+    # VM names are kept sorted and indexed by status and by label, and the
+    # indexes are updated on every change, so a listing only touches the
+    # VMs it returns instead of scanning all of them.
+    def __init__(self):
+        self._names = []
+        self._statuses = {}
+        self._labels = {}
+        self._by_status = collections.defaultdict(set)
+        self._by_label = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, vm_name, status, labels=None):
+        with self._lock:
+            if (vm_name not in self._statuses):
+                bisect.insort(self._names, vm_name)
+                self._labels[vm_name] = {}
+            self._set_status(vm_name, status)
+            self._set_labels(vm_name, labels or {})
+
+    def remove(self, vm_name):
+        with self._lock:
+            status = self._statuses.pop(vm_name, None)
+            if (status == None):
+                return
+            del self._names[bisect.bisect_left(self._names, vm_name)]
+            self._discard(self._by_status, status, vm_name)
+            for label in self._labels.pop(vm_name).items():
+                self._discard(self._by_label, label, vm_name)
+
+    def set_status(self, vm_name, status):
+        with self._lock:
+            if (vm_name in self._statuses):
+                self._set_status(vm_name, status)
+
+    def set_labels(self, vm_name, labels):
+        with self._lock:
+            if (vm_name in self._statuses):
+                self._set_labels(vm_name, labels)
+
+    def get_labels(self, vm_name):
+        with self._lock:
+            return dict(self._labels.get(vm_name, {}))
+
+    # Returns up to page_size VM names in name order that have the given
+    # status and all of the given labels, starting after page_token, and the
+    # token of the next page, which is "" on the last one. An empty status
+    # or "all" matches every status, and a page_size of 0 returns every
+    # match.
+    def query(self, status="", labels=None, page_token="", page_size=500):
+        with self._lock:
+            candidates = []
+            if (status not in ["", "all"]):
+                candidates.append(self._by_status.get(status, set()))
+            for label in (labels or {}).items():
+                candidates.append(self._by_label.get(label, set()))
+
+            if (len(candidates) == 0):
+                names = self._names
+            else:
+                candidates.sort(key=len)
+                names = sorted(candidates[0].intersection(*candidates[1:]))
+
+            start = bisect.bisect_right(names, page_token) if page_token else 0
+            end = start + page_size if page_size else len(names)
+            page = names[start:end]
+
+        next_page_token = page[-1] if end < len(names) else ""
+        return page, next_page_token
+
+    def _set_status(self, vm_name, status):
+        previous = self._statuses.get(vm_name)
+        if (previous != None):
+            self._discard(self._by_status, previous, vm_name)
+        self._statuses[vm_name] = status
+        self._by_status[status].add(vm_name)
+
+    def _set_labels(self, vm_name, labels):
+        for label in self._labels[vm_name].items():
+            self._discard(self._by_label, label, vm_name)
+        self._labels[vm_name] = dict(labels)
+        for label in self._labels[vm_name].items():
+            self._by_label[label].add(vm_name)
+
+    def _discard(self, index, key, vm_name):
+        index[key].discard(vm_name)
+        if (len(index[key]) == 0):
+            del index[key]
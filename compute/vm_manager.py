@@ -12,17 +12,33 @@ import subprocess
 import socket
 import time
 import shutil
-import select
 import re
 import grpc
 import json
+import threading
+import shlex
+import signal
 from concurrent import futures
 
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
-
-from .distro_manager import DistroManager
+from .distro_manager import DistroManager, DEFAULT_IMAGE
+from .image_builder import ImageBuilder
+from .memory_controller import MemoryController
+from .vm_metrics import VMMetricsSampler
+from .provisioning_pipeline import ProvisioningPipeline
+from .key_pool import KeyPool
+from . import cloud_init
+from .warm_pool import WarmPool, WARM_MARKER
+from .qmp import QMPClient
+from .inventory import Inventory
+from .instance_catalog import InstanceCatalog, config_resources
+from .capacity import CapacityManager
+from .placement import PlacementEngine
+from .host_topology import format_cpulist
+from .template_store import TemplateStore, template_name
+from .vm_events import VMEventLog
+from .vm_index import VMIndex
+from .console_hub import ConsoleHub, CONSOLE_LOG_SIZE
+from .guest_agent import GuestAgentManager, GuestAgentError
 from .vm import VM
 from .generated import compute_pb2
 from .generated import compute_pb2_grpc
@@ -30,51 +46,258 @@ from .generated import compute_pb2_grpc
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from network.network_manager import NetworkManager
 
+VM_EVENT_STATUS = {
+    "STOP": "stopped",
+    "RESUME": "running",
+    "POWERDOWN": "shutting_down",
+    "SHUTDOWN": "down",
+}
+
+VM_READINESS = ["qmp", "serial", "agent"]
+
+DEFAULT_STATE_ROOT = "/IGS/compute"
+
+QEMU_RUN_STATE_STATUS = {
+    "running": "running",
+    "paused": "stopped",
+    "suspended": "stopped",
+    "shutdown": "down",
+    "postmigrate": "migrated",
+}
+
+# Statuses a VM moves through while its state is saved, loaded or migrated
+# to another server. QEMU events do not change these. A VM is left
+# "migrated" when its memory reached the target but the target did not
+# confirm taking it over, and it is not started or resumed here again.
+VM_TRANSITION_STATUSES = ["hibernating", "restoring", "migrating", "migrated"]
+
+# QEMU throttles migrations to 128MiB/s by default, far below what local
+# disks and host networks sustain.
+MIGRATION_MAX_BANDWIDTH = 64 * 1024 ** 3
+
+MIGRATION_MULTIFD_CHANNELS = 4
+
+DESCRIBE_PAGE_SIZE = 500
+DESCRIBE_MAX_PAGE_SIZE = 5000
+
+# How often an idle watcher checks whether its client is still connected.
+WATCH_WAKEUP_INTERVAL = 1.0
+
+# ExecVMs runs a command on this many VMs at once, each one only waits on
+# its guest agent.
+GUEST_EXEC_CONCURRENCY = 64
+
+# Files in a VM's directory that are not sent along when it is migrated.
+# The disk is mirrored by QEMU instead.
+MIGRATION_SKIPPED_FILES = ["qemu.log", WARM_MARKER]
+
+# The VM's SSH private key. Migrations go over a plaintext gRPC channel, so
+# it is only sent along when the server is started with
+# --migrate-private-keys.
+MIGRATION_PRIVATE_KEY = "id_rsa"
+
+# Serial output spilled from a VM's console log, see ConsoleHub.
+CONSOLE_LOG_NAME = "console.log"
+
+# Run through the guest agent in VMs restored from a template, which come up
+# with the template's MAC, IP, SSH key and host keys.
+IDENTITY_SCRIPT = """set -e
+iface=$(ip -o link | grep -i "link/ether {template_mac}" | cut -d: -f2 | tr -d ' ')
+ip link set dev "$iface" address {mac_address}
+sed -i -e 's/macaddress: .*/macaddress: "{mac_address}"/' -e 's#- [0-9.]*/24#- {ip_address}/24#' /etc/netplan/99-netcfg.yaml
+netplan apply
+echo {public_key} > /home/ubuntu/.ssh/authorized_keys
+rm -f /etc/ssh/ssh_host_*
+ssh-keygen -A
+systemctl restart ssh
+"""
+
+def find_free_port():
+    with socket.socket() as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+# Maps VM names to the pids of the QEMU processes serving them, found through
+# the QMP socket path on each process's command line. VMs started by earlier
+# releases have a human monitor on the same socket path instead, they are
+# returned separately since they cannot be reattached.
+def find_qemu_processes(run_location="/tmp"):
+    qemu_pids = {}
+    legacy_pids = {}
+    for pid in os.listdir("/proc"):
+        if (not pid.isdigit()):
+            continue
+
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as cf:
+                cmdline = cf.read().split(b"\0")
+        except OSError:
+            continue
+
+        if (not cmdline[0].endswith(b"qemu-system-x86_64")):
+            continue
+
+        for i, arg in enumerate(cmdline[:-1]):
+            if (arg not in [b"-qmp", b"-monitor"]):
+                continue
+            match = re.match(rf"unix:{re.escape(run_location)}/([^/,]+)\.sock", cmdline[i + 1].decode(errors="replace"))
+            if (match and arg == b"-qmp"):
+                qemu_pids[match.group(1)] = int(pid)
+            elif (match):
+                legacy_pids[match.group(1)] = int(pid)
+
+    return qemu_pids, legacy_pids
+
 class VMManager():
 
     def __init__(self): ...
     def connect(self): ...
 
     def get_vms(self): ...
+    def describe_vms(self, status, labels, page_token, page_size): ...
+    def watch_vms(self, resource_version, is_active): ...
+    def open_console(self, vm_name, read_only): ...
+    def get_console_log(self, vm_name, offset, tail, follow, is_active): ...
+    def exec_vms(self, vm_names, labels, script, input_data, timeout, is_active): ...
 
     def create_vm(self): ...
+    def create_vms(self, count, instance_type, image): ...
+    def clone_vms(self, source_vm, count, instance_type): ...
+    def build_template(self, image, instance_type): ...
+    def get_templates(self): ...
+    def delete_template(self, name): ...
+    def create_vm_from_template(self, instance_type, image): ...
+    def get_images(self): ...
+    def pull_image(self, name, url, sha256, image_format): ...
+    def build_image(self, name, source): ...
+    def get_image_builds(self): ...
+    def get_warm_pool_stats(self): ...
+    def get_instance_types(self): ...
+    def get_capacity(self): ...
+    def update_vm_disks(self, vm_name, disks): ...
+    def set_vm_labels(self, vm_name, labels): ...
     def delete_vm(self): ...
     def allocate_vm_disk(self, vm_id): ...
-    def copy_image(self, vm_id): ...
+    def copy_image(self, vm_id, image): ...
     def write_vm_config(self, vm_id): ...
 
     def start_vm(self): ...
+    def start_vms(self, vm_names, wait_for): ...
     def shutdown_vm(self): ...
     def resume_vm(self): ...
     def stop_vm(self): ...
+    def hibernate_vm(self, vm_name): ...
+    def restore_vm(self, vm_name): ...
+    def migrate_vm(self, vm_name, target_endpoint): ...
+    def prepare_incoming_migration(self, vm_record, files, backing_file, backing_format, disk_size): ...
+    def finish_incoming_migration(self, vm_name, success, running): ...
 
     def get_vm_status(self): ...
     def get_vm_link(self): ...
 
-    def update_vm_cloud_init(self, vm_name, old_string="", new_string=""): ...
-
-    def _send_command_to_vm(self, curr_vm, cmd): ...
-
-    def __init__(self, network_manager):
+    def _send_command_to_vm(self, curr_vm, cmd, arguments, timeout): ...
+    def _connect_qmp(self, vm_name, timeout, alive): ...
+    def _handle_vm_event(self, vm_name, event): ...
+    def _handle_vm_exit(self, vm_name): ...
+    def _set_vm_status(self, vm_name, vm_dict, status): ...
+    def _get_vm_lock(self, vm_name): ...
+    def _memory_args(self, placement, vcpus, memory_mib): ...
+    def _pin_vcpus(self, qmp, placement): ...
+    def _read_vm_placement(self, vm_name, qmp): ...
+    def _get_balloon_vms(self): ...
+    def _get_metric_vms(self): ...
+    def _get_vm_state_path(self, vm_name): ...
+    def _wait_for_migration(self, qmp, timeout): ...
+    def _wait_for_block_job(self, qmp, job_id, timeout): ...
+    def _get_vm_drive(self, curr_vm): ...
+    def _snapshot_clone_source(self, source_vm, instance_type): ...
+    def _snapshot_vm_disk(self, vm_name, vm_dict): ...
+    def _create_clone_disk(self, ctx): ...
+    def _collect_snapshots(self): ...
+    def _hold_snapshot(self, snapshot_id): ...
+    def _drop_snapshot(self, snapshot_id): ...
+    def _build_template(self, image, instance_type): ...
+    def _get_valid_template(self, image, instance_type): ...
+    def _restore_template(self, ctx, template): ...
+    def _apply_vm_identity(self, vm_name, ctx, template): ...
+    def _stop_qemu(self, qmp, pid): ...
+    def _guest_exec(self, vm_name, script, timeout): ...
+    def _exec_vm(self, vm_name, script, input_data, timeout): ...
+
+    def __init__(self, network_manager, key_type="rsa", key_pool_size=32, warm_pool_targets=None,
+                 cpu_overcommit=1.0, memory_overcommit=1.0, reserved_memory_mib=1024, reserved_cpus="",
+                 golden_images=None, golden_image_interval=24 * 3600, balloon_floors=None,
+                 hibernate_location="", state_root=DEFAULT_STATE_ROOT, accel="", console_log_size=CONSOLE_LOG_SIZE,
+                 console_log_files=0, vm_metrics_interval=10.0, migrate_private_keys=False):
         self._uri = "qemu:///system"
         self._conn = None
         self._logger = None
-        self._vm_location = "/IGS/compute/vms"
+        # Everything a server keeps per VM lives under state_root, so that
+        # two servers can run side by side on one host, e.g. to test
+        # migrations. Images are shared between them. The default root keeps
+        # its sockets in /tmp, where VMs started by earlier versions have them.
+        self._state_root = state_root
+        self._vm_location = f"{state_root}/vms"
+        os.makedirs(self._vm_location, exist_ok=True)
+        self._run_location = "/tmp" if state_root == DEFAULT_STATE_ROOT else f"{state_root}/run"
+        os.makedirs(self._run_location, exist_ok=True)
+        self._accel = accel
+        self._migrate_private_keys = migrate_private_keys
+        self._hibernate_location = hibernate_location or f"{state_root}/hibernate"
+        os.makedirs(self._hibernate_location, exist_ok=True)
+        self._snapshot_location = f"{state_root}/snapshots"
+        os.makedirs(self._snapshot_location, exist_ok=True)
+        self._snapshot_lock = threading.Lock()
+        self._pending_snapshots = {}
+        self._template_store = TemplateStore(f"{state_root}/templates")
+        self._template_builds = set()
+        self._template_lock = threading.Lock()
+        self._template_executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="template-build")
         self._vms = {}
+        self._vms_lock = threading.Lock()
+        self._vm_locks = {}
+        self._incoming = {}
+        self._legacy_qemu_pids = {}
+        self._vm_events = VMEventLog()
+        self._vm_index = VMIndex()
+        self._console_hub = ConsoleHub(log_size=console_log_size, log_files=console_log_files)
+        self._guest_agent = GuestAgentManager(self._run_location)
         self._distro_manager = DistroManager()
+        self._image_builder = ImageBuilder(self._distro_manager)
         self.network_manager = network_manager
-
-        count = 0
-        for vm_name in os.listdir(f"{self._vm_location}/"):
-            vm_tap_intf = self.network_manager.allocate_vm_tap_interface(vm_name)
-            vm_ip = self.network_manager.get_vm_ip(vm_name)
-            vm_mac_addr = self.network_manager.get_vm_mac(vm_name)
-            vm = VM(vm_name, disk_location=f"{self._vm_location}/{vm_name}/{vm_name}.qcow2", tap_intf=vm_tap_intf,
-                    ip_address=vm_ip,
-                    mac_address=vm_mac_addr)
-            self._vms[vm_name] = {"instance": vm, "status": "down"}
-
-            count += 1
+        self._key_pool = KeyPool(key_type=key_type, size=key_pool_size,
+            refill_threshold=max(1, key_pool_size // 4), spool_location=f"{state_root}/keys")
+        self._warm_pool = WarmPool(self._provision_warm_vm, targets=warm_pool_targets)
+        self._catalog = InstanceCatalog()
+        self._capacity = CapacityManager(cpu_overcommit=cpu_overcommit,
+            memory_overcommit=memory_overcommit, reserved_memory_mib=reserved_memory_mib)
+        self._placement = PlacementEngine(reserved_cpus=reserved_cpus)
+        self._memory_controller = MemoryController(self._get_balloon_vms, floors=balloon_floors)
+        self._vm_metrics = VMMetricsSampler(self._get_metric_vms, interval=vm_metrics_interval)
+
+        self._inventory = Inventory(location=state_root)
+        self._network_ready = threading.Event()
+
+        if (self._inventory.exists()):
+            vm_records = self._inventory.load()
+        else:
+            vm_records = self._scan_vm_inventory()
+
+        for vm_record in vm_records.values():
+            self._load_vm_record(vm_record)
+
+        self._reattach_running_vms()
+
+        self._key_pool.start()
+        self._warm_pool.start()
+        self._image_builder.schedule(golden_images or {}, interval=golden_image_interval)
+        self._memory_controller.start()
+        self._vm_metrics.start()
+        self._console_hub.start()
+
+        reconcile_thread = threading.Thread(target=self._reconcile_network,
+            name="network-reconcile", daemon=True)
+        reconcile_thread.start()
 
         self.connect()
 
@@ -90,49 +313,920 @@ class VMManager():
             print(f'Connection error: {e}', file=sys.stderr)
             return False
 
-    def get_vms(self, status=""):
-        vm_names = []
+    # Only used when there is no inventory yet, e.g. on the first start after
+    # an upgrade. Every later start loads the inventory instead.
+    def _scan_vm_inventory(self):
+        self.network_manager.ip_manager.inventory_ips(self._vm_location)
+
+        for vm_name in os.listdir(f"{self._vm_location}/"):
+            try:
+                vm_ip = self.network_manager.get_vm_ip(vm_name)
+            except KeyError:
+                vm_ip = ""
+
+            warm_marker = f"{self._vm_location}/{vm_name}/{WARM_MARKER}"
+            warm = ""
+            if (os.path.exists(warm_marker)):
+                with open(warm_marker, "r") as wf:
+                    warm = wf.read().strip()
+
+            self._inventory.put_vm(self._vm_record({
+                "vm_name": vm_name,
+                "instance_type": warm,
+                "tap_intf": self.network_manager.get_vm_tap_name(vm_name),
+                "ip_address": vm_ip,
+                "mac_address": self.network_manager.get_vm_mac(vm_name, self._vm_location) or "",
+            }, warm=warm))
+
+        return self._inventory.get_vms()
+
+    def _vm_record(self, ctx, warm=""):
+        vm_name = ctx["vm_name"]
+        return {
+            "name": vm_name,
+            "ip_address": ctx["ip_address"],
+            "mac_address": ctx["mac_address"],
+            "tap_intf": ctx["tap_intf"],
+            "instance_type": ctx["instance_type"],
+            "disk_location": f"{self._vm_location}/{vm_name}/{vm_name}.qcow2",
+            "disks": ctx.get("disks", []),
+            "warm": warm,
+            "image": ctx.get("image", DEFAULT_IMAGE),
+            "snapshot": ctx.get("snapshot", ""),
+            "labels": ctx.get("labels", {}),
+        }
+
+    def _load_vm_record(self, vm_record):
+        vm_name = vm_record["name"]
+
+        if (vm_record["ip_address"]):
+            self.network_manager.ip_manager.reserve_ip(vm_name, vm_record["ip_address"])
+        self.network_manager.reserve_mac(vm_record["mac_address"])
+
+        # Hibernated VMs hold no host resources until they are restored.
+        hibernated = os.path.exists(self._get_vm_state_path(vm_name))
+        if (not hibernated):
+            self._capacity.reserve(vm_name, self._get_vm_resources(vm_name, vm_record["instance_type"]),
+                force=True)
+
+        if (vm_record["warm"]):
+            self._warm_pool.add({"vm_name": vm_name, "instance_type": vm_record["warm"],
+                "tap_intf": vm_record["tap_intf"], "ip_address": vm_record["ip_address"],
+                "mac_address": vm_record["mac_address"]})
+            return
+
+        vm = VM(vm_name, disk_location=vm_record["disk_location"], tap_intf=vm_record["tap_intf"],
+                ip_address=vm_record["ip_address"],
+                mac_address=vm_record["mac_address"],
+                instance_type=vm_record["instance_type"])
+        self._vms[vm_name] = {"instance": vm, "status": "hibernated" if hibernated else "down"}
+        self._vm_locks[vm_name] = threading.RLock()
+        self._vm_index.add(vm_name, self._vms[vm_name]["status"], vm_record.get("labels"))
+        self._vm_events.publish("ADDED", vm_name, self._vms[vm_name]["status"])
+
+    # Taps and the bridge are brought up in one batch in the background so
+    # that loading the inventory never waits on ip or ovs-vsctl. Creating or
+    # starting a VM waits for this to finish.
+    def _reconcile_network(self):
+        tap_names = [vm_record["tap_intf"] for vm_record in self._inventory.get_vms().values()]
+        try:
+            self.network_manager.reconcile_vm_taps(tap_names)
+        except Exception as e:
+            print(f"Failed to reconcile VM network interfaces: {e}")
+        self._network_ready.set()
+
+    # QEMU processes outlive a server restart since they run in their own
+    # session, so reconnect to them instead of reporting their VMs as down.
+    # A human monitor cannot be turned into QMP while QEMU runs, so VMs still
+    # running from before the upgrade to QMP stay down here until they are
+    # shut down from inside the guest. Until then they cannot be started
+    # again, which would remove their monitor socket and boot a second QEMU
+    # on the same disk.
+    def _reattach_running_vms(self):
+        qemu_pids, legacy_pids = find_qemu_processes(self._run_location)
+
+        for vm_name, pid in legacy_pids.items():
+            if (vm_name in self._vms):
+                print(f"Not reattaching vm {vm_name} (pid {pid}), it was started with a monitor that is not QMP")
+                self._legacy_qemu_pids[vm_name] = pid
+
+        vm_names = [vm_name for vm_name in self._vms if vm_name in qemu_pids]
+        if (len(vm_names) == 0):
+            return
+
+        with futures.ThreadPoolExecutor(max_workers=min(len(vm_names), 16)) as executor:
+            for vm_name in vm_names:
+                executor.submit(self._reattach_vm, vm_name, qemu_pids[vm_name])
+
+    def _reattach_vm(self, vm_name, pid):
+        vm_dict = self._vms[vm_name]
+        curr_vm = vm_dict["instance"]
+        try:
+            qmp = self._connect_qmp(vm_name, timeout=2.0)
+
+            serial_port = None
+            for chardev in qmp.execute("query-chardev"):
+                if (chardev["label"] == "serial0" and chardev["filename"].startswith("pty:")):
+                    serial_port = chardev["filename"][len("pty:"):]
+            if (serial_port != None):
+                self._console_hub.attach_vm(vm_name, serial_port,
+                    spill_path=f"{self._vm_location}/{vm_name}/{CONSOLE_LOG_NAME}")
+
+            run_state = qmp.execute("query-status")["status"]
+        except Exception as e:
+            print(f"Failed to reattach to vm {vm_name} (pid {pid}): {e}")
+            return
+
+        self._read_vm_placement(vm_name, qmp)
+
+        curr_vm.hv_conn = qmp
+        curr_vm.serial_conn = serial_port
+        curr_vm.pid = pid
+        self._set_vm_status(vm_name, vm_dict, QEMU_RUN_STATE_STATUS.get(run_state, "stopped"))
+
+    def update_vm_disks(self, vm_name, disks=[]):
+        vm_record = self._inventory.get_vm(vm_name)
+        if (vm_record == None):
+            return
+
+        vm_record["disks"] = list(disks)
+        self._inventory.put_vm(vm_record)
+
+    def set_vm_labels(self, vm_name, labels=None):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
+            return False
+
+        with vm_lock:
+            vm_record = self._inventory.get_vm(vm_name)
+            if (vm_record == None):
+                return False
+
+            vm_record["labels"] = dict(labels or {})
+            self._inventory.put_vm(vm_record)
+            self._vm_index.set_labels(vm_name, vm_record["labels"])
+
+        return True
 
-        for vm, vm_dict in self._vms.items():
-            if (status == "all" or status == vm_dict["status"]):
-                vm_names.append(vm)
+    def _get_vm_lock(self, vm_name):
+        with self._vms_lock:
+            return self._vm_locks.get(vm_name)
 
+    def get_vms(self, status=""):
+        if (status == ""):
+            return []
+
+        vm_names, _ = self._vm_index.query(status=status, page_size=0)
         return vm_names
+
+    # Returns a page of VM records matching status and labels, in name
+    # order, and the page_token of the next page.
+    def describe_vms(self, status="", labels=None, page_token="", page_size=DESCRIBE_PAGE_SIZE):
+        page_size = min(page_size or DESCRIBE_PAGE_SIZE, DESCRIBE_MAX_PAGE_SIZE)
+        vm_names, next_page_token = self._vm_index.query(status=status, labels=labels,
+            page_token=page_token, page_size=page_size)
+
+        vms = []
+        for vm_name in vm_names:
+            with self._vms_lock:
+                vm_dict = self._vms.get(vm_name)
+            vm_record = self._inventory.get_vm(vm_name)
+            if (vm_dict == None or vm_record == None):
+                continue
+
+            curr_vm = vm_dict["instance"]
+            vms.append({
+                "name": vm_name,
+                "status": vm_dict["status"],
+                "ip_address": curr_vm.ip_address or "",
+                "mac_address": curr_vm.mac_address or "",
+                "tap_intf": curr_vm.tap_intf or "",
+                "instance_type": curr_vm.instance_type or "",
+                "image": vm_record.get("image", ""),
+                "disks": vm_record.get("disks", []),
+                "pid": curr_vm.pid or 0,
+                "labels": vm_record.get("labels", {}),
+            })
+
+        return vms, next_page_token
+
+    # Yields the status of every VM followed by a SYNCED event, then each
+    # change as it happens. A watcher that reconnects with the
+    # resource_version of the last event it saw only gets the changes after
+    # it. If those are no longer kept, or the watcher falls too far behind,
+    # a RESET event tells it to drop what it knows and the snapshot is sent
+    # again.
+    def watch_vms(self, resource_version=0, is_active=None):
+        events = None
+        if (resource_version):
+            events = self._vm_events.events_since(resource_version)
+            if (events == None):
+                yield {"type": "RESET", "vm_name": "", "status": "", "resource_version": 0}
+
+        while (is_active == None or is_active()):
+            if (events == None):
+                resource_version, statuses = self._vm_events.snapshot()
+                for vm_name in sorted(statuses):
+                    yield {"type": "ADDED", "vm_name": vm_name, "status": statuses[vm_name],
+                        "resource_version": resource_version}
+                yield {"type": "SYNCED", "vm_name": "", "status": "", "resource_version": resource_version}
+                events = []
+
+            for event in events:
+                yield event
+                resource_version = event["resource_version"]
+
+            self._vm_events.wait(resource_version, timeout=WATCH_WAKEUP_INTERVAL)
+            events = self._vm_events.events_since(resource_version)
+            if (events == None):
+                yield {"type": "RESET", "vm_name": "", "status": "", "resource_version": 0}
     
-    def get_vm_pty_file(self, vm_name=""):
-        return self._vms[vm_name]["instance"].serial_conn
+    # Attaches to the serial console of a running VM. Any number of sessions
+    # can be open on the same VM, and all of them see its output.
+    def open_console(self, vm_name="", read_only=False):
+        with self._vms_lock:
+            vm_dict = self._vms.get(vm_name)
+        if (vm_dict == None or vm_dict["instance"].serial_conn == None):
+            return None
+
+        return self._console_hub.open_session(vm_name, vm_dict["instance"].serial_conn, read_only=read_only)
+
+    # Yields the VM's serial output from offset, or its last tail bytes, as
+    # dicts with the data and the offsets it spans. skipped counts output
+    # that was no longer kept. With follow, new output keeps being sent
+    # until the VM is deleted.
+    def get_console_log(self, vm_name="", offset=0, tail=0, follow=False, is_active=None):
+        log = self._console_hub.get_log(vm_name)
+        if (log == None):
+            return
+
+        if (tail > 0):
+            offset = max(log.end() - tail, 0)
+        while (is_active == None or is_active()):
+            data, start, end = log.read(offset)
+            if (data):
+                yield {"data": data, "offset": start, "next_offset": end, "skipped": start - offset}
+                offset = end
+                continue
+
+            if (not follow or log.closed):
+                return
+            log.wait(offset, timeout=WATCH_WAKEUP_INTERVAL)
+
+    # Runs script with /bin/sh in every VM named or carrying all of labels,
+    # and yields each VM's result as soon as it finishes. VMs that are not
+    # running are reported straight away rather than waited for.
+    def exec_vms(self, vm_names=None, labels=None, script="", input_data=b"", timeout=60.0, is_active=None):
+        vm_names = list(vm_names or [])
+        if (labels):
+            vm_names += [vm_name for vm_name in self._vm_index.query(labels=labels, page_size=0)[0]
+                if vm_name not in vm_names]
+        if (len(vm_names) == 0):
+            return
+
+        executor = futures.ThreadPoolExecutor(max_workers=min(len(vm_names), GUEST_EXEC_CONCURRENCY),
+            thread_name_prefix="guest-exec")
+        try:
+            execs = [executor.submit(self._exec_vm, vm_name, script, input_data, timeout) for vm_name in vm_names]
+            for guest_exec in futures.as_completed(execs):
+                if (is_active != None and not is_active()):
+                    return
+                yield guest_exec.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _exec_vm(self, vm_name, script, input_data=b"", timeout=60.0):
+        result = {"vm_name": vm_name, "exit_code": 0, "stdout": b"", "stderr": b"", "error": "", "duration": 0.0}
+
+        with self._vms_lock:
+            vm_dict = self._vms.get(vm_name)
+        if (vm_dict == None):
+            result["error"] = "No such VM"
+            return result
+        if (vm_dict["status"] != "running"):
+            result["error"] = f"VM is {vm_dict['status']}"
+            return result
+
+        start_time = time.monotonic()
+        try:
+            result.update(self._guest_agent.exec_command(vm_name, "/bin/sh", ["-c", script], input_data, timeout))
+        except GuestAgentError as e:
+            result["error"] = str(e)
+        result["duration"] = time.monotonic() - start_time
+
+        return result
     
-    def create_vm(self):
-        ret = self._distro_manager.verify_ubuntu_image()
-        if (ret != 0):
+    def create_vm(self, instance_type="micro", image=""):
+        instance_type = instance_type or "micro"
+        image = image or DEFAULT_IMAGE
+        if (not self._image_exists(image) or not self._instance_type_exists(instance_type)):
+            return ""
+
+        # Warm VMs are always built from the default image.
+        ctx = self._warm_pool.claim(instance_type) if image == DEFAULT_IMAGE else None
+        if (ctx != None):
+            self._personalize_warm_vm(ctx)
+            return ctx["vm_name"]
+
+        ctx = self._new_create_context(instance_type, image)
+        if (not self._reserve_capacity(ctx)):
+            print(f"Not enough capacity left for a {instance_type} VM")
             return ""
 
-        vm_uuid = str(uuid.uuid4())
-        vm_path = f"{vm_uuid}"
-
-        os.makedirs(f"{self._vm_location}/{vm_path}")
-        self.copy_vm_image(vm_uuid)
-        self.write_vm_config(vm_uuid)
-
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        private_key_str = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption()
-        ).decode('utf-8')
-
-        public_key = private_key.public_key()
-        public_key_bytes = public_key.public_bytes(
-            encoding=serialization.Encoding.OpenSSH,
-            format=serialization.PublicFormat.OpenSSH
-        )
-        public_key_str = public_key_bytes.decode('utf-8')
+        try:
+            for _, stage_func, _ in self._create_vm_stages():
+                stage_func(ctx)
+        except Exception:
+            self._cleanup_failed_vm(ctx)
+            raise
+
+        return ctx["vm_name"]
+
+    def create_vms(self, count=1, instance_type="micro", image=""):
+        instance_type = instance_type or "micro"
+        image = image or DEFAULT_IMAGE
+        if (not self._image_exists(image) or not self._instance_type_exists(instance_type)):
+            return
+
+        contexts = []
+        for _ in range(count):
+            ctx = self._warm_pool.claim(instance_type) if image == DEFAULT_IMAGE else None
+            if (ctx == None):
+                ctx = self._new_create_context(instance_type, image)
+                if (self._reserve_capacity(ctx)):
+                    contexts.append(ctx)
+                    continue
+
+                ctx["error"] = "capacity: not enough free vcpus or memory"
+                ctx["duration"] = 0.0
+                yield ctx
+                continue
+
+            ctx["error"] = ""
+            ctx["start_time"] = time.monotonic()
+            try:
+                self._personalize_warm_vm(ctx)
+            except Exception as e:
+                ctx["error"] = f"personalize: {e}"
+                self._cleanup_failed_vm(ctx)
+            ctx["duration"] = time.monotonic() - ctx["start_time"]
+            yield ctx
+
+        if (len(contexts) == 0):
+            return
+
+        pipeline = ProvisioningPipeline(self._create_vm_stages(),
+            failure_handler=self._cleanup_failed_vm)
+
+        for ctx in pipeline.run(contexts):
+            yield ctx
+
+    # Clones share a read-only snapshot of the source VM's disk and only get
+    # a copy-on-write overlay of their own, so they start with everything
+    # that was installed on the source without copying its disk. Each clone
+    # still gets its own keys, network and cloud-init instance id.
+    def clone_vms(self, source_vm="", count=1, instance_type=""):
+        error = ""
+        vm_lock = self._get_vm_lock(source_vm)
+        if (vm_lock == None):
+            error = f"No such VM: {source_vm}"
+        else:
+            with vm_lock:
+                error, snapshot_id, source_record, instance_type = self._snapshot_clone_source(source_vm,
+                    instance_type)
+
+        # Failures before any clone is provisioned are reported as a single
+        # result, so callers can tell them from a stream with nothing in it.
+        if (error != ""):
+            print(f"Failed to clone vm {source_vm}: {error}")
+            yield {"vm_name": "", "error": error, "duration": 0.0}
+            return
+
+        contexts = []
+        try:
+            for _ in range(count):
+                ctx = self._new_create_context(instance_type, source_record.get("image", DEFAULT_IMAGE))
+                ctx["snapshot"] = snapshot_id
+                if (self._reserve_capacity(ctx)):
+                    contexts.append(ctx)
+                    continue
+
+                ctx["error"] = "capacity: not enough free vcpus or memory"
+                ctx["duration"] = 0.0
+                yield ctx
+
+            if (len(contexts) == 0):
+                return
+
+            pipeline = ProvisioningPipeline(self._create_vm_stages(disk_func=self._create_clone_disk),
+                failure_handler=self._cleanup_failed_vm)
+
+            for ctx in pipeline.run(contexts):
+                yield ctx
+        finally:
+            self._drop_snapshot(snapshot_id)
+            self._collect_snapshots()
+
+    # Returns an error, or the source's snapshot, inventory record and the
+    # instance type for the clones. Called with the source's lock held.
+    def _snapshot_clone_source(self, source_vm, instance_type):
+        vm_dict = self._vms.get(source_vm)
+        if (vm_dict == None):
+            return f"No such VM: {source_vm}", None, None, instance_type
+
+        source_record = self._inventory.get_vm(source_vm) or {}
+        instance_type = instance_type or vm_dict["instance"].instance_type or "micro"
+        if (not self._instance_type_exists(instance_type)):
+            return f"Unknown instance type: {instance_type}", None, None, instance_type
+
+        with self._snapshot_lock:
+            try:
+                snapshot_id = self._snapshot_vm_disk(source_vm, vm_dict)
+            except Exception as e:
+                return f"snapshot: {e}", None, None, instance_type
+        self._hold_snapshot(snapshot_id)
+
+        return "", snapshot_id, source_record, instance_type
+
+    # The source's current disk becomes the read-only snapshot and the source
+    # continues on a new empty overlay backed by it. A running source is
+    # paused while QEMU switches over to the new overlay, so the snapshot is
+    # consistent with what the guest had written. A source that has not run
+    # since its last snapshot reuses that snapshot instead of adding another
+    # empty layer to the chain.
+    def _snapshot_vm_disk(self, vm_name, vm_dict):
+        if (vm_dict["status"] not in ["down", "hibernated", "running", "stopped"]):
+            raise Exception(f"VM is {vm_dict['status']}")
+
+        curr_vm = vm_dict["instance"]
+        disk_path = f"{self._vm_location}/{vm_name}/{vm_name}.qcow2"
+        vm_record = self._inventory.get_vm(vm_name) or {}
+
+        previous_id = vm_record.get("snapshot", "")
+        if (previous_id != "" and curr_vm.hv_conn == None):
+            try:
+                with open(f"{self._snapshot_location}/{previous_id}.json", "r") as sf:
+                    previous = json.load(sf)
+                if (previous["overlay_mtime"] == os.stat(disk_path).st_mtime_ns):
+                    return previous_id
+            except (OSError, ValueError, KeyError):
+                pass
+
+        snapshot_id = str(uuid.uuid4())
+        snapshot_path = f"{self._snapshot_location}/{snapshot_id}.qcow2"
+
+        was_running = vm_dict["status"] == "running"
+        if (was_running):
+            self._send_command_to_vm(curr_vm, "stop")
+        try:
+            # QEMU keeps the renamed file open, so a running guest is not
+            # affected until it is switched to the new overlay below.
+            os.rename(disk_path, snapshot_path)
+            try:
+                subprocess.run([
+                    "qemu-img", "create",
+                    "-f", "qcow2",
+                    "-b", snapshot_path,
+                    "-F", "qcow2",
+                    disk_path
+                ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+                if (curr_vm.hv_conn != None):
+                    device = self._get_vm_drive(curr_vm)["device"]
+                    self._send_command_to_vm(curr_vm, "blockdev-snapshot-sync", {"device": device,
+                        "snapshot-file": disk_path, "format": "qcow2", "mode": "existing"})
+            except Exception:
+                if (os.path.exists(disk_path)):
+                    os.remove(disk_path)
+                os.rename(snapshot_path, disk_path)
+                raise
+        finally:
+            if (was_running):
+                self._send_command_to_vm(curr_vm, "cont")
+
+        os.chmod(snapshot_path, 0o444)
+        with open(f"{self._snapshot_location}/{snapshot_id}.json", "w") as sf:
+            json.dump({
+                "snapshot_id": snapshot_id,
+                "source_vm": vm_name,
+                "parent": previous_id,
+                "overlay_mtime": os.stat(disk_path).st_mtime_ns,
+            }, sf)
+
+        vm_record["snapshot"] = snapshot_id
+        if ("name" in vm_record):
+            self._inventory.put_vm(vm_record)
+
+        return snapshot_id
+
+    def _create_clone_disk(self, ctx):
+        vm_uuid = ctx["vm_name"]
+
+        os.makedirs(f"{self._vm_location}/{vm_uuid}")
+        subprocess.run([
+            "qemu-img", "create",
+            "-f", "qcow2",
+            "-b", f"{self._snapshot_location}/{ctx['snapshot']}.qcow2",
+            "-F", "qcow2",
+            f"{self._vm_location}/{vm_uuid}/{vm_uuid}.qcow2"
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.write_vm_config(vm_uuid, instance_type=ctx["instance_type"])
+
+    # Snapshots that VMs are still being created from are never collected.
+    def _hold_snapshot(self, snapshot_id):
+        with self._snapshot_lock:
+            self._pending_snapshots[snapshot_id] = self._pending_snapshots.get(snapshot_id, 0) + 1
+
+    def _drop_snapshot(self, snapshot_id):
+        with self._snapshot_lock:
+            self._pending_snapshots[snapshot_id] -= 1
+            if (self._pending_snapshots[snapshot_id] == 0):
+                del self._pending_snapshots[snapshot_id]
+
+    # Removes snapshots that no VM disk or template is backed by anymore,
+    # directly or through a newer snapshot.
+    def _collect_snapshots(self):
+        with self._snapshot_lock:
+            parents = {}
+            for fname in os.listdir(self._snapshot_location):
+                if (not fname.endswith(".json")):
+                    continue
+                try:
+                    with open(f"{self._snapshot_location}/{fname}", "r") as sf:
+                        parents[fname[:-len(".json")]] = json.load(sf).get("parent", "")
+                except (OSError, ValueError):
+                    continue
+
+            in_use = set(self._pending_snapshots)
+            in_use.update(vm_record.get("snapshot", "") for vm_record in self._inventory.get_vms().values())
+            in_use.update(template["snapshot"] for template in self._template_store.get_templates())
+            pending = list(in_use)
+            while pending:
+                parent = parents.get(pending.pop(), "")
+                if (parent != "" and parent not in in_use):
+                    in_use.add(parent)
+                    pending.append(parent)
+
+            for snapshot_id in parents:
+                if (snapshot_id in in_use):
+                    continue
+                for suffix in [".qcow2", ".state.zst", ".json"]:
+                    if (os.path.exists(f"{self._snapshot_location}/{snapshot_id}{suffix}")):
+                        os.remove(f"{self._snapshot_location}/{snapshot_id}{suffix}")
+
+    # Builds the template for image and instance_type, replacing an existing
+    # one. Builds run one at a time.
+    def build_template(self, image="", instance_type="micro"):
+        return self._template_executor.submit(self._build_template, image or DEFAULT_IMAGE,
+            instance_type or "micro").result()
+
+    def get_templates(self):
+        return [template for template in self._template_store.get_templates()
+            if self._get_valid_template(template["image"], template["instance_type"]) != None]
+
+    def delete_template(self, name=""):
+        self._template_store.remove_template(name)
+        self._collect_snapshots()
+        return name
+
+    # Creates a VM by restoring the template for image and instance_type
+    # instead of booting it, and then gives it its own identity through the
+    # guest agent. Without a usable template the VM is booted cold while the
+    # template is built in the background for the next one. Either way the
+    # VM is running and its guest agent answers once this returns.
+    def create_vm_from_template(self, instance_type="micro", image=""):
+        instance_type = instance_type or "micro"
+        image = image or DEFAULT_IMAGE
+        result = {"vm_name": "", "error": "", "from_template": False, "time_to_ready": 0.0, "cold_boot_time": 0.0}
+        if (not self._image_exists(image) or not self._instance_type_exists(instance_type)):
+            result["error"] = f"Unknown image {image} or instance type {instance_type}"
+            return result
+
+        template = self._get_valid_template(image, instance_type)
+        if (template != None):
+            result["cold_boot_time"] = template["boot_time"]
+            self._hold_snapshot(template["snapshot"])
+            try:
+                ctx = self._new_create_context(instance_type, image)
+                ctx["snapshot"] = template["snapshot"]
+                if (not self._reserve_capacity(ctx)):
+                    result["error"] = "capacity: not enough free vcpus or memory"
+                    return result
+
+                try:
+                    for _, stage_func, _ in self._create_vm_stages(disk_func=self._create_clone_disk):
+                        stage_func(ctx)
+                except Exception as e:
+                    self._cleanup_failed_vm(ctx)
+                    result["error"] = str(e)
+                    return result
+                result["vm_name"] = ctx["vm_name"]
+
+                error, time_to_ready = self._restore_template(ctx, template)
+            finally:
+                self._drop_snapshot(template["snapshot"])
+
+            if (error == ""):
+                result["from_template"] = True
+                result["time_to_ready"] = time_to_ready
+                return result
+
+            # A template QEMU can no longer load, e.g. after a QEMU upgrade,
+            # is rebuilt and this VM boots from its disk instead.
+            print(f"Failed to restore template {template['name']}: {error}")
+            self._template_store.remove_template(template["name"])
+
+        with self._template_lock:
+            name = template_name(image, instance_type)
+            if (name not in self._template_builds):
+                self._template_builds.add(name)
+                self._template_executor.submit(self._build_template, image, instance_type)
+
+        if (result["vm_name"] == ""):
+            result["vm_name"] = self.create_vm(instance_type, image)
+            if (result["vm_name"] == ""):
+                result["error"] = "Failed to create vm"
+                return result
+
+        start = self._start_vm(result["vm_name"], wait_for="agent")
+        result["error"] = start["error"]
+        result["time_to_ready"] = start["time_to_ready"]
+        result["cold_boot_time"] = start["time_to_ready"]
+        return result
+
+    # The template VM boots like any other VM, is left until cloud-init has
+    # finished and is then paused and saved. Its boot is timed the same way
+    # as start_vm with wait_for="agent", which gives the cold boot time that
+    # restores are compared against.
+    def _build_template(self, image, instance_type):
+        name = template_name(image, instance_type)
+        result = {"name": name, "error": "", "boot_time": 0.0, "state_size": 0, "duration": 0.0}
+
+        start_time = time.monotonic()
+        ctx = self._new_create_context(instance_type, image)
+        image_record = self._distro_manager.image_store.get_image(image)
+        instance = self._catalog.get(instance_type)
+        if (image_record == None or instance == None):
+            result["error"] = f"Unknown image {image} or instance type {instance_type}"
+        elif (not self._reserve_capacity(ctx)):
+            result["error"] = "capacity: not enough free vcpus or memory"
+
+        vm_name = ctx["vm_name"]
+        snapshot_id = str(uuid.uuid4())
+        snapshot_path = f"{self._snapshot_location}/{snapshot_id}"
+        qmp = None
+        try:
+            if (result["error"] != ""):
+                raise Exception(result["error"])
+
+            self._create_vm_disk(ctx)
+            self._create_vm_keys(ctx)
+            self._create_vm_network(ctx)
+            self._create_vm_seed(ctx)
+            curr_vm = VM(vm_name, disk_location=f"{self._vm_location}/{vm_name}/{vm_name}.qcow2",
+                tap_intf=ctx["tap_intf"], ip_address=ctx["ip_address"], mac_address=ctx["mac_address"],
+                instance_type=instance_type)
+
+            boot_time = time.monotonic()
+            qmp, _ = self._launch_vm(vm_name, curr_vm, wait_for="agent", timeout=300.0)
+            result["boot_time"] = time.monotonic() - boot_time
+            self._guest_exec(vm_name, "cloud-init status --wait > /dev/null || true; sync", timeout=300.0)
+
+            qmp.execute("stop")
+            qmp.execute("migrate-set-parameters", {"max-bandwidth": MIGRATION_MAX_BANDWIDTH})
+            qmp.execute("migrate", {"uri": f"exec:zstd -q -f -T0 -o {shlex.quote(snapshot_path + '.state.zst')}"})
+            self._wait_for_migration(qmp)
+            self._stop_qemu(qmp, curr_vm.pid)
+
+            os.rename(curr_vm.disk_location, f"{snapshot_path}.qcow2")
+            os.chmod(f"{snapshot_path}.qcow2", 0o444)
+            result["state_size"] = os.path.getsize(f"{snapshot_path}.state.zst")
+            result["duration"] = time.monotonic() - start_time
+
+            # The snapshot only becomes visible to _collect_snapshots together
+            # with the template that uses it.
+            with self._snapshot_lock:
+                self._template_store.put_template({
+                    "name": name,
+                    "image": image,
+                    "image_sha256": image_record["sha256"],
+                    "instance_type": instance_type,
+                    "config": instance["template"],
+                    "snapshot": snapshot_id,
+                    "mac_address": ctx["mac_address"],
+                    "boot_time": result["boot_time"],
+                    "state_size": result["state_size"],
+                })
+                with open(f"{snapshot_path}.json", "w") as sf:
+                    json.dump({"snapshot_id": snapshot_id, "source_vm": name, "parent": "", "overlay_mtime": 0}, sf)
+        except Exception as e:
+            if (qmp != None and qmp.is_connected()):
+                self._stop_qemu(qmp, curr_vm.pid)
+            for suffix in [".qcow2", ".state.zst", ".state.zst.tmp"]:
+                if (os.path.exists(f"{snapshot_path}{suffix}")):
+                    os.remove(f"{snapshot_path}{suffix}")
+            result["error"] = str(e)
+            print(f"Failed to build template {name}: {e}")
+        finally:
+            # The template VM itself is never registered and is thrown away.
+            self._cleanup_failed_vm(ctx)
+            with self._template_lock:
+                self._template_builds.discard(name)
+
+        self._collect_snapshots()
+        return result
+
+    # Templates are dropped once the image they were built from is rebuilt
+    # or the instance type's config changes, since their saved state would
+    # no longer match what a new VM is started with.
+    def _get_valid_template(self, image, instance_type):
+        template = self._template_store.get_template(template_name(image, instance_type))
+        if (template == None):
+            return None
+
+        image_record = self._distro_manager.image_store.get_image(image)
+        instance = self._catalog.get(instance_type)
+        snapshot_path = f"{self._snapshot_location}/{template['snapshot']}"
+        if (image_record == None or image_record["sha256"] != template["image_sha256"]
+                or instance == None or instance["template"] != template["config"]
+                or not os.path.exists(f"{snapshot_path}.qcow2") or not os.path.exists(f"{snapshot_path}.state.zst")):
+            self._template_store.remove_template(template["name"])
+            self._collect_snapshots()
+            return None
+
+        return template
+
+    # Returns the error, if any, and the time from launching QEMU until the
+    # guest had its new identity.
+    def _restore_template(self, ctx, template):
+        vm_name = ctx["vm_name"]
+        state_path = f"{self._snapshot_location}/{template['snapshot']}.state.zst"
+
+        with self._get_vm_lock(vm_name):
+            vm_dict = self._vms[vm_name]
+            curr_vm = vm_dict["instance"]
+
+            start_time = time.monotonic()
+            self._set_vm_status(vm_name, vm_dict, "restoring")
+            try:
+                curr_vm.hv_conn, curr_vm.serial_conn = self._launch_vm(vm_name, curr_vm, incoming=True)
+                self._send_command_to_vm(curr_vm, "migrate-incoming",
+                    {"uri": f"exec:zstd -q -d -c {shlex.quote(state_path)}"})
+                self._wait_for_migration(curr_vm.hv_conn)
+                self._send_command_to_vm(curr_vm, "cont")
+                self._apply_vm_identity(vm_name, ctx, template)
+            except Exception as e:
+                # A guest that is still using the template's identity must
+                # not stay on the network.
+                if (curr_vm.hv_conn != None):
+                    self._stop_qemu(curr_vm.hv_conn, curr_vm.pid)
+                self._set_vm_status(vm_name, vm_dict, "down")
+                return str(e), 0.0
+
+            self._set_vm_status(vm_name, vm_dict, "running")
+            return "", time.monotonic() - start_time
+
+    # The guest clock is stepped from the RTC first, it still holds the time
+    # the template was saved at.
+    def _apply_vm_identity(self, vm_name, ctx, template):
+        self._guest_agent.execute(vm_name, "guest-set-time")
+        self._guest_exec(vm_name, IDENTITY_SCRIPT.format(
+            template_mac=template["mac_address"],
+            mac_address=ctx["mac_address"],
+            ip_address=ctx["ip_address"],
+            public_key=shlex.quote(ctx["public_key"])))
+
+    def _stop_qemu(self, qmp, pid, timeout=10.0):
+        try:
+            qmp.execute("quit")
+        except Exception:
+            pass
+
+        deadline = time.monotonic() + timeout
+        while qmp.is_connected() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if (qmp.is_connected() and pid != None):
+            os.kill(pid, signal.SIGKILL)
+
+    def _guest_exec(self, vm_name, script, timeout=60.0):
+        result = self._guest_agent.exec_command(vm_name, "/bin/sh", ["-c", script], timeout=timeout)
+        if (result["exit_code"] != 0):
+            stderr = result["stderr"].decode(errors="replace").strip()
+            raise Exception(f"Guest command failed with exit code {result['exit_code']}: {stderr}")
+        return result["stdout"].decode(errors="replace")
+
+    def get_instance_types(self):
+        return self._catalog.get_instance_types()
+
+    def get_images(self):
+        self._distro_manager.verify_ubuntu_image()
+        return self._distro_manager.image_store.get_images()
+
+    def pull_image(self, name, url="", sha256="", image_format="qcow2"):
+        return self._distro_manager.pull_image(name, url=url, sha256=sha256, image_format=image_format)
+
+    def build_image(self, name, source):
+        return self._image_builder.build_image(name, source)
+
+    def get_image_builds(self):
+        return self._image_builder.get_builds()
+
+    # Only disk images can back a VM's overlay, ISOs are used for installs.
+    def _image_exists(self, image):
+        if (image == DEFAULT_IMAGE and self._distro_manager.verify_ubuntu_image() != 0):
+            return False
+
+        image = self._distro_manager.image_store.get_image(image)
+        return image != None and image["format"] != "iso"
+
+    def get_capacity(self):
+        return self._capacity.get_capacity()
+
+    def _reserve_capacity(self, ctx):
+        instance = self._catalog.get(ctx["instance_type"])
+        return self._capacity.reserve(ctx["vm_name"], instance)
+
+    # VMs created before instance types were recorded fall back to the
+    # resources in their own config file.
+    def _get_vm_resources(self, vm_name, instance_type):
+        instance = self._catalog.get(instance_type)
+        if (instance != None):
+            return instance
+
+        try:
+            with open(f"{self._vm_location}/{vm_name}/{vm_name}.conf", "r") as cfile:
+                return config_resources(cfile.read())
+        except Exception as e:
+            print(f"Failed to read resources of vm {vm_name}: {e}")
+            return {"vcpus": 0, "memory_mib": 0}
+
+    def get_warm_pool_stats(self):
+        return self._warm_pool.get_stats()
+
+    def _provision_warm_vm(self, instance_type):
+        if (not self._image_exists(DEFAULT_IMAGE)):
+            return None
+
+        ctx = self._new_create_context(instance_type)
+        ctx["public_key"] = ""
+
+        if (not self._reserve_capacity(ctx)):
+            return None
+
+        try:
+            self._create_vm_disk(ctx)
+            self._create_vm_network(ctx)
+            self._create_vm_seed(ctx)
+
+            with open(f"{self._vm_location}/{ctx['vm_name']}/{WARM_MARKER}", "w") as wf:
+                wf.write(instance_type)
+            self._inventory.put_vm(self._vm_record(ctx, warm=instance_type))
+        except Exception as e:
+            print(f"Failed to provision warm VM: {e}")
+            self._cleanup_failed_vm(ctx)
+            return None
+
+        return ctx
+
+    # A warm VM already has its disk, config and network, so claiming it only
+    # needs the tenant's SSH key and a seed image carrying that key.
+    def _personalize_warm_vm(self, ctx):
+        self._create_vm_keys(ctx)
+        self._create_vm_seed(ctx)
+        os.remove(f"{self._vm_location}/{ctx['vm_name']}/{WARM_MARKER}")
+        self._register_vm(ctx)
+
+    def _instance_type_exists(self, instance_type):
+        return self._catalog.get(instance_type or "micro") != None
+
+    def _new_create_context(self, instance_type, image=DEFAULT_IMAGE):
+        return {"vm_name": str(uuid.uuid4()), "instance_type": instance_type or "micro", "image": image}
+
+    def _create_vm_stages(self, disk_func=None):
+        cpu_workers = os.cpu_count() or 1
+        return [
+            ("disk", disk_func or self._create_vm_disk, 4),
+            ("keys", self._create_vm_keys, cpu_workers),
+            ("network", self._create_vm_network, 4),
+            ("seed", self._create_vm_seed, 4),
+            ("register", self._register_vm, 1),
+        ]
+
+    def _create_vm_disk(self, ctx):
+        vm_uuid = ctx["vm_name"]
+
+        os.makedirs(f"{self._vm_location}/{vm_uuid}")
+        self.copy_vm_image(vm_uuid, image=ctx.get("image", DEFAULT_IMAGE))
+        self.write_vm_config(vm_uuid, instance_type=ctx["instance_type"])
+
+    def _create_vm_keys(self, ctx):
+        vm_uuid = ctx["vm_name"]
+
+        private_key_str, public_key_str = self._key_pool.get_keypair()
         public_key_str = public_key_str + f" {os.getlogin()}@{socket.gethostname()}"
 
+        # The key files keep their id_rsa names for every key type since
+        # clients build their ssh command from that path.
         with open(f"{self._vm_location}/{vm_uuid}/id_rsa", "w") as pkf:
             pkf.write(private_key_str)
             os.chmod(f"{self._vm_location}/{vm_uuid}/id_rsa", 0o600)
@@ -142,170 +1236,880 @@ class VMManager():
             pkf.write(public_key_str)
             pkf.close()
 
-        with open(f"compute/provisioning/vm_config/user-data", 'r') as udf:
-            data = udf.read()
+        ctx["public_key"] = public_key_str
+
+    def _create_vm_network(self, ctx):
+        vm_uuid = ctx["vm_name"]
+        self._network_ready.wait()
 
-        with open(f"{self._vm_location}/{vm_uuid}/user-data", 'w') as wdf:
-            wdf.write(data)
-            wdf.close()
-        os.chmod(f"{self._vm_location}/{vm_uuid}/user-data", 0o600)
+        ctx["tap_intf"] = self.network_manager.allocate_vm_tap_interface(vm_uuid)
+        ctx["mac_address"] = f"{self.network_manager.generate_mac()}"
+        ctx["ip_address"] = f"192.168.100.{self.network_manager.ip_manager.acquire_ip(vm_uuid)}"
 
-        data = f"instance-id: {vm_uuid}\n"
-        data = data + f"local-hostname: ubuntu\n"
+    def _create_vm_seed(self, ctx):
+        vm_uuid = ctx["vm_name"]
 
-        with open(f"{self._vm_location}/{vm_uuid}/meta-data", 'w') as wdf:
-            wdf.write(data)
-        os.chmod(f"{self._vm_location}/{vm_uuid}/meta-data", 0o644)
+        user_data = cloud_init.render_user_data(ssh_key=ctx["public_key"],
+            mac_address=ctx["mac_address"], ip_address=ctx["ip_address"]).encode()
+        meta_data = cloud_init.render_meta_data(vm_uuid).encode()
 
-        vm_tap_intf = self.network_manager.allocate_vm_tap_interface(vm_uuid)
-        vm_mac = f"{self.network_manager.generate_mac()}"
-        vm_ip = f"192.168.100.{self.network_manager.ip_manager.acquire_ip(vm_uuid)}"
+        cloud_init.write_file(f"{self._vm_location}/{vm_uuid}/user-data", user_data, 0o600)
+        cloud_init.write_file(f"{self._vm_location}/{vm_uuid}/meta-data", meta_data, 0o644)
 
-        self.update_vm_cloud_init(vm_uuid, old_string="SSH_KEY",
-            new_string=f"- {public_key_str}")
+        seed_iso = cloud_init.build_seed_iso({"user-data": user_data, "meta-data": meta_data})
+        cloud_init.write_file(f"{self._vm_location}/{vm_uuid}/cloud-init.iso", seed_iso)
 
-        self.update_vm_cloud_init(vm_uuid, old_string="MAC_ADDRESS",
-            new_string=f"{vm_mac}")
+    def _register_vm(self, ctx):
+        vm_uuid = ctx["vm_name"]
 
-        self.update_vm_cloud_init(vm_uuid, old_string="IP_ADDRESS",
-            new_string=f"{vm_ip}")
+        new_vm = VM(vm_uuid, disk_location=f"{self._vm_location}/{vm_uuid}/{vm_uuid}.qcow2", tap_intf=ctx["tap_intf"],
+            ip_address=ctx["ip_address"], mac_address=ctx["mac_address"],
+            instance_type=ctx["instance_type"])
 
-        subprocess.run(["genisoimage",
-            "-output", f"{self._vm_location}/{vm_uuid}/cloud-init.iso",
-            "-volid", "cidata",
-            "-joliet", "-rock",
-            "-input-charset", "utf-8",
-            f"{self._vm_location}/{vm_uuid}/user-data",
-            f"{self._vm_location}/{vm_uuid}/meta-data"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL)
+        self._inventory.put_vm(self._vm_record(ctx))
 
-        new_vm = VM(vm_uuid, disk_location=vm_path+"/{vm_uuid}.qcow2", tap_intf=vm_tap_intf,
-            ip_address=vm_ip, mac_address=vm_mac)
+        with self._vms_lock:
+            self._vms[vm_uuid] = {"instance": new_vm, "status": "down"}
+            self._vm_locks[vm_uuid] = threading.RLock()
+        self._vm_index.add(vm_uuid, "down", ctx.get("labels"))
+        self._vm_events.publish("ADDED", vm_uuid, "down")
 
-        self._vms[vm_uuid] = {"instance": new_vm, "status": "down"}
+    def _cleanup_failed_vm(self, ctx):
+        vm_uuid = ctx["vm_name"]
 
-        return vm_uuid
+        if ("tap_intf" in ctx):
+            self.network_manager.deallocate_vm_tap_interface(vm_uuid)
+
+        if ("ip_address" in ctx):
+            self.network_manager.ip_manager.release_ip(vm_uuid)
+
+        self._console_hub.remove_vm(vm_uuid)
+        shutil.rmtree(f"{self._vm_location}/{vm_uuid}", ignore_errors=True)
+
+        self._inventory.remove_vm(vm_uuid)
+        self._capacity.release(vm_uuid)
 
     def delete_vm(self, vm_name=""):
-        curr_vm = self._vms.get(vm_name)
-        if (curr_vm == None):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
             return
 
-        if (curr_vm["status"] != "down"):
-            pass
+        with vm_lock:
+            curr_vm = self._vms.get(vm_name)
+            if (curr_vm == None):
+                return
 
-        self.network_manager.deallocate_vm_tap_interface(vm_name)
+            if (curr_vm["status"] != "down"):
+                pass
 
-        shutil.rmtree(f"{self._vm_location}/{vm_name}")
+            self.network_manager.deallocate_vm_tap_interface(vm_name)
+            if (vm_name in self.network_manager.ip_manager.used_ips):
+                self.network_manager.ip_manager.release_ip(vm_name)
 
-        del self._vms[vm_name]
+            shutil.rmtree(f"{self._vm_location}/{vm_name}")
 
-        return vm_name
+            if (os.path.exists(self._get_vm_state_path(vm_name))):
+                os.remove(self._get_vm_state_path(vm_name))
 
-    def start_vm(self, vm_name=""):
-        vm_dict = self._vms.get(vm_name)
-        if (vm_dict == None):
-            return ""
-        curr_vm = vm_dict["instance"]
-        try:
-            run_vm_cmd = [
-                "qemu-system-x86_64",
-                "-nographic",
-                "-serial", "pty",
-                "-monitor", f"unix:/tmp/{vm_name}.sock,server,nowait",
-                "-device", "virtio-serial-pci",
-                "-chardev", f"socket,id=ch0,path=/tmp/{vm_name}_qga.sock,server=on,wait=off",
-                "-device", "virtserialport,chardev=ch0,name=org.qemu.guest_agent.0",
-                "-readconfig", f"{self._vm_location}/{vm_name}/{vm_name}.conf",
-                "-drive", f"file={self._vm_location}/{vm_name}/cloud-init.iso,format=raw,if=virtio,media=cdrom",
-                "-netdev", f"tap,id={curr_vm.tap_intf},ifname={curr_vm.tap_intf},script=no,downscript=no",
-                "-device", f"virtio-net-pci,netdev={curr_vm.tap_intf},mac={curr_vm.mac_address}",
-            ]
+            self._inventory.remove_vm(vm_name)
+            self._capacity.release(vm_name)
+            self._placement.release(vm_name)
 
-            process = subprocess.Popen(
-                run_vm_cmd,
-                start_new_session = True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                universal_newlines=True,
-                bufsize=1
-            )
+            with self._vms_lock:
+                del self._vms[vm_name]
+                del self._vm_locks[vm_name]
+            self._vm_index.remove(vm_name)
+            self._console_hub.remove_vm(vm_name)
+            self._guest_agent.remove(vm_name)
+            self._vm_events.publish("DELETED", vm_name)
 
-            readable, _, _ = select.select([process.stdout, process.stderr], [], [], 5.0)
+        self._collect_snapshots()
 
-            match = None
-            for pipe in readable:
-                for line in pipe:
-                    match = re.search(r"char device redirected to (/dev/pts/\d+)", line)
-                    if (match):
-                        break
+        return vm_name
 
-            serial_port = match.group(1)
+    def start_vm(self, vm_name="", wait_for="qmp"):
+        result = self._start_vm(vm_name, wait_for=wait_for)
+        if (result["error"] != ""):
+            print(f"Failed to start vm: {result['error']}")
 
-            time.sleep(2.0)
+        return result["vm_name"]
 
-            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            sock.connect(f"/tmp/{vm_name}.sock")
+    def start_vms(self, vm_names=[], wait_for="qmp"):
+        if (len(vm_names) == 0):
+            return
 
-            curr_vm.hv_conn = sock
-            curr_vm.serial_conn = serial_port
+        with futures.ThreadPoolExecutor(max_workers=min(len(vm_names), 32)) as executor:
+            starts = [executor.submit(self._start_vm, vm_name, wait_for) for vm_name in vm_names]
+            for start in futures.as_completed(starts):
+                yield start.result()
+
+    def _start_vm(self, vm_name, wait_for="qmp", timeout=60.0):
+        result = {"vm_name": vm_name, "error": "", "time_to_ready": 0.0}
+
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
+            result["vm_name"] = ""
+            return result
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None):
+                result["vm_name"] = ""
+                return result
+            curr_vm = vm_dict["instance"]
+            if (vm_dict["status"] != "down"):
+                result["error"] = f"VM is {vm_dict['status']}"
+                return result
+            legacy_pid = self._legacy_qemu_pids.get(vm_name)
+            if (legacy_pid != None and os.path.exists(f"/proc/{legacy_pid}")):
+                result["error"] = "VM is still running from before the upgrade, shut it down from inside the guest"
+                return result
+
+            start_time = time.monotonic()
+            try:
+                curr_vm.hv_conn, curr_vm.serial_conn = self._launch_vm(vm_name, curr_vm, wait_for, timeout)
+                self._set_vm_status(vm_name, vm_dict, "running")
+            except Exception as e:
+                result["error"] = str(e)
+            result["time_to_ready"] = time.monotonic() - start_time
+
+        return result
+
+    # Readiness is driven by what QEMU and the guest report rather than fixed
+    # sleeps: the QMP greeting means the monitor is up, query-chardev gives
+    # the allocated PTY, and "serial" or "agent" additionally wait for the
+    # guest's first console output or a guest agent ping.
+    def _launch_vm(self, vm_name, curr_vm, wait_for="qmp", timeout=60.0, incoming=False):
+        if (wait_for not in VM_READINESS):
+            raise ValueError(f"Unknown readiness condition: {wait_for}")
+
+        self._network_ready.wait()
+
+        qmp_path = f"{self._run_location}/{vm_name}.sock"
+        if (os.path.exists(qmp_path)):
+            os.remove(qmp_path)
+
+        # A VM whose resources cannot be read boots with the CPUs and memory
+        # of its config alone, unpinned and without a memory backend.
+        resources = self._get_vm_resources(vm_name, curr_vm.instance_type)
+        known_resources = resources["vcpus"] > 0 and resources["memory_mib"] > 0
+        placement = None
+        if (not known_resources):
+            print(f"Unknown resources of vm {vm_name}, starting it with the layout of its config")
+        else:
+            placement = self._placement.place(vm_name, resources["vcpus"], resources["memory_mib"])
+            if (placement == None):
+                print(f"Not enough free host CPUs to pin vm {vm_name}, starting it unpinned")
+
+        run_vm_cmd = [
+            "qemu-system-x86_64",
+            "-nographic",
+            "-serial", "pty",
+            "-qmp", f"unix:{qmp_path},server=on,wait=off",
+            "-device", "virtio-serial-pci",
+            "-chardev", f"socket,id=ch0,path={self._run_location}/{vm_name}_qga.sock,server=on,wait=off",
+            "-device", "virtserialport,chardev=ch0,name=org.qemu.guest_agent.0",
+            "-readconfig", f"{self._vm_location}/{vm_name}/{vm_name}.conf",
+            "-drive", f"file={self._vm_location}/{vm_name}/cloud-init.iso,format=raw,if=virtio,media=cdrom",
+            "-netdev", f"tap,id={curr_vm.tap_intf},ifname={curr_vm.tap_intf},script=no,downscript=no",
+            "-device", f"virtio-net-pci,netdev={curr_vm.tap_intf},mac={curr_vm.mac_address}",
+            "-device", "virtio-balloon-pci,id=balloon0,deflate-on-oom=on,free-page-reporting=on",
+        ]
+        if (known_resources):
+            run_vm_cmd += self._memory_args(placement, resources["vcpus"], resources["memory_mib"])
+        if (placement != None):
+            run_vm_cmd = ["taskset", "-c", format_cpulist(placement["cpus"])] + run_vm_cmd
+        if (incoming):
+            run_vm_cmd += ["-incoming", "defer"]
+
+        log_path = f"{self._vm_location}/{vm_name}/qemu.log"
+        try:
+            with open(log_path, "w") as log_file:
+                process = subprocess.Popen(
+                    run_vm_cmd,
+                    start_new_session = True,
+                    stdin=subprocess.DEVNULL,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT
+                )
+        except Exception:
+            self._placement.release(vm_name)
+            raise
+        curr_vm.pid = process.pid
+
+        deadline = time.monotonic() + timeout
+        try:
+            qmp = self._connect_qmp(vm_name, timeout=min(timeout, 10.0),
+                alive=lambda: process.poll() == None)
+
+            serial_port = ""
+            for chardev in qmp.execute("query-chardev"):
+                if (chardev["label"] == "serial0" and chardev["filename"].startswith("pty:")):
+                    serial_port = chardev["filename"][len("pty:"):]
+            if (serial_port == ""):
+                raise Exception("QEMU did not allocate a serial PTY")
+            console_log = self._console_hub.attach_vm(vm_name, serial_port,
+                spill_path=f"{self._vm_location}/{vm_name}/{CONSOLE_LOG_NAME}")
+            log_offset = console_log.end()
+
+            if (placement != None):
+                self._pin_vcpus(qmp, placement)
+
+            # The memory controller sizes balloons from the guest's own view
+            # of its free memory, which the driver reports every 2 seconds.
+            qmp.execute("qom-set", {"path": "/machine/peripheral/balloon0",
+                "property": "guest-stats-polling-interval", "value": 2})
+
+            if (wait_for == "serial"):
+                self._wait_for_serial_output(console_log, log_offset, deadline)
+            elif (wait_for == "agent"):
+                self._wait_for_guest_agent(vm_name, deadline)
 
-            self._vms[vm_name]["status"] = "running"
         except Exception as e:
-            print(f"Failed to start vm: {e}")
+            if (process.poll() == None):
+                process.kill()
+            self._placement.release(vm_name)
+            with open(log_path, "r") as log_file:
+                qemu_output = log_file.read().strip()
+            raise Exception(f"{e}: {qemu_output}" if qemu_output else str(e))
+
+        return qmp, serial_port
+
+    def _get_balloon_vms(self):
+        with self._vms_lock:
+            vm_dicts = list(self._vms.items())
+
+        balloon_vms = []
+        for vm_name, vm_dict in vm_dicts:
+            curr_vm = vm_dict["instance"]
+            if (vm_dict["status"] != "running" or curr_vm.hv_conn == None):
+                continue
+            balloon_vms.append({
+                "vm_name": vm_name,
+                "qmp": curr_vm.hv_conn,
+                "memory_mib": self._get_vm_resources(vm_name, curr_vm.instance_type)["memory_mib"],
+                "instance_type": curr_vm.instance_type,
+            })
+        return balloon_vms
+
+    # Stopped VMs are included, their QEMU still holds their memory.
+    def _get_metric_vms(self):
+        with self._vms_lock:
+            vm_dicts = list(self._vms.items())
+
+        metric_vms = []
+        for vm_name, vm_dict in vm_dicts:
+            curr_vm = vm_dict["instance"]
+            if (curr_vm.pid == None or curr_vm.hv_conn == None):
+                continue
+            metric_vms.append({
+                "vm_name": vm_name,
+                "pid": curr_vm.pid,
+                "qmp": curr_vm.hv_conn,
+                "tap_intf": curr_vm.tap_intf or self.network_manager.get_vm_tap_name(vm_name),
+            })
+        return metric_vms
+
+    # Guest memory comes from a single backend bound to the VM's NUMA node,
+    # taken from hugetlbfs when the placement reserved hugepages for it.
+    # Unplaced VMs get the same backend without a binding, so that a VM
+    # hibernated with one layout can be restored with the other.
+    def _memory_args(self, placement, vcpus, memory_mib):
+        if (placement == None):
+            backend = f"memory-backend-ram,id=mem0,size={memory_mib}M"
+        elif (placement["hugepages"]):
+            backend = (f"memory-backend-file,id=mem0,size={memory_mib}M,mem-path={placement['mem_path']},"
+                f"share=on,prealloc=on,host-nodes={placement['node']},policy=bind")
+        else:
+            backend = f"memory-backend-ram,id=mem0,size={memory_mib}M,host-nodes={placement['node']},policy=bind"
+
+        return [
+            "-object", backend,
+            "-numa", f"node,nodeid=0,cpus=0-{vcpus - 1},memdev=mem0",
+        ]
+
+    # QEMU as a whole is confined to the placement's CPUs by taskset, each
+    # vCPU thread is then pinned to one of them.
+    def _pin_vcpus(self, qmp, placement):
+        cpus = placement["cpus"]
+        for vcpu in qmp.execute("query-cpus-fast"):
+            os.sched_setaffinity(vcpu["thread-id"], {cpus[vcpu["cpu-index"] % len(cpus)]})
+
+    def _read_vm_placement(self, vm_name, qmp):
+        try:
+            cpus = set()
+            for vcpu in qmp.execute("query-cpus-fast"):
+                cpus.update(os.sched_getaffinity(vcpu["thread-id"]))
+            if (len(cpus) == 0 or len(cpus) == os.cpu_count()):
+                return
+
+            # Only hugepage backed VMs have a mem-path on their backend.
+            mem_path = ""
+            memory_mib = 0
+            try:
+                mem_path = qmp.execute("qom-get", {"path": "/objects/mem0", "property": "mem-path"})
+                memory_mib = qmp.execute("qom-get", {"path": "/objects/mem0", "property": "size"}) // (1024 * 1024)
+            except Exception:
+                pass
+
+            self._placement.adopt(vm_name, sorted(cpus), mem_path, memory_mib)
+        except Exception as e:
+            print(f"Failed to read placement of vm {vm_name}: {e}")
 
-        return vm_name
+    # The console hub drains the PTY, so output shows up in the VM's console
+    # log rather than on the PTY itself.
+    def _wait_for_serial_output(self, console_log, log_offset, deadline):
+        if (not console_log.wait(log_offset, timeout=max(deadline - time.monotonic(), 0))):
+            raise Exception("Timed out waiting for serial output")
+
+    def _wait_for_guest_agent(self, vm_name, deadline):
+        while time.monotonic() < deadline:
+            if (self._guest_agent.ping(vm_name, timeout=min(max(deadline - time.monotonic(), 0.1), 1.0))):
+                return
+            time.sleep(0.1)
+
+        raise Exception("Timed out waiting for the guest agent")
 
     def shutdown_vm(self, vm_name=""):
-        vm_dict = self._vms.get(vm_name)
-        if (vm_dict == None or vm_dict["status"] != "running"):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
             return ""
-        curr_vm = vm_dict["instance"]
-        try:
-            self._send_command_to_vm(curr_vm, "system_powerdown")
-            print(vm_dict)
-            vm_dict["status"] = "down"
-        except Exception as e:
-            print(f"Failed to shutdown vm: {e}")
 
-        return vm_name
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None or vm_dict["status"] != "running"):
+                return ""
+            curr_vm = vm_dict["instance"]
+            try:
+                self._send_command_to_vm(curr_vm, "system_powerdown")
+                self._set_vm_status(vm_name, vm_dict, "shutting_down")
+            except Exception as e:
+                print(f"Failed to shutdown vm: {e}")
+
+            return vm_name
 
     def resume_vm(self, vm_name=""):
-        vm_dict = self._vms.get(vm_name)
-        if (vm_dict == None or vm_dict["status"] != "stopped"):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
             return ""
-        curr_vm = vm_dict["instance"]
-        try:
-            self._send_command_to_vm(curr_vm, "cont")
-            vm_dict["status"] = "running"
-        except Exception as e:
-            print(f"Failed to start vm: {e}")
 
-        return vm_name
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None or vm_dict["status"] != "stopped"):
+                return ""
+            curr_vm = vm_dict["instance"]
+            try:
+                self._send_command_to_vm(curr_vm, "cont")
+                self._set_vm_status(vm_name, vm_dict, "running")
+            except Exception as e:
+                print(f"Failed to start vm: {e}")
+
+            return vm_name
 
     def stop_vm(self, vm_name=""):
-        vm_dict = self._vms.get(vm_name)
-        if (vm_dict == None or vm_dict["status"] != "running"):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
             return ""
-        curr_vm = vm_dict["instance"]
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None or vm_dict["status"] != "running"):
+                return ""
+            curr_vm = vm_dict["instance"]
+            try:
+                self._send_command_to_vm(curr_vm, "stop")
+                self._set_vm_status(vm_name, vm_dict, "stopped")
+            except Exception as e:
+                print(f"Failed to start vm: {e}")
+
+            return vm_name
+
+    # Hibernation saves the guest's memory and device state through QEMU's
+    # migration stream into a zstd compressed file and then ends QEMU, so a
+    # hibernated VM holds no host memory or capacity until it is restored.
+    def hibernate_vm(self, vm_name=""):
+        result = {"vm_name": vm_name, "error": "", "state_size": 0, "memory_size": 0, "duration": 0.0}
+
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
+            result["vm_name"] = ""
+            return result
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None):
+                result["vm_name"] = ""
+                return result
+            curr_vm = vm_dict["instance"]
+            if (vm_dict["status"] not in ["running", "stopped"] or curr_vm.hv_conn == None):
+                result["error"] = f"VM is {vm_dict['status']}"
+                return result
+
+            start_time = time.monotonic()
+            state_path = self._get_vm_state_path(vm_name)
+            previous_status = vm_dict["status"]
+            self._set_vm_status(vm_name, vm_dict, "hibernating")
+            try:
+                self._send_command_to_vm(curr_vm, "stop")
+                self._send_command_to_vm(curr_vm, "migrate-set-parameters",
+                    {"max-bandwidth": MIGRATION_MAX_BANDWIDTH})
+                self._send_command_to_vm(curr_vm, "migrate",
+                    {"uri": f"exec:zstd -q -f -T0 -o {shlex.quote(state_path + '.tmp')}"})
+                migration = self._wait_for_migration(curr_vm.hv_conn)
+                os.replace(f"{state_path}.tmp", state_path)
+            except Exception as e:
+                if (os.path.exists(f"{state_path}.tmp")):
+                    os.remove(f"{state_path}.tmp")
+                if (previous_status == "running"):
+                    try:
+                        self._send_command_to_vm(curr_vm, "cont")
+                    except Exception:
+                        pass
+                self._set_vm_status(vm_name, vm_dict, previous_status)
+                result["error"] = f"Failed to save VM state: {e}"
+                return result
+
+            # A VM that was paused is restored paused, the inventory keeps
+            # this across server restarts like the state file does.
+            vm_record = self._inventory.get_vm(vm_name)
+            if (vm_record != None):
+                vm_record["paused"] = previous_status == "stopped"
+                self._inventory.put_vm(vm_record)
+
+            # QEMU exiting moves the VM to hibernated, see _handle_vm_exit.
+            pid = curr_vm.pid
+            try:
+                self._send_command_to_vm(curr_vm, "quit")
+            except Exception:
+                pass
+            deadline = time.monotonic() + 10.0
+            while vm_dict["status"] == "hibernating" and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if (vm_dict["status"] == "hibernating" and pid != None):
+                os.kill(pid, signal.SIGKILL)
+
+            self._capacity.release(vm_name)
+
+            result["state_size"] = os.path.getsize(state_path)
+            result["memory_size"] = migration.get("ram", {}).get("total", 0)
+            result["duration"] = time.monotonic() - start_time
+
+        return result
+
+    # The VM is started with the same devices and memory layout it had, QEMU
+    # then loads the saved state instead of booting and the guest continues
+    # where it left off.
+    def restore_vm(self, vm_name=""):
+        result = {"vm_name": vm_name, "error": "", "state_size": 0, "duration": 0.0}
+
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
+            result["vm_name"] = ""
+            return result
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None):
+                result["vm_name"] = ""
+                return result
+            curr_vm = vm_dict["instance"]
+            if (vm_dict["status"] != "hibernated"):
+                result["error"] = f"VM is {vm_dict['status']}"
+                return result
+
+            if (not self._capacity.reserve(vm_name, self._get_vm_resources(vm_name, curr_vm.instance_type))):
+                result["error"] = "capacity: not enough free vcpus or memory"
+                return result
+
+            start_time = time.monotonic()
+            state_path = self._get_vm_state_path(vm_name)
+            state_size = os.path.getsize(state_path)
+            vm_record = self._inventory.get_vm(vm_name) or {}
+            paused = vm_record.get("paused", False)
+            self._set_vm_status(vm_name, vm_dict, "restoring")
+            try:
+                curr_vm.hv_conn, curr_vm.serial_conn = self._launch_vm(vm_name, curr_vm, incoming=True)
+                self._send_command_to_vm(curr_vm, "migrate-incoming",
+                    {"uri": f"exec:zstd -q -d -c {shlex.quote(state_path)}"})
+                self._wait_for_migration(curr_vm.hv_conn)
+                if (not paused):
+                    self._send_command_to_vm(curr_vm, "cont")
+            except Exception as e:
+                if (curr_vm.hv_conn != None):
+                    try:
+                        self._send_command_to_vm(curr_vm, "quit")
+                    except Exception:
+                        pass
+                self._capacity.release(vm_name)
+                self._set_vm_status(vm_name, vm_dict, "hibernated")
+                result["error"] = f"Failed to restore VM state: {e}"
+                return result
+
+            self._set_vm_status(vm_name, vm_dict, "stopped" if paused else "running")
+            os.remove(state_path)
+            if (vm_record.pop("paused", None) != None):
+                self._inventory.put_vm(vm_record)
+
+            result["state_size"] = state_size
+            result["duration"] = time.monotonic() - start_time
+
+        return result
+
+    def _get_vm_state_path(self, vm_name):
+        return f"{self._hibernate_location}/{vm_name}.state.zst"
+
+    def _wait_for_migration(self, qmp, timeout=600.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            migration = qmp.execute("query-migrate")
+            status = migration.get("status", "")
+            if (status == "completed"):
+                return migration
+            if (status in ["failed", "cancelled"]):
+                raise Exception(migration.get("error-desc", f"migration {status}"))
+            time.sleep(0.05)
+
+        raise Exception("Timed out waiting for the migration to finish")
+
+    def _wait_for_block_job(self, qmp, job_id, timeout=3600.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = next((job for job in qmp.execute("query-block-jobs") if job["device"] == job_id), None)
+            if (job == None):
+                raise Exception(f"Block job {job_id} ended before it was ready")
+            if (job["ready"]):
+                return job
+            time.sleep(0.1)
+
+        raise Exception(f"Timed out waiting for block job {job_id}")
+
+    def _get_vm_drive(self, curr_vm):
+        for block in self._send_command_to_vm(curr_vm, "query-block"):
+            if (block.get("inserted", {}).get("file") == curr_vm.disk_location):
+                return block
+
+        raise Exception(f"QEMU has no drive for {curr_vm.disk_location}")
+
+    # Moves a VM to the dataplane server at target_endpoint while it keeps
+    # running. The target prepares the VM's tap, IP and disk and waits in QEMU
+    # with -incoming. The disk is mirrored to it over NBD, and memory is
+    # streamed over several multifd connections with auto-converge throttling
+    # guests that dirty memory faster than it can be sent. The VM only leaves
+    # this server's bookkeeping once the target has taken it over.
+    def migrate_vm(self, vm_name="", target_endpoint=""):
+        result = {"vm_name": vm_name, "error": "", "duration": 0.0, "downtime_ms": 0, "transferred": 0}
+
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
+            result["vm_name"] = ""
+            return result
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None):
+                result["vm_name"] = ""
+                return result
+            curr_vm = vm_dict["instance"]
+            if (vm_dict["status"] not in ["running", "stopped"] or curr_vm.hv_conn == None):
+                result["error"] = f"VM is {vm_dict['status']}"
+                return result
+
+            vm_record = self._inventory.get_vm(vm_name)
+            if (vm_record.get("disks")):
+                result["error"] = "VMs with attached disk partitions cannot be migrated"
+                return result
+
+            start_time = time.monotonic()
+            vm_path = f"{self._vm_location}/{vm_name}"
+            try:
+                disk_info = json.loads(subprocess.run(["qemu-img", "info", "-U", "--output=json", curr_vm.disk_location],
+                    check=True, capture_output=True).stdout)
+            except Exception as e:
+                result["error"] = f"Failed to read the vm disk: {e}"
+                return result
+
+            # Overlays on an image only have their own layer mirrored, the
+            # target backs its overlay with the same image. Clones depend on
+            # snapshots that only this server keeps, so their whole disk is.
+            backing_file = ""
+            if (vm_record.get("snapshot", "") == ""):
+                backing_file = disk_info.get("full-backing-filename", "")
+
+            files = {}
+            for fname in os.listdir(vm_path):
+                if (fname in MIGRATION_SKIPPED_FILES or fname.endswith(".qcow2") or fname.startswith(CONSOLE_LOG_NAME)):
+                    continue
+                if (fname == MIGRATION_PRIVATE_KEY and not self._migrate_private_keys):
+                    continue
+                with open(f"{vm_path}/{fname}", "rb") as vf:
+                    files[fname] = vf.read()
+
+            target_host = target_endpoint.rpartition(":")[0]
+            channel = grpc.insecure_channel(target_endpoint)
+            stub = compute_pb2_grpc.vmmStub(channel)
+
+            was_running = vm_dict["status"] == "running"
+            self._set_vm_status(vm_name, vm_dict, "migrating")
+            migrated = False
+            try:
+                prepared = stub.PrepareMigration(compute_pb2.PrepareMigrationRequest(
+                    vm_record=json.dumps(vm_record),
+                    files=files,
+                    backing_file=backing_file,
+                    backing_format=disk_info.get("backing-filename-format", ""),
+                    disk_size=disk_info["virtual-size"]), timeout=120)
+                if (prepared.error != ""):
+                    raise Exception(f"target: {prepared.error}")
+
+                # Guest writes are copied synchronously once the mirror has
+                # caught up, so the target disk is current at the switchover.
+                self._send_command_to_vm(curr_vm, "drive-mirror", {
+                    "job-id": f"mirror-{vm_name}",
+                    "device": self._get_vm_drive(curr_vm)["device"],
+                    "target": f"nbd://{target_host}:{prepared.nbd_port}/{prepared.export_name}",
+                    "format": "raw",
+                    "mode": "existing",
+                    "sync": "top" if backing_file else "full",
+                    "copy-mode": "write-blocking",
+                })
+                self._wait_for_block_job(curr_vm.hv_conn, f"mirror-{vm_name}")
+
+                self._send_command_to_vm(curr_vm, "migrate-set-capabilities", {"capabilities": [
+                    {"capability": "multifd", "state": True},
+                    {"capability": "auto-converge", "state": True},
+                ]})
+                self._send_command_to_vm(curr_vm, "migrate-set-parameters", {
+                    "multifd-channels": MIGRATION_MULTIFD_CHANNELS,
+                    "max-bandwidth": MIGRATION_MAX_BANDWIDTH,
+                })
+                self._send_command_to_vm(curr_vm, "migrate", {"uri": f"tcp:{target_host}:{prepared.migration_port}"})
+                migration = self._wait_for_migration(curr_vm.hv_conn, timeout=3600.0)
+                migrated = True
+
+                self._send_command_to_vm(curr_vm, "block-job-cancel", {"device": f"mirror-{vm_name}"})
+                finished = stub.FinishMigration(compute_pb2.FinishMigrationRequest(vm_name=vm_name,
+                    success=True, running=was_running), timeout=60)
+                if (finished.error != ""):
+                    raise Exception(f"target: {finished.error}")
+            except Exception as e:
+                if (not migrated):
+                    for cmd, arguments in [("migrate_cancel", None),
+                            ("block-job-cancel", {"device": f"mirror-{vm_name}", "force": True})]:
+                        try:
+                            self._send_command_to_vm(curr_vm, cmd, arguments)
+                        except Exception:
+                            pass
+                    if (was_running):
+                        try:
+                            self._send_command_to_vm(curr_vm, "cont")
+                        except Exception:
+                            pass
+                    self._set_vm_status(vm_name, vm_dict, "running" if was_running else "stopped")
+                    try:
+                        stub.FinishMigration(compute_pb2.FinishMigrationRequest(vm_name=vm_name, success=False),
+                            timeout=60)
+                    except Exception:
+                        pass
+                else:
+                    # The guest may already be running on the target, so it
+                    # must not be resumed here.
+                    self._set_vm_status(vm_name, vm_dict, "migrated")
+                    print(f"VM {vm_name} may be running on {target_endpoint}, check it there and delete "
+                        f"the copy that is not needed")
+                channel.close()
+                result["error"] = f"Failed to migrate VM: {e}"
+                return result
+            channel.close()
+
+            self._stop_qemu(curr_vm.hv_conn, curr_vm.pid)
+            self.network_manager.deallocate_vm_tap_interface(vm_name)
+            if (vm_name in self.network_manager.ip_manager.used_ips):
+                self.network_manager.ip_manager.release_ip(vm_name)
+            shutil.rmtree(vm_path)
+
+            self._inventory.remove_vm(vm_name)
+            self._capacity.release(vm_name)
+            self._placement.release(vm_name)
+
+            with self._vms_lock:
+                del self._vms[vm_name]
+                del self._vm_locks[vm_name]
+            self._vm_index.remove(vm_name)
+            self._console_hub.remove_vm(vm_name)
+            self._guest_agent.remove(vm_name)
+            self._vm_events.publish("DELETED", vm_name)
+
+        self._collect_snapshots()
+
+        result["duration"] = time.monotonic() - start_time
+        result["downtime_ms"] = migration.get("downtime", 0)
+        result["transferred"] = migration.get("ram", {}).get("transferred", 0)
+        return result
+
+    # Called through PrepareMigration by the server a VM is migrated from.
+    # The VM gets the same MAC and IP it had there and a disk that its
+    # mirror is written into, and QEMU waits for its state. It stays out of
+    # _vms and the inventory until finish_incoming_migration.
+    def prepare_incoming_migration(self, vm_record, files, backing_file="", backing_format="", disk_size=0):
+        result = {"error": "", "migration_port": 0, "nbd_port": 0, "export_name": ""}
+
+        vm_name = vm_record["name"]
+        with self._vms_lock:
+            if (vm_name in self._vms or vm_name in self._incoming):
+                result["error"] = f"VM {vm_name} already exists"
+                return result
+            self._incoming[vm_name] = None
+
+        vm_path = f"{self._vm_location}/{vm_name}"
+        disk_path = f"{vm_path}/{vm_name}.qcow2"
+        ctx = {
+            "vm_name": vm_name,
+            "instance_type": vm_record["instance_type"],
+            "image": vm_record.get("image", DEFAULT_IMAGE),
+            "mac_address": vm_record["mac_address"],
+            "labels": vm_record.get("labels", {}),
+        }
+        curr_vm = None
         try:
-            self._send_command_to_vm(curr_vm, "stop")
+            os.makedirs(vm_path)
+            for fname, content in files.items():
+                if (fname.endswith(".conf")):
+                    content = content.replace(vm_record["disk_location"].encode(), disk_path.encode())
+                with open(f"{vm_path}/{fname}", "wb") as vf:
+                    vf.write(content)
+                if (fname == MIGRATION_PRIVATE_KEY):
+                    os.chmod(f"{vm_path}/{fname}", 0o600)
+
+            if (backing_file != ""):
+                if (not os.path.exists(backing_file)):
+                    raise Exception(f"Backing image {backing_file} is not present on this host")
+                create_disk_cmd = ["qemu-img", "create", "-f", "qcow2", "-b", backing_file, "-F", backing_format, disk_path]
+            else:
+                create_disk_cmd = ["qemu-img", "create", "-f", "qcow2", disk_path, str(disk_size)]
+            subprocess.run(create_disk_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            if (not self._capacity.reserve(vm_name, self._get_vm_resources(vm_name, ctx["instance_type"]))):
+                raise Exception("capacity: not enough free vcpus or memory")
+
+            self._network_ready.wait()
+            ctx["tap_intf"] = self.network_manager.allocate_vm_tap_interface(vm_name)
+            self.network_manager.reserve_mac(vm_record["mac_address"])
+            self.network_manager.ip_manager.reserve_ip(vm_name, vm_record["ip_address"])
+            ctx["ip_address"] = vm_record["ip_address"]
+
+            curr_vm = VM(vm_name, disk_location=disk_path, tap_intf=ctx["tap_intf"],
+                ip_address=ctx["ip_address"], mac_address=ctx["mac_address"],
+                instance_type=ctx["instance_type"])
+            curr_vm.hv_conn, curr_vm.serial_conn = self._launch_vm(vm_name, curr_vm, incoming=True)
+
+            result["nbd_port"] = find_free_port()
+            result["migration_port"] = find_free_port()
+            result["export_name"] = vm_name
+            self._send_command_to_vm(curr_vm, "nbd-server-start", {"addr": {"type": "inet",
+                "data": {"host": "0.0.0.0", "port": str(result["nbd_port"])}}})
+            self._send_command_to_vm(curr_vm, "block-export-add", {"type": "nbd", "id": "migration",
+                "node-name": self._get_vm_drive(curr_vm)["inserted"]["node-name"],
+                "name": result["export_name"], "writable": True})
+            self._send_command_to_vm(curr_vm, "migrate-set-capabilities", {"capabilities": [
+                {"capability": "multifd", "state": True},
+            ]})
+            self._send_command_to_vm(curr_vm, "migrate-set-parameters",
+                {"multifd-channels": MIGRATION_MULTIFD_CHANNELS})
+            self._send_command_to_vm(curr_vm, "migrate-incoming", {"uri": f"tcp:0.0.0.0:{result['migration_port']}"})
+        except Exception as e:
+            if (curr_vm != None and curr_vm.hv_conn != None):
+                self._stop_qemu(curr_vm.hv_conn, curr_vm.pid)
+            self._cleanup_failed_vm(ctx)
+            with self._vms_lock:
+                del self._incoming[vm_name]
+            result["error"] = str(e)
+            return result
+
+        with self._vms_lock:
+            self._incoming[vm_name] = {"ctx": ctx, "instance": curr_vm}
+        return result
+
+    # Takes over the VM once the source has finished sending it, or throws
+    # the prepared VM away when the migration failed.
+    def finish_incoming_migration(self, vm_name="", success=False, running=True):
+        with self._vms_lock:
+            incoming = self._incoming.get(vm_name)
+            if (incoming == None):
+                return f"No migration of vm {vm_name} is in progress"
+            del self._incoming[vm_name]
+
+        ctx = incoming["ctx"]
+        curr_vm = incoming["instance"]
+        try:
+            if (not success):
+                raise Exception("Migration failed on the source")
+
+            self._send_command_to_vm(curr_vm, "block-export-del", {"id": "migration", "mode": "hard"})
+            self._send_command_to_vm(curr_vm, "nbd-server-stop")
+            self._wait_for_migration(curr_vm.hv_conn)
+            if (running and self._send_command_to_vm(curr_vm, "query-status")["status"] != "running"):
+                self._send_command_to_vm(curr_vm, "cont")
         except Exception as e:
-            print(f"Failed to start vm: {e}")
+            if (curr_vm.hv_conn != None):
+                self._stop_qemu(curr_vm.hv_conn, curr_vm.pid)
+            self._cleanup_failed_vm(ctx)
+            return "" if not success else str(e)
+
+        self._inventory.put_vm(self._vm_record(ctx))
+        with self._vms_lock:
+            self._vms[vm_name] = {"instance": curr_vm, "status": "running" if running else "stopped"}
+            self._vm_locks[vm_name] = threading.RLock()
+        self._vm_index.add(vm_name, "running" if running else "stopped", ctx.get("labels"))
+        self._vm_events.publish("ADDED", vm_name, "running" if running else "stopped")
 
-        return vm_name
+        return ""
+
+    def _send_command_to_vm(self, curr_vm, cmd, arguments=None, timeout=5.0):
+        return curr_vm.hv_conn.execute(cmd, arguments=arguments, timeout=timeout)
+
+    def _connect_qmp(self, vm_name, timeout=5.0, alive=None):
+        qmp = QMPClient(f"{self._run_location}/{vm_name}.sock",
+            event_handler=lambda event: self._handle_vm_event(vm_name, event),
+            close_handler=lambda: self._handle_vm_exit(vm_name))
+        qmp.connect(timeout=timeout, alive=alive)
+        return qmp
+
+    # Status changes are driven by the events QEMU emits, so a guest that
+    # pauses or powers itself off is reflected without polling.
+    def _handle_vm_event(self, vm_name, event):
+        status = VM_EVENT_STATUS.get(event["event"])
+        if (status == None):
+            return
+
+        with self._vms_lock:
+            vm_dict = self._vms.get(vm_name)
+        if (vm_dict != None and vm_dict["status"] not in VM_TRANSITION_STATUSES):
+            self._set_vm_status(vm_name, vm_dict, status)
 
-    def _send_command_to_vm(self, curr_vm, cmd):
-        sock = curr_vm.hv_conn
-        time.sleep(0.3)
+    def _handle_vm_exit(self, vm_name):
+        self._placement.release(vm_name)
+        self._guest_agent.remove(vm_name)
 
-        sock.send(f"{cmd}\r\n".encode())
-        time.sleep(0.3)
+        with self._vms_lock:
+            vm_dict = self._vms.get(vm_name)
+        if (vm_dict == None):
+            return
+
+        curr_vm = vm_dict["instance"]
+        curr_vm.hv_conn = None
+        curr_vm.serial_conn = None
+        curr_vm.pid = None
+        if (vm_dict["status"] == "migrated"):
+            return
+        if (vm_dict["status"] in VM_TRANSITION_STATUSES and os.path.exists(self._get_vm_state_path(vm_name))):
+            self._set_vm_status(vm_name, vm_dict, "hibernated")
+        else:
+            self._set_vm_status(vm_name, vm_dict, "down")
 
-        response = sock.recv(1024).decode()
-        return response
+    def _set_vm_status(self, vm_name, vm_dict, status):
+        vm_dict["status"] = status
+        self._vm_index.set_status(vm_name, status)
+        self._vm_events.publish("MODIFIED", vm_name, status)
 
     def allocate_vm_disk(self, vm_id):
         vm_path = f"{self._vm_location}/{vm_id}/{vm_id}.qcow2"
@@ -320,13 +2124,14 @@ class VMManager():
             print(f"Failed to create disk: {e}")
             return False
 
-    def copy_vm_image(self, vm_id):
+    def copy_vm_image(self, vm_id, image=DEFAULT_IMAGE):
         try:
+            image = self._distro_manager.image_store.get_image(image)
             copy_image_cmd = [
                 "qemu-img", "create",
                 "-f", "qcow2",
-                "-b", "/IGS/compute/images/ubuntu_22.04.5_base.qcow2",
-                "-F", "qcow2",
+                "-b", image["path"],
+                "-F", image["format"],
                 f"{self._vm_location}/{vm_id}/{vm_id}.qcow2",
                 "10G"
             ]
@@ -338,59 +2143,47 @@ class VMManager():
         except Exception as e:
             print(f"Failed to create vm disk: {e}")
 
-    def write_vm_config(self, vm_id):
+    def write_vm_config(self, vm_id, instance_type="micro"):
         try:
-            with open("conf/instances/micro.conf", "r") as cfile:
-                content = cfile.read()
-                content = content.replace("GNAME", vm_id)
-                content = content.replace("FPATH", f"/IGS/compute/vms/{vm_id}/{vm_id}.qcow2")
-                with open(f"/IGS/compute/vms/{vm_id}/{vm_id}.conf", "w") as fcfile:
-                    fcfile.write(content)
+            content = self._catalog.render_config(instance_type, vm_id,
+                f"{self._vm_location}/{vm_id}/{vm_id}.qcow2", accel=self._accel)
+            with open(f"{self._vm_location}/{vm_id}/{vm_id}.conf", "w") as fcfile:
+                fcfile.write(content)
         except Exception as e:
             print(f"Failed to open instance config file: {e}")
 
     def get_vm_status(self, vm_name=-1):
-        vm_dict = self._vms.get(vm_name)
-        if (vm_dict == None or vm_dict["status"] != "stopped"):
+        vm_lock = self._get_vm_lock(vm_name)
+        if (vm_lock == None):
             return ""
-        curr_vm = vm_dict["instance"]
-        try:
-            cmd_output = self._send_command_to_vm(curr_vm, "info status")
-            status = re.search(r"VM status: (\w+)", cmd_output).group(1)
-        except Exception as e:
-            print(f"Failed to start vm: {e}")
-        return status
+
+        with vm_lock:
+            vm_dict = self._vms.get(vm_name)
+            if (vm_dict == None):
+                return ""
+            curr_vm = vm_dict["instance"]
+            if (curr_vm.hv_conn == None):
+                return vm_dict["status"]
+
+            status = ""
+            try:
+                status = self._send_command_to_vm(curr_vm, "query-status")["status"]
+            except Exception as e:
+                print(f"Failed to get vm status: {e}")
+            return status
 
     def get_vm_link(self, vm_name=-1):
         vm_dict = self._vms.get(vm_name)
         if (vm_dict == None):
             return ""
-        curr_vm = vm_dict["instance"]
 
-        socket_path = f"/tmp/{vm_name}_qga.sock"
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
-            sock.connect(socket_path)
-            command = json.dumps({"execute": "guest-network-get-interfaces"})
-            sock.send(command.encode())
-
-            response = "" + sock.recv(4096).decode()
-            interfaces = json.loads(response)
-            for iface in interfaces["return"]:
+            interfaces = self._guest_agent.execute(vm_name, "guest-network-get-interfaces")
+            for iface in interfaces:
                 if iface["name"] != "lo":
-                    for addr in iface["ip-addresses"]:
+                    for addr in iface.get("ip-addresses", []):
                         if addr["ip-address-type"] == "ipv4" and addr["ip-address"].startswith("10"):
                             return (addr["ip-address"], f"{self.network_manager.port_map[vm_name]}")
-            sock.close()
         except Exception as e:
             print(f"Failed to get VM IP: {e}")
         return ""
-
-    def update_vm_cloud_init(self, vm_name, old_string="", new_string=""):
-        conf_path = f"{self._vm_location}/{vm_name}/user-data"
-        with open(conf_path, 'r') as file:
-            conf_data = file.read()
-        conf_data = conf_data.replace(old_string, new_string)
-
-        with open(conf_path, 'w') as file:
-            file.write(conf_data)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import threading
+import time
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pyroute2 import IPRoute
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# query-blockstats field for each exported block counter.
+BLOCK_COUNTERS = {
+    "read_bytes": "rd_bytes",
+    "written_bytes": "wr_bytes",
+    "reads": "rd_operations",
+    "writes": "wr_operations",
+    "flushes": "flush_operations",
+}
+
+# Tap counters are counted by the host, so what the tap receives is what
+# the guest transmitted and the other way round.
+NETWORK_COUNTERS = {
+    "receive_bytes": "tx_bytes",
+    "transmit_bytes": "rx_bytes",
+    "receive_packets": "tx_packets",
+    "transmit_packets": "rx_packets",
+    "receive_drops": "tx_dropped",
+    "transmit_drops": "rx_dropped",
+}
+
+# Reads the CPU time and resident memory of a process from /proc, returns
+# None once the process is gone.
+def read_process_stats(pid, proc_root="/proc"):
+    try:
+        with open(f"{proc_root}/{pid}/stat", "r") as sf:
+            # The command name may contain spaces, the fields after it are
+            # counted from its closing parenthesis.
+            fields = sf.read().rpartition(")")[2].split()
+        return {
+            "cpu_seconds": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+            "rss_bytes": int(fields[21]) * PAGE_SIZE,
+        }
+    except (OSError, IndexError, ValueError):
+        return None
+
+class VMMetricsCollector:
+
+    def __init__(self): ...
+    def add(self, sampler): ...
+    def remove(self, sampler): ...
+    def collect(self): ...
+
+    # Reports the last samples of every sampler. Servers sharing a process,
+    # as in the migration tests, each have a sampler, and a metric name can
+    # only be registered once.
+    def __init__(self):
+        self._samplers = []
+        self._lock = threading.Lock()
+
+    def add(self, sampler):
+        with self._lock:
+            self._samplers.append(sampler)
+
+    def remove(self, sampler):
+        with self._lock:
+            if (sampler in self._samplers):
+                self._samplers.remove(sampler)
+
+    def collect(self):
+        with self._lock:
+            samplers = list(self._samplers)
+
+        cpu = CounterMetricFamily("igs_vm_cpu_seconds", "CPU time used by the VM's QEMU process", labels=["vm"])
+        rss = GaugeMetricFamily("igs_vm_memory_rss_bytes", "Resident memory of the VM's QEMU process",
+            labels=["vm"])
+        block = {name: CounterMetricFamily(f"igs_vm_block_{name}", f"Block device {name.replace('_', ' ')}",
+            labels=["vm", "device"]) for name in BLOCK_COUNTERS}
+        network = {name: CounterMetricFamily(f"igs_vm_network_{name}",
+            f"Network {name.replace('_', ' ')} of the VM", labels=["vm", "interface"]) for name in NETWORK_COUNTERS}
+
+        for sampler in samplers:
+            for sample in sampler.samples:
+                vm_name = sample["vm_name"]
+                cpu.add_metric([vm_name], sample["process"]["cpu_seconds"])
+                rss.add_metric([vm_name], sample["process"]["rss_bytes"])
+                for device, stats in sample["block"].items():
+                    for name, field in BLOCK_COUNTERS.items():
+                        block[name].add_metric([vm_name, device], stats.get(field, 0))
+                for interface, stats in sample["network"].items():
+                    for name, field in NETWORK_COUNTERS.items():
+                        network[name].add_metric([vm_name, interface], stats.get(field, 0))
+
+        yield cpu
+        yield rss
+        yield from block.values()
+        yield from network.values()
+        yield GaugeMetricFamily("igs_vm_metrics_sample_seconds", "Time the last pass over all VMs took",
+            value=max([sampler.sample_duration for sampler in samplers], default=0.0))
+
+VM_METRICS = VMMetricsCollector()
+REGISTRY.register(VM_METRICS)
+
+class VMMetricsSampler:
+
+    def __init__(self): ...
+    def start(self): ...
+    def stop(self): ...
+    def sample(self): ...
+
+    def _read_block_stats(self, qmp): ...
+    def _read_tap_stats(self, tap_names): ...
+    def _run(self): ...
+
+    # vms_func returns the VMs with a QEMU process as dicts with vm_name, pid,
+    # qmp and tap_intf. Every interval all of them are sampled in one pass,
+    # one /proc read and one query-blockstats on the VM's open QMP connection
+    # each, and a single netlink dump for every tap. Scrapes are served from
+    # the last pass and never touch the VMs.
+    def __init__(self, vms_func, interval=10.0, proc_root="/proc", ipr=None, collector=VM_METRICS):
+        self._vms_func = vms_func
+        self._interval = interval
+        self._proc_root = proc_root
+        self._ipr = ipr
+        self._collector = collector
+        self.samples = []
+        self.sample_duration = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if (self._thread != None):
+            return
+
+        if (self._ipr == None):
+            self._ipr = IPRoute()
+        self._collector.add(self)
+        self._thread = threading.Thread(target=self._run, name="vm-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._collector.remove(self)
+
+    # Samples every VM and returns the samples, which the next scrape
+    # reports.
+    def sample(self):
+        start_time = time.monotonic()
+        vms = self._vms_func()
+        tap_stats = self._read_tap_stats([vm["tap_intf"] for vm in vms if vm.get("tap_intf")])
+
+        samples = []
+        for vm in vms:
+            process_stats = read_process_stats(vm["pid"], self._proc_root)
+            if (process_stats == None):
+                continue
+            tap_name = vm.get("tap_intf")
+            samples.append({
+                "vm_name": vm["vm_name"],
+                "process": process_stats,
+                "block": self._read_block_stats(vm["qmp"]),
+                "network": {tap_name: tap_stats[tap_name]} if tap_name in tap_stats else {},
+            })
+
+        self.samples = samples
+        self.sample_duration = time.monotonic() - start_time
+        return samples
+
+    # A VM whose monitor does not answer quickly is left without block
+    # stats for this pass rather than holding up all the others.
+    def _read_block_stats(self, qmp):
+        block_stats = {}
+        try:
+            for entry in qmp.execute("query-blockstats", timeout=1.0):
+                device = entry.get("device") or entry.get("qdev") or entry.get("node-name", "")
+                block_stats[device] = entry["stats"]
+        except Exception:
+            pass
+        return block_stats
+
+    # Returns {tap_name: stats} from one dump of all links, so that the
+    # number of VMs does not change the number of netlink requests.
+    def _read_tap_stats(self, tap_names):
+        if (len(tap_names) == 0):
+            return {}
+
+        tap_names = set(tap_names)
+        tap_stats = {}
+        try:
+            for link in self._ipr.get_links():
+                name = link.get_attr("IFLA_IFNAME")
+                stats = link.get_attr("IFLA_STATS64")
+                if (name in tap_names and stats != None):
+                    tap_stats[name] = {field: stats[field] for field in NETWORK_COUNTERS.values()}
+        except Exception as e:
+            print(f"Failed to read tap interface counters: {e}")
+        return tap_stats
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Failed to sample VM metrics: {e}")
+            if (self._stopped.wait(self._interval)):
+                break
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import threading
+from collections import deque
+
+from prometheus_client import Gauge, Counter
+
+WARM_POOL_SIZE = Gauge('igs_warm_pool_size', 'Provisioned VMs waiting in the warm pool', ['instance_type'])
+WARM_POOL_TARGET = Gauge('igs_warm_pool_target', 'Configured warm pool depth', ['instance_type'])
+WARM_POOL_HITS = Counter('igs_warm_pool_hits', 'VM creations served from the warm pool', ['instance_type'])
+WARM_POOL_MISSES = Counter('igs_warm_pool_misses', 'VM creations that missed the warm pool', ['instance_type'])
+
+WARM_MARKER = "warm"
+
+def parse_pool_targets(spec=""):
+    targets = {}
+    for entry in spec.split(","):
+        if (entry.strip() == ""):
+            continue
+        instance_type, _, depth = entry.partition("=")
+        targets[instance_type.strip()] = int(depth)
+    return targets
+
+class WarmPool:
+
+    def __init__(self): ...
+    def start(self): ...
+    def stop(self): ...
+
+    def add(self, ctx): ...
+    def claim(self, instance_type): ...
+    def get_stats(self): ...
+
+    def _deficit(self): ...
+    def _replenish(self): ...
+
+    # provision_func builds one unregistered VM of the given instance type and
+    # returns its creation context, or None if it could not be provisioned.
+    def __init__(self, provision_func, targets=None, retry_interval=30.0):
+        self._provision_func = provision_func
+        self._targets = dict(targets or {})
+        self._retry_interval = retry_interval
+        self._vms = {}
+        self._hits = {}
+        self._misses = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        for instance_type, target in self._targets.items():
+            self._vms[instance_type] = deque()
+            WARM_POOL_TARGET.labels(instance_type=instance_type).set(target)
+            WARM_POOL_SIZE.labels(instance_type=instance_type).set(0)
+
+    def start(self):
+        if (self._thread != None or len(self._targets) == 0):
+            return
+
+        self._thread = threading.Thread(target=self._replenish, name="warm-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def add(self, ctx):
+        instance_type = ctx["instance_type"]
+        with self._lock:
+            self._vms.setdefault(instance_type, deque()).append(ctx)
+            size = len(self._vms[instance_type])
+        WARM_POOL_SIZE.labels(instance_type=instance_type).set(size)
+
+    def claim(self, instance_type):
+        with self._lock:
+            pool = self._vms.get(instance_type)
+            ctx = pool.popleft() if pool else None
+            size = len(pool) if pool != None else 0
+
+            if (ctx != None):
+                self._hits[instance_type] = self._hits.get(instance_type, 0) + 1
+            else:
+                self._misses[instance_type] = self._misses.get(instance_type, 0) + 1
+
+        if (ctx != None):
+            WARM_POOL_HITS.labels(instance_type=instance_type).inc()
+            WARM_POOL_SIZE.labels(instance_type=instance_type).set(size)
+            self._wakeup.set()
+        else:
+            WARM_POOL_MISSES.labels(instance_type=instance_type).inc()
+
+        return ctx
+
+    def get_stats(self):
+        stats = []
+        with self._lock:
+            instance_types = set(self._targets) | set(self._vms) | set(self._misses)
+            for instance_type in sorted(instance_types):
+                stats.append({
+                    "instance_type": instance_type,
+                    "size": len(self._vms.get(instance_type, [])),
+                    "target": self._targets.get(instance_type, 0),
+                    "hits": self._hits.get(instance_type, 0),
+                    "misses": self._misses.get(instance_type, 0),
+                })
+        return stats
+
+    def _deficit(self):
+        with self._lock:
+            for instance_type, target in self._targets.items():
+                if (len(self._vms.get(instance_type, [])) < target):
+                    return instance_type
+        return None
+
+    def _replenish(self):
+        # The pool only soaks up idle capacity, so it runs at a lower priority
+        # than the threads serving RPCs.
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except Exception:
+            pass
+
+        while not self._stopped.is_set():
+            instance_type = self._deficit()
+            if (instance_type == None):
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            ctx = None
+            try:
+                ctx = self._provision_func(instance_type)
+            except Exception as e:
+                print(f"Failed to provision warm {instance_type} VM: {e}")
+
+            if (ctx == None):
+                self._wakeup.wait(self._retry_interval)
+                self._wakeup.clear()
+                continue
+
+            self.add(ctx)
@@ -22,7 +22,8 @@ install_dependencies()
     libparted-dev \
     libvirt-dev \
     libvirt-daemon-system > /dev/null \
-    genisoimage \
+    libguestfs-tools \
+    zstd \
     openvswitch-switch \
     openvswitch-common \
     apt-transport-https \
@@ -82,6 +83,10 @@ create_IGS_directories()
     sudo mkdir -p /IGS/compute/vms
     sudo mkdir -p /IGS/compute/isos
     sudo mkdir -p /IGS/compute/images
+    sudo mkdir -p /IGS/compute/keys
+    sudo mkdir -p /IGS/compute/hibernate
+    sudo mkdir -p /IGS/compute/snapshots
+    sudo mkdir -p /IGS/compute/templates
     sudo mkdir -p /IGS/storage
 }
 
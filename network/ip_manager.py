@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import yaml
+import threading
 from pathlib import Path
 
 class IPManager:
@@ -15,14 +16,14 @@ class IPManager:
         self.start = 5
         self.end = 252
         self.used_ips = {}
+        self._lock = threading.Lock()
         self.free_ips = {
         f'{i}': ""
         for i in range(self.start, self.end + 1)
         }
-        self.inventory_ips()
 
-    def inventory_ips(self):
-        vm_dir = Path("/IGS/compute/vms")
+    def inventory_ips(self, vm_location="/IGS/compute/vms"):
+        vm_dir = Path(vm_location)
         for vm_dir in vm_dir.iterdir():
             cloudinit_path = vm_dir / "user-data"
             try:
@@ -33,24 +34,33 @@ class IPManager:
                         netplan = yaml.safe_load(file['content'])
                         for interface in netplan.get('network', {}).get('ethernets', {}).values():
                             if interface.get('addresses'):
-                                ip = interface['addresses'][0].split('/')[0].split('.')[-1]
-                                self.used_ips[vm_dir.name] = ip
-                                del self.free_ips[ip]
-                                return
+                                ip = interface['addresses'][0].split('/')[0]
+                                self.reserve_ip(vm_dir.name, ip)
+                                break
             except Exception as e:
                 print(f"Error getting IP: {e}")
 
     def acquire_ip(self, vm_name=""):
-        ip = next(iter(self.free_ips))
-        del self.free_ips[ip]
-        self.used_ips[vm_name] = ip
+        with self._lock:
+            ip = next(iter(self.free_ips))
+            del self.free_ips[ip]
+            self.used_ips[vm_name] = ip
         return ip
 
+    def reserve_ip(self, vm_name, ip_address):
+        ip = ip_address.split('.')[-1]
+        with self._lock:
+            self.free_ips.pop(ip, None)
+            self.used_ips[vm_name] = ip
+
     def release_ip(self, vm_name):
-        ip = self.used_ips[vm_name]
-        del self.used_ips[vm_name]
-        self.free_ips[ip] = ""
+        with self._lock:
+            ip = self.used_ips[vm_name]
+            del self.used_ips[vm_name]
+            self.free_ips[ip] = ""
         return
 
     def get_vm_ip(self, vm_name=""):
-        return f"{self.network_subnet}.{self.used_ips[vm_name]}" or ""
+        with self._lock:
+            ip = self.used_ips[vm_name]
+        return f"{self.network_subnet}.{ip}" or ""
@@ -10,8 +10,8 @@ from network.network_manager import NetworkManager
 
 class NMServicer(network_pb2_grpc.nmServicer):
 
-    def __init__(self):
-        self.network_manager = NetworkManager()
+    def __init__(self, **options):
+        self.network_manager = NetworkManager(**options)
         self.server_socket = None
 
     def set_managers(self, vm_manager=None):
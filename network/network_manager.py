@@ -8,6 +8,7 @@ from pyroute2 import IPRoute
 import subprocess
 import sys
 import random
+import threading
 import yaml
 
 from network.ip_manager import IPManager
@@ -25,14 +26,19 @@ def run_network_cmd(cmd):
 
 class NetworkManager:
 
-    def __init__(self):
+    # tap_prefix tells apart the taps of servers sharing a host, whose VMs
+    # may have the same names while one is migrated between them.
+    def __init__(self, tap_prefix="tap_"):
+        self.tap_prefix = tap_prefix
         self._host_network_interface = IPRoute()
+        self._lock = threading.Lock()
         self._used_macs = []
         self.vm_ssh_ports = list(range(7600,7700))
         self.port_map = {}
         self.ip_manager = IPManager("192.168.100.1")
 
-        add_bridge_cmd = ["ovs-vsctl", "add-br", "ovs-vm-bridge"]
+    def setup_bridge(self):
+        add_bridge_cmd = ["ovs-vsctl", "--may-exist", "add-br", "ovs-vm-bridge"]
         run_network_cmd(add_bridge_cmd)
 
         setup_bridge_cmd = ["ip", "link", "set", "ovs-vm-bridge", "up"]
@@ -53,34 +59,66 @@ class NetworkManager:
     def setup_vm_networking_interface(self, vm_name=""):
         tap_name = vm_name + "_tap"
 
-        if (not self._host_network_interface.link_lookup(ifname=tap_name)):
-            self._host_network_interface.link('add', ifname=tap_name, kind="tuntap", mode="tap")
-            tap_index = self._host_network_interface.link_lookup(ifname=tap_name)[0]
-            self._host_network_interface.link('set', index=tap_index, state='up')
+        with self._lock:
+            if (not self._host_network_interface.link_lookup(ifname=tap_name)):
+                self._host_network_interface.link('add', ifname=tap_name, kind="tuntap", mode="tap")
+                tap_index = self._host_network_interface.link_lookup(ifname=tap_name)[0]
+                self._host_network_interface.link('set', index=tap_index, state='up')
 
         result = subprocess.run(['ovs-vsctl', 'add-port', "vm_switch", tap_name])
 
         return tap_name
 
     def generate_mac(self):
-        mac = ""
-        while (mac not in self._used_macs):
-            mac = '02:%02x:%02x:%02x:%02x:%02x' % tuple(random.randint(0, 255) for _ in range(5))
+        with self._lock:
+            mac = ""
+            while (mac == "" or mac in self._used_macs):
+                mac = '02:%02x:%02x:%02x:%02x:%02x' % tuple(random.randint(0, 255) for _ in range(5))
             self._used_macs.append(mac)
             return mac
 
     def acquire_vm_port(self, vm_name):
-        vm_port = self.vm_ssh_ports[0]
-        self.port_map[vm_name] = vm_port
-        self.vm_ssh_ports.pop(0)
-        return vm_port
+        with self._lock:
+            vm_port = self.vm_ssh_ports[0]
+            self.port_map[vm_name] = vm_port
+            self.vm_ssh_ports.pop(0)
+            return vm_port
 
     def release_vm_port(self, vm_name):
-        self.vm_ssh_ports.append(self.port_map(vm_name))
-        self.port_map.remove(vm_name)
+        with self._lock:
+            self.vm_ssh_ports.append(self.port_map[vm_name])
+            del self.port_map[vm_name]
+
+    def reserve_mac(self, mac):
+        with self._lock:
+            if (mac and mac not in self._used_macs):
+                self._used_macs.append(mac)
+
+    def get_vm_tap_name(self, vm_name):
+        return f"{self.tap_prefix}{vm_name}"[:15]
+
+    # Brings the bridge and every given tap up with one ip and one ovs-vsctl
+    # invocation instead of three commands per tap.
+    def reconcile_vm_taps(self, tap_names=[]):
+        self.setup_bridge()
+
+        if (len(tap_names) == 0):
+            return
+
+        ip_batch = ""
+        for tap_name in tap_names:
+            ip_batch += f"tuntap add dev {tap_name} mode tap\n"
+            ip_batch += f"link set {tap_name} up\n"
+        subprocess.run(["ip", "-force", "-batch", "-"], input=ip_batch.encode(),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        add_ports_cmd = ["ovs-vsctl"]
+        for tap_name in tap_names:
+            add_ports_cmd += ["--", "--may-exist", "add-port", "ovs-vm-bridge", tap_name]
+        run_network_cmd(add_ports_cmd)
 
     def allocate_vm_tap_interface(self, vm_name):
-        tap_name = f"tap_{vm_name}"[:15]
+        tap_name = self.get_vm_tap_name(vm_name)
 
         create_tap_cmd = ["ip", "tuntap", "add", "dev", tap_name, "mode", "tap"]
         run_network_cmd(create_tap_cmd)
@@ -94,7 +132,7 @@ class NetworkManager:
         return tap_name
 
     def deallocate_vm_tap_interface(self, vm_name):
-        tap_name = f"tap_{vm_name}"[:15]
+        tap_name = self.get_vm_tap_name(vm_name)
 
         add_tap_ovs_cmd = ["ovs-vsctl", "del-port", "ovs-vm-bridge", tap_name]
         run_network_cmd(add_tap_ovs_cmd)
@@ -102,9 +140,9 @@ class NetworkManager:
         create_tap_cmd = ["ip", "tuntap", "del", "dev", tap_name, "mode", "tap"]
         run_network_cmd(create_tap_cmd)
 
-    def get_vm_mac(self, vm_name):
+    def get_vm_mac(self, vm_name, vm_location="/IGS/compute/vms"):
         try:
-            with open(f"/IGS/compute/vms/{vm_name}/user-data", 'r') as f:
+            with open(f"{vm_location}/{vm_name}/user-data", 'r') as f:
                 config = yaml.safe_load(f)
 
             for wf in config.get('write_files', []):
@@ -4,22 +4,32 @@
 
 # SPDX-License-Identifier: BSD-3-Clause
 
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 import psutil
 import platform
+import threading
 import time
 
-NODE_HEALTH = Gauge('node_health', 'Overall node health status (1 = healthy, 0 = unhealthy)')
-COMPONENT_HEALTH = Gauge('component_health', 'Component health status', ['component', 'detail'])
+CHECK_DURATION = Histogram('node_health_check_duration_seconds', 'Time a health check took during a scrape',
+    ['component'], buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
 
-MEMORY_USAGE = Gauge('memory_usage_percent', 'Memory usage percentage')
-CPU_USAGE = Gauge('cpu_usage_percent', 'CPU usage percentage')
-DISK_USAGE = Gauge('disk_usage_percent', 'Disk usage percentage')
-SWAP_USAGE = Gauge('swap_usage_percent', 'Swap usage percentage')
-LOAD_AVERAGE = Gauge('load_average', 'System load average (1 minute)')
+COMPONENTS = ['memory', 'cpu', 'disk', 'swap', 'load']
+
+# Guest time is already counted in user and nice time.
+def cpu_busy_percent(previous, current):
+    deltas = {field: getattr(current, field) - getattr(previous, field) for field in current._fields}
+    total = sum(deltas.values()) - deltas.get('guest', 0) - deltas.get('guest_nice', 0)
+    idle = deltas['idle'] + deltas.get('iowait', 0)
+    if total <= 0:
+        return None
+    return max(0.0, min(100.0, (total - idle) / total * 100))
 
 class NodeHealthExporter:
-    def __init__(self):
+    # Checks run when Prometheus scrapes, so every scrape gets current
+    # numbers. None of them waits: CPU usage is the share of busy time
+    # since the previous scrape, from the cumulative counters in /proc/stat.
+    def __init__(self, thresholds=None):
         self.thresholds = {
             'memory': 90,
             'cpu': 80,
@@ -27,78 +37,77 @@ class NodeHealthExporter:
             'swap': 50,
             'load': 5,
         }
+        self.thresholds.update(thresholds or {})
         self.hostname = platform.node()
-        
+        self._cpu_lock = threading.Lock()
+        self._cpu_times = psutil.cpu_times()
+        self._cpu_percent = 0.0
+
     def check_memory(self):
-        memory = psutil.virtual_memory()
-        MEMORY_USAGE.set(memory.percent)
-        is_healthy = memory.percent < self.thresholds['memory']
-        status = f"{memory.percent:.1f}% used (threshold: {self.thresholds['memory']}%)"
-        return is_healthy, status
+        percent = psutil.virtual_memory().percent
+        return percent, percent < self.thresholds['memory']
 
     def check_cpu(self):
-        cpu_percent = psutil.cpu_percent(interval=1)
-        CPU_USAGE.set(cpu_percent)
-        is_healthy = cpu_percent < self.thresholds['cpu']
-        status = f"{cpu_percent:.1f}% used (threshold: {self.thresholds['cpu']}%)"
-        return is_healthy, status
+        with self._cpu_lock:
+            cpu_times = psutil.cpu_times()
+            percent = cpu_busy_percent(self._cpu_times, cpu_times)
+            # Scrapes closer together than a clock tick see no change and
+            # keep the last value.
+            if percent is not None:
+                self._cpu_times = cpu_times
+                self._cpu_percent = percent
+            percent = self._cpu_percent
+        return percent, percent < self.thresholds['cpu']
 
     def check_disk(self):
-        disk = psutil.disk_usage('/')
-        DISK_USAGE.set(disk.percent)
-        is_healthy = disk.percent < self.thresholds['disk']
-        status = f"{disk.percent:.1f}% used (threshold: {self.thresholds['disk']}%)"
-        return is_healthy, status
+        percent = psutil.disk_usage('/').percent
+        return percent, percent < self.thresholds['disk']
 
     def check_swap(self):
-        swap = psutil.swap_memory()
-        SWAP_USAGE.set(swap.percent)
-        is_healthy = swap.percent < self.thresholds['swap']
-        status = f"{swap.percent:.1f}% used (threshold: {self.thresholds['swap']}%)"
-        return is_healthy, status
+        percent = psutil.swap_memory().percent
+        return percent, percent < self.thresholds['swap']
 
     def check_load(self):
-        cpu_count = psutil.cpu_count()
         load_avg = psutil.getloadavg()[0]
-        LOAD_AVERAGE.set(load_avg)
-        is_healthy = load_avg < (cpu_count * self.thresholds['load'])
-        status = f"Load: {load_avg:.1f} (threshold: {cpu_count * self.thresholds['load']})"
-        return is_healthy, status
+        return load_avg, load_avg < (psutil.cpu_count() * self.thresholds['load'])
+
+    def collect(self):
+        usage = {
+            'memory': GaugeMetricFamily('memory_usage_percent', 'Memory usage percentage'),
+            'cpu': GaugeMetricFamily('cpu_usage_percent', 'CPU usage percentage'),
+            'disk': GaugeMetricFamily('disk_usage_percent', 'Disk usage percentage'),
+            'swap': GaugeMetricFamily('swap_usage_percent', 'Swap usage percentage'),
+            'load': GaugeMetricFamily('load_average', 'System load average (1 minute)'),
+        }
+        component_health = GaugeMetricFamily('component_health', 'Component health status', labels=['component'])
+        component_threshold = GaugeMetricFamily('component_threshold',
+            'Value above which a component is unhealthy, the load threshold is per CPU', labels=['component'])
 
-    def run_checks(self):
-        while True:
+        all_healthy = True
+        for component in COMPONENTS:
+            start = time.perf_counter()
             try:
-                for item in COMPONENT_HEALTH._metrics.copy():
-                    COMPONENT_HEALTH.remove(*item)
-
-                checks = {
-                    'memory': self.check_memory(),
-                    'cpu': self.check_cpu(),
-                    'disk': self.check_disk(),
-                    'swap': self.check_swap(),
-                    'load': self.check_load()
-                }
-
-                all_healthy = True
-                for component, (is_healthy, status) in checks.items():
-                    COMPONENT_HEALTH.labels(
-                        component=component,
-                        status=status
-                    ).set(1 if is_healthy else 0)
-                    
-                    if not is_healthy:
-                        all_healthy = False
-
-                NODE_HEALTH.set(1 if all_healthy else 0)
-                
-                time.sleep(10)
-
+                value, is_healthy = getattr(self, f'check_{component}')()
+                usage[component].add_metric([], value)
             except Exception as e:
-                time.sleep(10)
+                print(f"Failed to check {component}: {e}")
+                is_healthy = False
+            CHECK_DURATION.labels(component=component).observe(time.perf_counter() - start)
+
+            component_health.add_metric([component], 1 if is_healthy else 0)
+            component_threshold.add_metric([component], self.thresholds[component])
+            if not is_healthy:
+                all_healthy = False
+
+        yield from usage.values()
+        yield component_health
+        yield component_threshold
+        yield GaugeMetricFamily('node_health', 'Overall node health status (1 = healthy, 0 = unhealthy)',
+            value=1 if all_healthy else 0)
 
 if __name__ == '__main__':
     port = 9101
+    REGISTRY.register(NodeHealthExporter())
     start_http_server(port)
-    
-    exporter = NodeHealthExporter()
-    exporter.run_checks()
+
+    threading.Event().wait()
@@ -6,7 +6,7 @@
 
 main()
 {
-    sudo ./IGS_venv/bin/python3 server.py
+    sudo ./IGS_venv/bin/python3 server.py "$@"
 }
 
-main
+main "$@"
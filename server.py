@@ -4,24 +4,39 @@
 
 # SPDX-License-Identifier: BSD-3-Clause
 
+import argparse
 import grpc
 from concurrent import futures
+from prometheus_client import start_http_server
 
 from compute import compute
+from compute.key_pool import KEY_TYPES
+from compute.warm_pool import parse_pool_targets
+from compute.image_builder import parse_golden_images
+from compute.memory_controller import parse_balloon_floors
 
 from network import network
 
 from storage import storage
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+DEFAULT_MAX_WORKERS = 16
 
-    vmm_servicer = compute.VMMServicer()
-    nm_servicer = network.NMServicer()
+# vm_manager_options and network_options are passed through to VMManager
+# and NetworkManager as keyword arguments.
+# Watchers and console sessions get threads on top of max_workers, so they
+# never hold up other RPCs.
+def build_server(max_workers=DEFAULT_MAX_WORKERS, port=50051, vm_manager_options=None, network_options=None,
+                 max_watchers=compute.DEFAULT_MAX_WATCHERS, max_consoles=compute.DEFAULT_MAX_CONSOLES):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers + max_watchers + max_consoles))
+
+    vmm_servicer = compute.VMMServicer(max_watchers=max_watchers, max_consoles=max_consoles)
+    nm_servicer = network.NMServicer(**(network_options or {}))
     sm_servicer = storage.SMServicer()
 
-    vmm_servicer.setup_vm_manager(network_manager=nm_servicer.network_manager)
+    vmm_servicer.setup_vm_manager(network_manager=nm_servicer.network_manager,
+        **(vm_manager_options or {}))
     nm_servicer.set_managers(vm_manager=vmm_servicer.vm_manager)
+    sm_servicer.set_managers(vm_manager=vmm_servicer.vm_manager)
 
     compute.compute_pb2_grpc.add_vmmServicer_to_server(
         vmm_servicer, server
@@ -32,15 +47,100 @@ def serve():
     )
 
     storage.storage_pb2_grpc.add_smServicer_to_server(
-        storage.SMServicer(), server
+        sm_servicer, server
     )
 
-    server.add_insecure_port('[::]:50051')
+    server.add_insecure_port(f'[::]:{port}')
+
+    return server
+
+def serve(max_workers=DEFAULT_MAX_WORKERS, port=50051, vm_manager_options=None, network_options=None,
+          metrics_port=9102, max_watchers=compute.DEFAULT_MAX_WATCHERS, max_consoles=compute.DEFAULT_MAX_CONSOLES):
+    server = build_server(max_workers=max_workers, port=port,
+        vm_manager_options=vm_manager_options, network_options=network_options, max_watchers=max_watchers,
+        max_consoles=max_consoles)
     server.start()
 
-    print("Started the dataplane server on port 50051")
+    start_http_server(metrics_port)
+
+    print(f"Started the dataplane server on port {port} with {max_workers} workers")
 
     server.wait_for_termination()
 
 if __name__ == "__main__":
-    serve()
+    parser = argparse.ArgumentParser(description="IGS dataplane server")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+        help="Number of worker threads serving RPCs")
+    parser.add_argument("--max-watchers", type=int, default=compute.DEFAULT_MAX_WATCHERS,
+        help="Number of clients that may watch VMs at the same time")
+    parser.add_argument("--max-consoles", type=int, default=compute.DEFAULT_MAX_CONSOLES,
+        help="Number of serial console sessions that may be open at the same time")
+    parser.add_argument("--port", type=int, default=50051,
+        help="Port the dataplane server listens on")
+    parser.add_argument("--ssh-key-type", choices=KEY_TYPES, default="rsa",
+        help="Type of the SSH keys generated for new VMs")
+    parser.add_argument("--key-pool-size", type=int, default=32,
+        help="Number of SSH keypairs kept pre-generated for new VMs")
+    parser.add_argument("--warm-pool", default="",
+        help="Warm pool depth per instance type, e.g. micro=4,small=2")
+    parser.add_argument("--cpu-overcommit", type=float, default=1.0,
+        help="vCPUs that may be committed per host CPU")
+    parser.add_argument("--memory-overcommit", type=float, default=1.0,
+        help="Guest memory that may be committed per MiB of host memory")
+    parser.add_argument("--reserved-memory-mib", type=int, default=1024,
+        help="Host memory kept back from VMs")
+    parser.add_argument("--reserved-cpus", default="",
+        help="Host CPUs never pinned to VMs, e.g. 0-1")
+    parser.add_argument("--balloon-floors", default="",
+        help="Smallest balloon size per instance type in MiB or percent, e.g. micro=256,large=75%%")
+    parser.add_argument("--console-log-kib", type=int, default=256,
+        help="Serial output kept in memory per VM")
+    parser.add_argument("--console-log-files", type=int, default=0,
+        help="Rotated files each VM's serial output is also written to, 0 to keep it in memory only")
+    parser.add_argument("--state-root", default="/IGS/compute",
+        help="Directory VMs, snapshots, templates and the inventory are kept in")
+    parser.add_argument("--hibernate-location", default="",
+        help="Directory hibernated VM state is saved to, e.g. a filesystem on a scaler partition, "
+            "defaults to hibernate under the state root")
+    parser.add_argument("--accel", default="",
+        help="Accelerator VMs run with instead of their instance type's, e.g. tcg")
+    parser.add_argument("--migrate-private-keys", action="store_true",
+        help="Send VMs' SSH private keys along when migrating them, in plaintext over the migration channel")
+    parser.add_argument("--tap-prefix", default="tap_",
+        help="Prefix of the tap interfaces created for VMs")
+    parser.add_argument("--golden-images", default="",
+        help="Base images rebuilt routinely from cloud images, e.g. ubuntu-24.04=ubuntu-24.04-cloud")
+    parser.add_argument("--golden-image-interval", type=float, default=24.0,
+        help="Hours between rebuilds of the golden images")
+    parser.add_argument("--metrics-port", type=int, default=9102,
+        help="Port the dataplane Prometheus metrics are served on")
+    parser.add_argument("--vm-metrics-interval", type=float, default=10.0,
+        help="Seconds between samples of the per-VM CPU, memory, block and network metrics")
+    args = parser.parse_args()
+
+    vm_manager_options = {
+        "key_type": args.ssh_key_type,
+        "key_pool_size": args.key_pool_size,
+        "warm_pool_targets": parse_pool_targets(args.warm_pool),
+        "cpu_overcommit": args.cpu_overcommit,
+        "memory_overcommit": args.memory_overcommit,
+        "reserved_memory_mib": args.reserved_memory_mib,
+        "reserved_cpus": args.reserved_cpus,
+        "golden_images": parse_golden_images(args.golden_images),
+        "balloon_floors": parse_balloon_floors(args.balloon_floors),
+        "golden_image_interval": args.golden_image_interval * 3600,
+        "hibernate_location": args.hibernate_location,
+        "state_root": args.state_root,
+        "accel": args.accel,
+        "console_log_size": args.console_log_kib * 1024,
+        "console_log_files": args.console_log_files,
+        "vm_metrics_interval": args.vm_metrics_interval,
+        "migrate_private_keys": args.migrate_private_keys,
+    }
+    network_options = {
+        "tap_prefix": args.tap_prefix,
+    }
+
+    serve(max_workers=args.workers, port=args.port, vm_manager_options=vm_manager_options,
+        network_options=network_options, metrics_port=args.metrics_port, max_watchers=args.max_watchers,
+        max_consoles=args.max_consoles)
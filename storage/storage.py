@@ -185,6 +185,9 @@ class SMServicer(storage_pb2_grpc.smServicer):
         self.s_manager = StorageManager()
         self.server_socket = None
 
+    def set_managers(self, vm_manager=None):
+        self.s_manager.vm_manager = vm_manager
+
     def GetDisks(self, request, context):
         disk_names = self.s_manager.get_free_disks()
         return storage_pb2.GetDisksResponse(disk_names=disk_names)
@@ -26,6 +26,7 @@ class StorageManager:
 
     def __init__(self):
         self.disk_manager = DiskManager()
+        self.vm_manager = None
 
     def get_disks(self):
         return self.disk_manager.get_disks()
@@ -46,7 +47,15 @@ class StorageManager:
         return self.disk_manager.get_vm_disks(vm_name)
 
     def attach_disk_to_vm(self, vm_name):
-        return self.disk_manager.attach_disk_to_vm(vm_name)
+        ret = self.disk_manager.attach_disk_to_vm(vm_name)
+        self._sync_vm_disks(vm_name)
+        return ret
 
     def detach_disk_from_vm(self, vm_name, vm_disk_name):
-        return self.disk_manager.detach_disk_from_vm(vm_name, vm_disk_name)
+        ret = self.disk_manager.detach_disk_from_vm(vm_name, vm_disk_name)
+        self._sync_vm_disks(vm_name)
+        return ret
+
+    def _sync_vm_disks(self, vm_name):
+        if (self.vm_manager != None):
+            self.vm_manager.update_vm_disks(vm_name, self.get_vm_disks(vm_name))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import tempfile
+
+from compute.capacity import CapacityManager, host_memory_mib
+
+SMALL = {"vcpus": 1, "memory_mib": 512}
+LARGE = {"vcpus": 4, "memory_mib": 2048}
+
+def capacity(manager):
+    return {entry["resource"]: entry for entry in manager.get_capacity()}
+
+def test_host_memory_mib():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        meminfo_path = os.path.join(temp_dir, "meminfo")
+        with open(meminfo_path, "w") as mf:
+            mf.write("MemFree:         1024 kB\nMemTotal:        8388608 kB\n")
+        assert host_memory_mib(meminfo_path) == 8192
+
+def test_overcommit_ratios_and_reserved_memory():
+    manager = CapacityManager(cpu_overcommit=2.0, memory_overcommit=1.5, reserved_memory_mib=1024,
+        host_vcpus=4, host_memory=5120)
+    assert manager.total == {"vcpus": 8, "memory_mib": 6144}
+
+def test_reserve_and_release_accounting():
+    manager = CapacityManager(reserved_memory_mib=0, host_vcpus=8, host_memory=4096)
+
+    assert manager.reserve("vm1", SMALL)
+    assert manager.reserve("vm2", LARGE)
+    assert manager.committed == {"vcpus": 5, "memory_mib": 2560}
+    assert capacity(manager)["vcpus"]["free"] == 3
+    assert capacity(manager)["memory_mib"]["free"] == 1536
+
+    manager.release("vm2")
+    assert manager.committed == SMALL
+
+    # Releasing a VM that holds nothing changes nothing.
+    manager.release("vm2")
+    manager.release("unknown")
+    assert manager.committed == SMALL
+
+    manager.release("vm1")
+    assert manager.committed == {"vcpus": 0, "memory_mib": 0}
+
+def test_reserve_refuses_to_overcommit():
+    manager = CapacityManager(reserved_memory_mib=0, host_vcpus=4, host_memory=4096)
+
+    assert manager.reserve("vm1", LARGE)
+    # Out of vcpus, although memory is still free.
+    assert not manager.reserve("vm2", SMALL)
+    assert manager.committed == LARGE
+
+    manager.release("vm1")
+    assert manager.reserve("vm2", SMALL)
+    # Out of memory, although vcpus are still free.
+    assert not manager.reserve("vm3", {"vcpus": 1, "memory_mib": 4096})
+    assert manager.committed == SMALL
+
+    # VMs that already exist on the host are always accounted for.
+    assert manager.reserve("vm4", LARGE, force=True)
+    assert manager.committed == {"vcpus": 5, "memory_mib": 2560}
+    assert capacity(manager)["vcpus"]["free"] == -1
+
+def test_reserving_a_held_name_keeps_one_reservation():
+    manager = CapacityManager(reserved_memory_mib=0, host_vcpus=4, host_memory=4096)
+
+    assert manager.reserve("vm1", SMALL)
+    assert manager.reserve("vm1", SMALL)
+    assert manager.reserve("vm1", LARGE)
+    assert manager.committed == SMALL
+
+    manager.release("vm1")
+    assert manager.committed == {"vcpus": 0, "memory_mib": 0}
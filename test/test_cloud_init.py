@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+from compute import cloud_init
+
+def test_render_user_data():
+    user_data = cloud_init.render_user_data(ssh_key="ssh-ed25519 AAAA test@igs",
+        mac_address="02:00:00:00:00:01", ip_address="192.168.100.7")
+
+    assert "- ssh-ed25519 AAAA test@igs" in user_data
+    assert 'macaddress: "02:00:00:00:00:01"' in user_data
+    assert "- 192.168.100.7/24" in user_data
+    for field in cloud_init.TEMPLATE_FIELDS:
+        assert field not in user_data
+
+def test_seed_iso_layout():
+    files = {"user-data": b"#cloud-config\n", "meta-data": b"instance-id: igs\n"}
+    iso = cloud_init.build_seed_iso(files)
+    sector = cloud_init.SECTOR_SIZE
+
+    assert len(iso) % sector == 0
+
+    pvd = iso[16 * sector:17 * sector]
+    assert pvd[0:6] == b"\x01CD001"
+    assert pvd[40:46] == b"cidata"
+
+    svd = iso[17 * sector:18 * sector]
+    assert svd[0:6] == b"\x02CD001"
+    assert svd[88:91] == b"%/E"
+
+    joliet_root = iso[24 * sector:25 * sector]
+    for name, data in files.items():
+        offset = joliet_root.index(name.encode("utf-16-be"))
+        record = joliet_root[offset - 33:]
+        extent = int.from_bytes(record[2:6], "little")
+        size = int.from_bytes(record[10:14], "little")
+        assert iso[extent * sector:extent * sector + size] == data
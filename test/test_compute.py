@@ -71,3 +71,73 @@ def test_vm_start(setup_vm_manager):
     subprocess.run(kill_vm_cmd)
 
     delete_vm_helper(vm_uuid)
+
+def test_vm_hibernate_and_restore(setup_vm_manager):
+    global vm_manager
+    vm_uuid = create_vm_helper()
+    vm_manager.start_vm(vm_uuid)
+
+    result = vm_manager.hibernate_vm(vm_uuid)
+    assert result["error"] == ""
+    assert result["state_size"] > 0
+    assert vm_manager.get_vm_status(vm_uuid) == "hibernated"
+
+    result = vm_manager.restore_vm(vm_uuid)
+    assert result["error"] == ""
+    assert vm_manager.get_vm_status(vm_uuid) == "running"
+
+    # A paused VM comes back paused.
+    assert vm_manager.stop_vm(vm_uuid) == vm_uuid
+    assert vm_manager.hibernate_vm(vm_uuid)["error"] == ""
+    assert vm_manager.restore_vm(vm_uuid)["error"] == ""
+    assert vm_manager.get_vm_status(vm_uuid) == "stopped"
+
+    kill_vm_cmd = ["sudo", "pkill", "-9", "qemu"]
+    subprocess.run(kill_vm_cmd)
+
+    delete_vm_helper(vm_uuid)
+
+def test_vm_clone(setup_vm_manager):
+    global vm_manager
+    vm_uuid = create_vm_helper()
+
+    clones = [result for result in vm_manager.clone_vms(vm_uuid, count=2)]
+    assert len(clones) == 2
+    for clone in clones:
+        assert clone["error"] == ""
+        assert os.path.exists(f"{IGS_vm_path}/{clone['vm_name']}/{clone['vm_name']}.qcow2")
+    assert len(os.listdir("/IGS/compute/snapshots")) == 2
+
+    for clone in clones:
+        vm_manager.delete_vm(vm_name=clone["vm_name"])
+    delete_vm_helper(vm_uuid)
+    assert len(os.listdir("/IGS/compute/snapshots")) == 0
+
+def test_vm_clone_failures_are_reported(setup_vm_manager):
+    global vm_manager
+    clones = list(vm_manager.clone_vms("no-such-vm", count=2))
+    assert len(clones) == 1
+    assert clones[0]["vm_name"] == "" and clones[0]["error"] != ""
+
+    vm_uuid = create_vm_helper()
+    clones = list(vm_manager.clone_vms(vm_uuid, count=1, instance_type="no-such-type"))
+    assert len(clones) == 1
+    assert "no-such-type" in clones[0]["error"]
+    delete_vm_helper(vm_uuid)
+
+def test_vm_from_template(setup_vm_manager):
+    global vm_manager
+    template = vm_manager.build_template(instance_type="micro")
+    assert template["error"] == ""
+    assert template["state_size"] > 0
+
+    result = vm_manager.create_vm_from_template(instance_type="micro")
+    assert result["error"] == ""
+    assert result["from_template"]
+    assert vm_manager.get_vm_status(result["vm_name"]) == "running"
+
+    kill_vm_cmd = ["sudo", "pkill", "-9", "qemu"]
+    subprocess.run(kill_vm_cmd)
+
+    delete_vm_helper(result["vm_name"])
+    vm_manager.delete_template(template["name"])
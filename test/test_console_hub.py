@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import select
+import time
+
+from compute.console_hub import ConsoleHub, ConsoleLog
+
+# The master side of a PTY pair stands in for QEMU, the slave side is what
+# QEMU reports as the VM's serial console.
+@pytest.fixture(scope="function")
+def setup_console():
+    master, slave = os.openpty()
+    hub = ConsoleHub(max_backlog=64 * 1024)
+    hub.start()
+    yield hub, master, os.ttyname(slave)
+    hub.stop()
+    os.close(slave)
+
+def read_until(session, expected, timeout=5.0):
+    data = b""
+    deadline = time.monotonic() + timeout
+    while len(data) < len(expected) and time.monotonic() < deadline:
+        data += session.read(timeout=0.1) or b""
+    return data
+
+def test_console_fans_out_output(setup_console):
+    hub, master, pty_path = setup_console
+    readers = [hub.open_session("vm0", pty_path, read_only=True) for _ in range(3)]
+    time.sleep(0.1)
+
+    os.write(master, b"login: " * 1000)
+    for reader in readers:
+        assert read_until(reader, b"login: " * 1000) == b"login: " * 1000
+
+    for reader in readers:
+        reader.close()
+    os.close(master)
+
+def test_console_forwards_input(setup_console):
+    hub, master, pty_path = setup_console
+    session = hub.open_session("vm0", pty_path)
+    reader = hub.open_session("vm0", pty_path, read_only=True)
+    reader.write(b"ignored")
+    session.write(b"root\r")
+
+    assert select.select([master], [], [], 5.0)[0] == [master]
+    assert os.read(master, 1024) == b"root\r"
+
+    os.close(master)
+    assert session.read(timeout=5.0) == None
+    assert reader.read(timeout=5.0) == None
+
+def test_console_drops_slow_readers(setup_console):
+    hub, master, pty_path = setup_console
+    slow = hub.open_session("vm0", pty_path, read_only=True)
+    time.sleep(0.1)
+
+    for _ in range(32):
+        os.write(master, b"x" * 4096)
+    time.sleep(0.2)
+    assert len(slow.read(timeout=0.1)) <= 64 * 1024
+    assert slow.read(timeout=0.1) == None
+    assert slow.error != ""
+
+    os.close(master)
+
+def test_console_log_keeps_the_tail(tmp_path):
+    log = ConsoleLog(size=10, spill_path=str(tmp_path / "console.log"), files=3, file_size=8)
+    log.append(b"0123456")
+    log.append(b"789abc")
+    assert log.end() == 13
+    assert log.read(0) == (b"3456789abc", 3, 13)
+    assert log.read(10, max_size=2) == (b"ab", 10, 12)
+    assert log.read(20) == (b"", 13, 13)
+
+    log.append(b"x" * 25)
+    assert log.read(0) == (b"x" * 10, 28, 38)
+    log.close()
+
+    assert (tmp_path / "console.log").read_bytes() == b"x" * 25
+    assert (tmp_path / "console.log.1").read_bytes() == b"789abc"
+    assert (tmp_path / "console.log.2").read_bytes() == b"0123456"
+
+def test_console_drains_attached_vms(setup_console):
+    hub, master, pty_path = setup_console
+    log = hub.attach_vm("vm0", pty_path)
+    time.sleep(0.1)
+
+    boot_output = b"[    0.000000] Linux version\r\n" * 128
+    for _ in range(64):
+        os.write(master, boot_output)
+    deadline = time.monotonic() + 5.0
+    while log.end() < 64 * len(boot_output) and time.monotonic() < deadline:
+        log.wait(log.end(), timeout=0.1)
+    assert log.end() == 64 * len(boot_output)
+
+    session = hub.open_session("vm0", pty_path, read_only=True)
+    session.close()
+    os.write(master, b"login: ")
+    assert log.wait(64 * len(boot_output), timeout=5.0)
+    assert log.read(log.end() - 7)[0] == b"login: "
+
+    hub.remove_vm("vm0")
+    assert log.wait(log.end(), timeout=5.0)
+    assert log.closed
+    assert hub.get_log("vm0") == None
+    os.close(master)
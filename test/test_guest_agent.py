@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import base64
+import json
+import os
+import socket
+import tempfile
+import threading
+
+from compute.guest_agent import GuestAgentManager, GuestAgentError, GUEST_FILE_CHUNK_SIZE
+
+def fake_guest_agent(socket_path, ready, files):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    ready.set()
+
+    conn, _ = server.accept()
+    # Left over from an earlier client, the sync has to skip both.
+    conn.sendall(b'{"return": {}, "id": 1}\n{"retu')
+
+    handles = {}
+    for line in conn.makefile("rb"):
+        request = json.loads(line.lstrip(b"\xff"))
+        cmd = request["execute"]
+        arguments = request.get("arguments", {})
+        prefix = b""
+        if (cmd == "guest-sync-delimited"):
+            prefix = b"\xff"
+            reply = {"return": arguments["id"]}
+        elif (cmd == "guest-ping"):
+            reply = {"return": {}}
+        elif (cmd == "guest-exec"):
+            reply = {"return": {"pid": 42}}
+        elif (cmd == "guest-exec-status"):
+            reply = {"return": {"exited": True, "exitcode": 3, "out-data": base64.b64encode(b"x" * 100000).decode(),
+                "err-data": base64.b64encode(b"oops").decode()}}
+        elif (cmd == "guest-file-open"):
+            handles[len(handles) + 1] = {"path": arguments["path"], "offset": 0}
+            files.setdefault(arguments["path"], b"")
+            if (arguments["mode"] == "w"):
+                files[arguments["path"]] = b""
+            reply = {"return": len(handles)}
+        elif (cmd == "guest-file-write"):
+            data = base64.b64decode(arguments["buf-b64"])
+            files[handles[arguments["handle"]]["path"]] += data
+            reply = {"return": {"count": len(data), "eof": False}}
+        elif (cmd == "guest-file-read"):
+            handle = handles[arguments["handle"]]
+            data = files[handle["path"]][handle["offset"]:handle["offset"] + arguments["count"]]
+            handle["offset"] += len(data)
+            reply = {"return": {"count": len(data), "buf-b64": base64.b64encode(data).decode(),
+                "eof": handle["offset"] >= len(files[handle["path"]])}}
+        elif (cmd in ["guest-file-flush", "guest-file-close"]):
+            reply = {"return": {}}
+        else:
+            reply = {"error": {"class": "CommandNotFound", "desc": f"{cmd} not found"}}
+        reply["id"] = request["id"]
+        conn.sendall(prefix + json.dumps(reply).encode() + b"\n")
+
+    conn.close()
+    server.close()
+
+@pytest.fixture(scope="function")
+def guest_agent():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ready = threading.Event()
+        files = {}
+        thread = threading.Thread(target=fake_guest_agent,
+            args=(os.path.join(tmp_dir, "vm1_qga.sock"), ready, files), daemon=True)
+        thread.start()
+        ready.wait()
+        manager = GuestAgentManager(tmp_dir)
+        yield manager, files
+        manager.close()
+
+def test_guest_agent_commands_share_one_connection(guest_agent):
+    manager, _ = guest_agent
+
+    assert manager.ping("vm1")
+    client = manager.get_client("vm1")
+    result = manager.exec_command("vm1", "/bin/sh", ["-c", "true"])
+    assert result["exit_code"] == 3
+    assert result["stdout"] == b"x" * 100000
+    assert result["stderr"] == b"oops"
+    assert manager.get_client("vm1") is client
+
+    with pytest.raises(GuestAgentError):
+        manager.execute("vm1", "guest-bogus")
+    assert not manager.ping("vm2")
+
+def test_guest_agent_files(guest_agent):
+    manager, files = guest_agent
+
+    data = os.urandom(GUEST_FILE_CHUNK_SIZE * 2 + 100)
+    manager.write_file("vm1", "/tmp/data", data)
+    assert files["/tmp/data"] == data
+    assert manager.read_file("vm1", "/tmp/data") == data
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import stat
+import tempfile
+import time
+
+from compute.image_builder import ImageBuilder, convert_image
+from compute.image_store import ImageStore
+
+# qemu-img stand-in: create copies the backing file into the overlay and
+# convert copies src to dst while reporting progress like qemu-img -p. Like
+# qemu-img, convert refuses out of order writes together with compression.
+FAKE_QEMU_IMG = """#!/bin/sh
+if [ "$1" = "create" ]; then
+    cp "$5" "$8"
+    exit 0
+fi
+for arg; do
+    [ "$arg" = "-W" ] && out_of_order=1
+    [ "$arg" = "-c" ] && compress=1
+done
+if [ -n "$out_of_order" ] && [ -n "$compress" ]; then
+    echo "qemu-img: Out of order write and compress are mutually exclusive" >&2
+    exit 1
+fi
+for arg; do src="$dst"; dst="$arg"; done
+printf '    (0.00/100%%)\\r    (50.00/100%%)\\r    (100.00/100%%)\\r'
+cp "$src" "$dst"
+"""
+
+FAKE_VIRT_CUSTOMIZE = """#!/bin/sh
+echo customized >> "$2"
+"""
+
+class FakeDistroManager:
+
+    def __init__(self, image_store):
+        self.image_store = image_store
+        self.pulls = []
+
+    def pull_image(self, name):
+        self.pulls.append(name)
+        return self.image_store.get_image(name)
+
+@pytest.fixture
+def tools(monkeypatch):
+    with tempfile.TemporaryDirectory() as bin_path:
+        for name, script in [("qemu-img", FAKE_QEMU_IMG), ("virt-customize", FAKE_VIRT_CUSTOMIZE)]:
+            with open(f"{bin_path}/{name}", "w") as f:
+                f.write(script)
+            os.chmod(f"{bin_path}/{name}", stat.S_IRWXU)
+        monkeypatch.setenv("PATH", f"{bin_path}:{os.environ['PATH']}")
+        yield bin_path
+
+def wait_for_build(builder, build_id):
+    for _ in range(100):
+        build = next(build for build in builder.get_builds() if build["build_id"] == build_id)
+        if (build["state"] in ["done", "failed"]):
+            return build
+        time.sleep(0.05)
+    raise Exception("Build did not finish")
+
+def test_convert_reports_progress(tools):
+    with tempfile.TemporaryDirectory() as location:
+        with open(f"{location}/src.qcow2", "w") as f:
+            f.write("image")
+
+        progress = []
+        convert_image(f"{location}/src.qcow2", f"{location}/dst.qcow2", progress_func=progress.append)
+        assert progress[-1] == 100.0
+        assert open(f"{location}/dst.qcow2").read() == "image"
+
+def test_build_image_from_cloud_image(tools):
+    with tempfile.TemporaryDirectory() as location:
+        store = ImageStore(f"{location}/images")
+        with open(f"{location}/cloud.img", "w") as f:
+            f.write("cloud\n")
+        store.import_image("ubuntu-cloud", f"{location}/cloud.img")
+
+        distro_manager = FakeDistroManager(store)
+        builder = ImageBuilder(distro_manager, build_location=f"{location}/builds")
+        build = wait_for_build(builder, builder.build_image("ubuntu-base", "ubuntu-cloud"))
+
+        assert build["state"] == "done", build["error"]
+        assert build["progress"] == 100.0
+        assert distro_manager.pulls == []
+        assert open(store.get_image("ubuntu-base")["path"]).read() == "cloud\ncustomized\n"
+
+        # The cloud image is left untouched and the build directory is gone.
+        assert open(store.get_image("ubuntu-cloud")["path"]).read() == "cloud\n"
+        assert os.listdir(f"{location}/builds") == []
+
+        build = wait_for_build(builder, builder.build_image("ubuntu-base", "ubuntu-cloud", refresh=True))
+        assert distro_manager.pulls == ["ubuntu-cloud"]
+
+def test_failed_build_reports_error(tools):
+    with tempfile.TemporaryDirectory() as location:
+        store = ImageStore(f"{location}/images")
+        builder = ImageBuilder(FakeDistroManager(store), build_location=f"{location}/builds")
+        build = wait_for_build(builder, builder.build_image("ubuntu-base", "missing"))
+
+        assert build["state"] == "failed"
+        assert store.get_image("ubuntu-base") == None
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from compute import image_store
+from compute.image_store import ImageStore
+
+IMAGE = os.urandom(3 * 1024 * 1024 + 123)
+IMAGE_SHA256 = hashlib.sha256(IMAGE).hexdigest()
+
+class RangeHandler(BaseHTTPRequestHandler):
+    ranges = []
+    fail_first_range = False
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(IMAGE)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if (not match):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE)
+            return
+
+        start, end = int(match.group(1)), int(match.group(2)) + 1
+        RangeHandler.ranges.append((start, end))
+        self.send_response(206)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(IMAGE)}")
+        self.end_headers()
+
+        # Drops the connection half way through the first segment once.
+        if (start == 0 and RangeHandler.fail_first_range):
+            RangeHandler.fail_first_range = False
+            self.wfile.write(IMAGE[start:start + (end - start) // 2])
+            self.close_connection = True
+            return
+
+        self.wfile.write(IMAGE[start:end])
+
+@pytest.fixture
+def image_url(monkeypatch):
+    monkeypatch.setattr(image_store, "MIN_SEGMENT_SIZE", 256 * 1024)
+    RangeHandler.ranges = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/ubuntu.img"
+    server.shutdown()
+    server.server_close()
+
+def test_parallel_download_is_verified_and_deduplicated(image_url):
+    with tempfile.TemporaryDirectory() as location:
+        store = ImageStore(location)
+        image = store.add_image("ubuntu", image_url, IMAGE_SHA256, segments=4)
+
+        assert len(RangeHandler.ranges) == 4
+        assert image["sha256"] == IMAGE_SHA256
+        with open(image["path"], "rb") as f:
+            assert f.read() == IMAGE
+
+        # The same content under another name is not downloaded again.
+        copy = store.add_image("ubuntu-copy", image_url, IMAGE_SHA256)
+        assert copy["path"] == image["path"]
+        assert len(RangeHandler.ranges) == 4
+        assert [image["name"] for image in ImageStore(location).get_images()] == ["ubuntu", "ubuntu-copy"]
+
+def test_download_resumes_after_failure(image_url):
+    with tempfile.TemporaryDirectory() as location:
+        store = ImageStore(location)
+        RangeHandler.fail_first_range = True
+        with pytest.raises(Exception):
+            store.add_image("ubuntu", image_url, IMAGE_SHA256, segments=4)
+        assert store.get_image("ubuntu") == None
+
+        # Bytes that reached disk before the failure are not fetched again.
+        RangeHandler.ranges = []
+        image = store.add_image("ubuntu", image_url, IMAGE_SHA256, segments=4)
+        assert 0 < sum(end - start for start, end in RangeHandler.ranges) < len(IMAGE)
+        with open(image["path"], "rb") as f:
+            assert f.read() == IMAGE
+
+def test_checksum_mismatch_is_rejected(image_url):
+    with tempfile.TemporaryDirectory() as location:
+        store = ImageStore(location)
+        with pytest.raises(ValueError):
+            store.add_image("ubuntu", image_url, "0" * 64)
+        assert store.get_images() == []
+        assert os.listdir(store.blob_location) == []
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import shutil
+import tempfile
+
+from compute.instance_catalog import InstanceCatalog, parse_memory_mib
+
+def test_parse_memory_mib():
+    assert parse_memory_mib("512M") == 512
+    assert parse_memory_mib("2G") == 2048
+    assert parse_memory_mib("1GiB") == 1024
+    with pytest.raises(ValueError):
+        parse_memory_mib("lots")
+
+def test_catalog_reads_shipped_instance_types():
+    catalog = InstanceCatalog("conf/instances")
+    assert catalog.get("small")["vcpus"] == 1
+    assert catalog.get("small")["memory_mib"] == 2048
+    assert catalog.get("missing") == None
+
+    config = catalog.render_config("small", "vm1", "/IGS/compute/vm1/vm1.qcow2")
+    assert 'guest = "vm1"' in config
+    assert 'file = "/IGS/compute/vm1/vm1.qcow2"' in config
+
+def test_catalog_picks_up_new_instance_types():
+    with tempfile.TemporaryDirectory() as location:
+        shutil.copy("conf/instances/small.conf", location)
+        catalog = InstanceCatalog(location)
+        assert [it["name"] for it in catalog.get_instance_types()] == ["small"]
+
+        with open("conf/instances/small.conf") as cf:
+            content = cf.read().replace('cpus = "1"', 'cpus = "64"')
+        with open(os.path.join(location, "huge.conf"), "w") as cf:
+            cf.write(content)
+        os.utime(location, (0, 0))
+
+        assert [it["name"] for it in catalog.get_instance_types()] == ["small", "huge"]
+        assert catalog.get("huge")["vcpus"] == 64
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import tempfile
+
+from compute.inventory import Inventory
+
+def vm_record(vm_name, ip_suffix):
+    return {"name": vm_name, "ip_address": f"192.168.100.{ip_suffix}", "mac_address": "",
+            "tap_intf": f"tap_{vm_name}"[:15], "instance_type": "micro",
+            "disk_location": "", "disks": [], "warm": ""}
+
+def test_inventory_survives_reload():
+    with tempfile.TemporaryDirectory() as location:
+        inventory = Inventory(location)
+        assert not inventory.exists()
+
+        for i in range(200):
+            inventory.put_vm(vm_record(f"vm{i}", i))
+        for i in range(0, 200, 2):
+            inventory.remove_vm(f"vm{i}")
+        inventory.put_vm(dict(vm_record("vm1", 1), disks=["/dev/sdb1"]))
+
+        reloaded = Inventory(location).load()
+        assert len(reloaded) == 100
+        assert "vm0" not in reloaded
+        assert reloaded["vm1"]["disks"] == ["/dev/sdb1"]
+        assert reloaded == inventory.get_vms()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import tempfile
+import threading
+import time
+
+from compute.key_pool import KeyPool
+
+def wait_for_size(pool, size):
+    for _ in range(200):
+        if (pool.size() >= size):
+            return
+        time.sleep(0.05)
+    raise Exception("Key pool did not refill")
+
+def test_key_pool_refills_and_survives_restart():
+    with tempfile.TemporaryDirectory() as location:
+        pool = KeyPool(key_type="ed25519", size=4, refill_threshold=1, spool_location=location)
+        pool.start()
+        wait_for_size(pool, 4)
+        pool.stop()
+        assert len(os.listdir(f"{location}/ed25519")) == 8
+
+        # A restarted pool serves the spooled keys, and each key is only
+        # handed out once.
+        reloaded = KeyPool(key_type="ed25519", size=4, refill_threshold=1, spool_location=location)
+        assert reloaded.size() == 4
+        private_key_str, public_key_str = reloaded.get_keypair()
+        assert "PRIVATE KEY" in private_key_str and public_key_str.startswith("ssh-ed25519 ")
+        assert reloaded.hits == 1 and reloaded.misses == 0
+        assert len(os.listdir(f"{location}/ed25519")) == 6
+        assert reloaded.get_keypair() != (private_key_str, public_key_str)
+
+def test_key_pool_counts_hits_and_misses():
+    with tempfile.TemporaryDirectory() as location:
+        pool = KeyPool(key_type="ed25519", size=16, refill_threshold=0, spool_location=location)
+        pool.start()
+        wait_for_size(pool, 16)
+        pool.stop()
+
+        # More concurrent requests than spooled keys, the rest are
+        # generated on the spot.
+        threads = [threading.Thread(target=lambda: [pool.get_keypair() for _ in range(4)]) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert pool.hits == 16
+        assert pool.misses == 8
+        assert pool.size() == 0
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import tempfile
+from collections import namedtuple
+
+from compute import memory_controller
+from compute.memory_controller import MemoryController, MIB, floor_bytes, parse_balloon_floors
+from compute.qmp import QMPError
+
+VirtualMemory = namedtuple("VirtualMemory", ["total", "available"])
+
+class FakeBalloonQMP:
+
+    def __init__(self, actual_mib, available_mib):
+        self.actual = actual_mib * MIB
+        self.available = available_mib * MIB
+        self.targets = []
+        self.errors = []
+
+    def execute(self, cmd, arguments=None, timeout=5.0):
+        if (self.errors):
+            raise self.errors.pop(0)
+        if (cmd == "query-balloon"):
+            return {"actual": self.actual}
+        if (cmd == "qom-get"):
+            return {"stats": {"stat-available-memory": self.available}}
+        if (cmd == "balloon"):
+            self.targets.append(arguments["value"] // MIB)
+            return {}
+
+@pytest.fixture
+def host(monkeypatch):
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(f"{root}/proc/pressure")
+        os.makedirs(f"{root}/ksm")
+        for name, value in [("run", "0"), ("pages_to_scan", "100"), ("pages_sharing", "42")]:
+            with open(f"{root}/ksm/{name}", "w") as kf:
+                kf.write(value)
+
+        def set_host(available_fraction, psi_some=0.0):
+            monkeypatch.setattr(memory_controller.psutil, "virtual_memory",
+                lambda: VirtualMemory(total=100 * 1024 * MIB, available=int(available_fraction * 100 * 1024 * MIB)))
+            with open(f"{root}/proc/pressure/memory", "w") as pf:
+                pf.write(f"some avg10={psi_some} avg60=0.00 avg300=0.00 total=0\n"
+                         f"full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n")
+
+        yield root, set_host
+
+def make_controller(root, vms):
+    return MemoryController(lambda: vms, floors=parse_balloon_floors("small=1536"),
+        proc_root=f"{root}/proc", ksm_root=f"{root}/ksm")
+
+def test_floor_bytes():
+    assert floor_bytes("50%", 2048) == 1024 * MIB
+    assert floor_bytes("4096", 2048) == 2048 * MIB
+
+def test_pressure_inflates_balloons_down_to_the_floor(host):
+    root, set_host = host
+    idle = FakeBalloonQMP(2048, 1800)
+    busy = FakeBalloonQMP(2048, 100)
+    vms = [{"vm_name": "idle", "qmp": idle, "memory_mib": 2048, "instance_type": "small"},
+           {"vm_name": "busy", "qmp": busy, "memory_mib": 2048, "instance_type": "medium"}]
+    controller = make_controller(root, vms)
+
+    set_host(0.05, psi_some=25.0)
+    assert controller.adjust() == {"idle": 1844 * MIB}
+    assert open(f"{root}/ksm/run").read() == "1"
+    assert open(f"{root}/ksm/pages_to_scan").read() == "2000"
+
+    # The guest shrinks step by step but never below its floor.
+    for _ in range(10):
+        idle.actual = idle.targets[-1] * MIB
+        controller.adjust()
+    assert idle.targets[-1] == 1536
+    assert busy.targets == []
+
+def test_balloons_deflate_once_pressure_is_gone(host):
+    root, set_host = host
+    qmp = FakeBalloonQMP(1024, 900)
+    controller = make_controller(root, [{"vm_name": "vm1", "qmp": qmp, "memory_mib": 2048, "instance_type": "small"}])
+
+    set_host(0.5)
+    assert controller.adjust() == {"vm1": 1228 * MIB}
+    assert open(f"{root}/ksm/pages_to_scan").read() == "100"
+
+    # A guest running short gets memory back even while the host is steady.
+    set_host(0.2)
+    qmp.actual = 1536 * MIB
+    qmp.available = 10 * MIB
+    assert controller.adjust() == {"vm1": 1740 * MIB}
+
+def test_only_vms_without_a_balloon_are_skipped(host):
+    root, set_host = host
+    flaky = FakeBalloonQMP(1024, 900)
+    no_balloon = FakeBalloonQMP(1024, 900)
+    controller = make_controller(root, [
+        {"vm_name": "flaky", "qmp": flaky, "memory_mib": 2048, "instance_type": "small"},
+        {"vm_name": "no_balloon", "qmp": no_balloon, "memory_mib": 2048, "instance_type": "small"}])
+
+    set_host(0.5)
+    flaky.errors = [QMPError("Timed out waiting for query-balloon")]
+    no_balloon.errors = [QMPError("No balloon device has been activated", "DeviceNotActive")]
+    assert controller.adjust() == {}
+
+    # A transient failure is retried on the next round.
+    assert controller.adjust() == {"flaky": 1228 * MIB}
+    assert no_balloon.targets == []
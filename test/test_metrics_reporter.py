@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+from collections import namedtuple
+
+from observability.client import metrics_reporter
+from observability.client.metrics_reporter import NodeHealthExporter, cpu_busy_percent
+
+CPUTimes = namedtuple("CPUTimes", ["user", "nice", "system", "idle", "iowait", "guest", "guest_nice"])
+
+def scrape(exporter):
+    return {(family.name, tuple(sample.labels.values())): sample.value
+        for family in exporter.collect() for sample in family.samples}
+
+def test_cpu_busy_percent_ignores_guest_time():
+    previous = CPUTimes(0, 0, 0, 0, 0, 0, 0)
+    assert cpu_busy_percent(previous, CPUTimes(60, 0, 10, 20, 10, 50, 0)) == 70.0
+    assert cpu_busy_percent(previous, previous) == None
+
+def test_scrapes_report_usage_since_the_last_scrape(monkeypatch):
+    cpu_times = [CPUTimes(0, 0, 0, 0, 0, 0, 0)]
+    monkeypatch.setattr(metrics_reporter.psutil, "cpu_times", lambda: cpu_times[0])
+    exporter = NodeHealthExporter()
+
+    cpu_times[0] = CPUTimes(90, 0, 0, 10, 0, 0, 0)
+    first = scrape(exporter)
+    assert first[("cpu_usage_percent", ())] == 90.0
+    assert first[("component_health", ("cpu",))] == 0
+    assert first[("node_health", ())] == 0
+
+    cpu_times[0] = CPUTimes(100, 0, 0, 100, 0, 0, 0)
+    second = scrape(exporter)
+    assert second[("cpu_usage_percent", ())] == 10.0
+    assert second[("component_health", ("cpu",))] == 1
+    assert scrape(exporter)[("cpu_usage_percent", ())] == 10.0
+    assert set(first) == set(second)
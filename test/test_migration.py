@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+
+import grpc
+
+import server
+from compute.generated import compute_pb2, compute_pb2_grpc
+
+SOURCE_PORT = 50071
+TARGET_PORT = 50072
+
+
+# Two dataplane servers on the same host, kept apart by their state roots
+# and tap prefixes. Both run VMs with TCG so the test does not depend on
+# nested KVM.
+@pytest.fixture(scope="function")
+def setup_servers(tmp_path):
+    servers = []
+    stubs = []
+    for port, name in [(SOURCE_PORT, "a"), (TARGET_PORT, "b")]:
+        srv = server.build_server(port=port,
+            vm_manager_options={"state_root": str(tmp_path / name), "accel": "tcg"},
+            network_options={"tap_prefix": f"t{name}_"})
+        srv.start()
+        servers.append(srv)
+        stubs.append(compute_pb2_grpc.vmmStub(grpc.insecure_channel(f"localhost:{port}")))
+
+    yield stubs
+
+    for srv in servers:
+        srv.stop(None)
+
+def test_vm_migrate(setup_servers, tmp_path):
+    source, target = setup_servers
+    vm_name = source.CreateVM(compute_pb2.CreateVMRequest(instance_type="micro")).vm_name
+    assert vm_name != ""
+    source.StartVM(compute_pb2.StartVMRequest(vm_name=vm_name))
+
+    response = source.MigrateVM(compute_pb2.MigrateVMRequest(vm_name=vm_name,
+        target_endpoint=f"localhost:{TARGET_PORT}"))
+    assert response.error == ""
+    assert response.transferred > 0
+
+    assert source.GetVMStatus(compute_pb2.GetVMStatusRequest(vm_name=vm_name)).vm_status == ""
+    assert target.GetVMStatus(compute_pb2.GetVMStatusRequest(vm_name=vm_name)).vm_status == "running"
+    assert not os.path.exists(tmp_path / "a" / "vms" / vm_name)
+    assert os.path.exists(tmp_path / "b" / "vms" / vm_name / f"{vm_name}.qcow2")
+
+    target.DeleteVM(compute_pb2.DeleteVMRequest(vm_name=vm_name))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import tempfile
+
+from compute.host_topology import discover_topology, format_cpulist, parse_cpulist
+from compute.placement import PlacementEngine
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as sf:
+        sf.write(data)
+
+# Two nodes with four cores each, hyperthread siblings are n and n + 8.
+# Node 0 has 1024 free 2M hugepages, node 1 has none.
+def fake_host(root):
+    sysfs_root = os.path.join(root, "sys")
+    proc_root = os.path.join(root, "proc")
+    for node in range(2):
+        cpus = list(range(node * 4, node * 4 + 4))
+        write_file(f"{sysfs_root}/devices/system/node/node{node}/cpulist",
+            format_cpulist(cpus + [cpu + 8 for cpu in cpus]))
+        hugepages = 1024 if node == 0 else 0
+        for name in ["nr_hugepages", "free_hugepages"]:
+            write_file(f"{sysfs_root}/devices/system/node/node{node}/hugepages/hugepages-2048kB/{name}",
+                str(hugepages))
+    for cpu in range(16):
+        write_file(f"{sysfs_root}/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list",
+            f"{cpu % 8},{cpu % 8 + 8}")
+
+    write_file(f"{proc_root}/meminfo", "MemTotal: 16384000 kB\nHugepagesize: 2048 kB\n")
+    write_file(f"{proc_root}/mounts", "hugetlbfs /dev/hugepages hugetlbfs rw,relatime,pagesize=2M 0 0\n")
+    return sysfs_root, proc_root
+
+def test_cpulist_round_trip():
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpulist([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+
+def test_discover_topology():
+    with tempfile.TemporaryDirectory() as root:
+        sysfs_root, _ = fake_host(root)
+        topology = discover_topology(sysfs_root)
+
+        assert sorted(topology) == [0, 1]
+        assert topology[0]["cores"] == [[0, 8], [1, 9], [2, 10], [3, 11]]
+        assert topology[0]["hugepages"] == {2048: 1024}
+
+def test_placement_packs_nodes():
+    with tempfile.TemporaryDirectory() as root:
+        sysfs_root, proc_root = fake_host(root)
+        engine = PlacementEngine(sysfs_root=sysfs_root, proc_root=proc_root, reserved_cpus="0,8")
+
+        # Hugepage backed memory wins, and whole cores are used before
+        # splitting one.
+        vm1 = engine.place("vm1", 3, 1024)
+        assert vm1["node"] == 0
+        assert vm1["cpus"] == [1, 2, 9]
+        assert vm1["hugepages"] == 512
+        assert vm1["mem_path"] == "/dev/hugepages"
+
+        # The odd vCPU fills the half used core rather than a fresh one.
+        vm2 = engine.place("vm2", 1, 1024)
+        assert vm2["node"] == 0
+        assert vm2["cpus"] == [10]
+
+        # Node 0 is out of hugepages and has only one core left.
+        vm3 = engine.place("vm3", 4, 1024)
+        assert vm3["node"] == 1
+        assert vm3["cpus"] == [4, 5, 12, 13]
+        assert vm3["hugepages"] == 0
+
+        assert engine.place("vm4", 8, 1024) == None
+
+        engine.release("vm1")
+        vm5 = engine.place("vm5", 5, 1024)
+        assert vm5["node"] == 0
+        assert vm5["cpus"] == [1, 2, 3, 9, 11]
+        assert vm5["hugepages"] == 512
+
+def test_placement_adopts_running_vms():
+    with tempfile.TemporaryDirectory() as root:
+        sysfs_root, proc_root = fake_host(root)
+        engine = PlacementEngine(sysfs_root=sysfs_root, proc_root=proc_root)
+
+        adopted = engine.adopt("vm1", [4, 12], "/dev/hugepages", 1024)
+        assert adopted["node"] == 1
+        assert adopted["hugepage_size_kb"] == 2048
+
+        assert 4 not in engine.place("vm2", 8, 1024)["cpus"]
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import threading
+import time
+
+from compute.provisioning_pipeline import ProvisioningPipeline
+
+def test_pipeline_runs_every_context_through_the_stages():
+    stages = [(name, lambda ctx, name=name: ctx.setdefault("stages", []).append(name), 2) for name in ["a", "b"]]
+    pipeline = ProvisioningPipeline(stages)
+
+    results = list(pipeline.run([{"n": n} for n in range(5)]))
+    assert sorted(ctx["n"] for ctx in results) == list(range(5))
+    assert all(ctx["error"] == "" and ctx["stages"] == ["a", "b"] for ctx in results)
+
+def test_stopping_early_cleans_up_queued_contexts():
+    cleaned = []
+    finished = []
+    lock = threading.Lock()
+
+    def allocate(ctx):
+        time.sleep(0.05)
+        if (ctx["n"] == 0):
+            raise Exception("no tap")
+
+    def boot(ctx):
+        with lock:
+            finished.append(ctx["n"])
+
+    def cleanup(ctx):
+        with lock:
+            cleaned.append(ctx["n"])
+
+    pipeline = ProvisioningPipeline([("allocate", allocate, 1), ("boot", boot, 1)], failure_handler=cleanup)
+    contexts = [{"n": n} for n in range(5)]
+    results = pipeline.run(contexts)
+
+    # The first context fails while the others are still queued, and the
+    # caller gives up after seeing the failure.
+    assert next(results)["error"] == "allocate: no tap"
+    results.close()
+    time.sleep(0.2)
+
+    assert sorted(cleaned + finished) == list(range(5))
+    assert 0 in cleaned
+    assert all(ctx["error"] != "" for ctx in contexts if ctx["n"] in cleaned)
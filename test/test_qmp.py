@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from compute.qmp import QMPClient, QMPError
+
+def fake_qmp_server(socket_path, ready):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    ready.set()
+
+    conn, _ = server.accept()
+    rfile = conn.makefile("rb")
+    conn.sendall(b'{"QMP": {"version": {}, "capabilities": []}}\n')
+
+    for line in rfile:
+        request = json.loads(line)
+        cmd = request["execute"]
+        if (cmd == "stop"):
+            conn.sendall(b'{"event": "STOP", "data": {}, "timestamp": {}}\n')
+        if (cmd == "bogus"):
+            reply = {"error": {"class": "CommandNotFound", "desc": "bogus not found"}, "id": request["id"]}
+        elif (cmd == "query-status"):
+            reply = {"return": {"status": "running", "running": True}, "id": request["id"]}
+        else:
+            reply = {"return": {}, "id": request["id"]}
+        conn.sendall(json.dumps(reply).encode() + b"\n")
+
+    conn.close()
+    server.close()
+
+@pytest.fixture(scope="function")
+def qmp_socket():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "vm.sock")
+        ready = threading.Event()
+        thread = threading.Thread(target=fake_qmp_server, args=(socket_path, ready), daemon=True)
+        thread.start()
+        ready.wait()
+        yield socket_path
+
+def test_qmp_commands_and_events(qmp_socket):
+    events = []
+    closed = threading.Event()
+    qmp = QMPClient(qmp_socket, event_handler=events.append, close_handler=closed.set)
+    qmp.connect(timeout=2.0)
+
+    start = time.monotonic()
+    assert qmp.execute("query-status")["status"] == "running"
+    assert qmp.execute("stop") == {}
+    assert time.monotonic() - start < 0.5
+    assert [event["event"] for event in events] == ["STOP"]
+
+    with pytest.raises(QMPError):
+        qmp.execute("bogus")
+
+    qmp.close()
+    assert closed.wait(2.0)
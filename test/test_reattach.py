@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import threading
+
+from compute.vm import VM
+from compute.vm_index import VMIndex
+from compute.vm_events import VMEventLog
+from compute.vm_manager import VMManager
+
+class FakeReattachQMP:
+
+    def __init__(self, run_state):
+        self.run_state = run_state
+        self.commands = []
+
+    def execute(self, cmd, arguments=None, timeout=5.0):
+        self.commands.append(cmd)
+        if (cmd == "query-chardev"):
+            return [{"label": "serial0", "filename": "pty:/dev/pts/7"},
+                {"label": "ch0", "filename": "unix:/tmp/vm_qga.sock,server=on"}]
+        if (cmd == "query-status"):
+            return {"status": self.run_state}
+        if (cmd == "query-cpus-fast"):
+            return []
+
+class FakeConsoleHub:
+
+    def __init__(self):
+        self.attached = {}
+
+    def attach_vm(self, vm_name, pty_path, spill_path=""):
+        self.attached[vm_name] = pty_path
+
+# Only what reattaching touches is set up, so no libvirt connection, network
+# or QEMU is needed.
+def make_vm_manager(qmps):
+    vm_manager = VMManager.__new__(VMManager)
+    vm_manager._vm_location = "/IGS/compute/vms"
+    vm_manager._vms = {}
+    vm_manager._vms_lock = threading.Lock()
+    vm_manager._vm_locks = {}
+    vm_manager._legacy_qemu_pids = {}
+    vm_manager._vm_index = VMIndex()
+    vm_manager._vm_events = VMEventLog()
+    vm_manager._console_hub = FakeConsoleHub()
+
+    def connect_qmp(vm_name, timeout=5.0, alive=None):
+        if (qmps[vm_name] == None):
+            raise ConnectionRefusedError("Connection refused")
+        return qmps[vm_name]
+    vm_manager._connect_qmp = connect_qmp
+
+    for vm_name in qmps:
+        vm_manager._vms[vm_name] = {"instance": VM(vm_name, disk_location=f"/IGS/compute/vms/{vm_name}.qcow2"),
+            "status": "down"}
+        vm_manager._vm_locks[vm_name] = threading.RLock()
+        vm_manager._vm_index.add(vm_name, "down")
+    return vm_manager
+
+def test_reattach_vm():
+    qmps = {"running": FakeReattachQMP("running"), "paused": FakeReattachQMP("paused"), "gone": None}
+    vm_manager = make_vm_manager(qmps)
+
+    for pid, vm_name in enumerate(qmps, start=100):
+        vm_manager._reattach_vm(vm_name, pid)
+
+    running = vm_manager._vms["running"]
+    assert running["status"] == "running"
+    assert running["instance"].hv_conn == qmps["running"]
+    assert running["instance"].serial_conn == "/dev/pts/7"
+    assert running["instance"].pid == 100
+    assert vm_manager._console_hub.attached["running"] == "/dev/pts/7"
+
+    paused = vm_manager._vms["paused"]
+    assert paused["status"] == "stopped"
+    assert paused["instance"].hv_conn == qmps["paused"]
+    assert paused["instance"].pid == 101
+
+    # A VM whose monitor does not answer is left down and untouched.
+    gone = vm_manager._vms["gone"]
+    assert gone["status"] == "down"
+    assert gone["instance"].hv_conn == None
+    assert gone["instance"].pid == None
+    assert "gone" not in vm_manager._console_hub.attached
+
+    names, _ = vm_manager._vm_index.query(status="running", page_size=0)
+    assert names == ["running"]
+
+def test_vms_running_under_a_legacy_monitor_are_not_started_again():
+    vm_manager = make_vm_manager({"legacy": None})
+    vm_manager._legacy_qemu_pids["legacy"] = os.getpid()
+
+    result = vm_manager._start_vm("legacy")
+    assert result["error"].startswith("VM is still running from before the upgrade")
+    assert vm_manager._vms["legacy"]["status"] == "down"
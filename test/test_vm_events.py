@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import threading
+
+from compute.vm_events import VMEventLog
+
+def test_vm_events_resume_from_resource_version():
+    log = VMEventLog(history=8)
+    log.publish("ADDED", "vm0", "down")
+    version, statuses = log.snapshot()
+    assert statuses == {"vm0": "down"}
+
+    log.publish("MODIFIED", "vm0", "running")
+    log.publish("MODIFIED", "vm0", "running")
+    log.publish("ADDED", "vm1", "down")
+    log.publish("DELETED", "vm0")
+    log.publish("MODIFIED", "vm0", "down")
+
+    events = log.events_since(version)
+    assert [(event["type"], event["vm_name"]) for event in events] == \
+        [("MODIFIED", "vm0"), ("ADDED", "vm1"), ("DELETED", "vm0")]
+    assert [event["resource_version"] for event in events] == [version + 1, version + 2, version + 3]
+    assert log.events_since(events[-1]["resource_version"]) == []
+    assert log.snapshot() == (version + 3, {"vm1": "down"})
+
+def test_vm_events_expire():
+    log = VMEventLog(history=4)
+    version, _ = log.snapshot()
+    for i in range(4):
+        log.publish("ADDED", f"vm{i}", "down")
+    assert len(log.events_since(version)) == 4
+
+    log.publish("ADDED", "vm4", "down")
+    assert log.events_since(version) == None
+    assert len(log.events_since(version + 1)) == 4
+    assert log.events_since(version + 100) == None
+
+def test_vm_events_wake_watchers():
+    log = VMEventLog()
+    version, _ = log.snapshot()
+    assert not log.wait(version, timeout=0.01)
+
+    woken = []
+    watchers = [threading.Thread(target=lambda: woken.append(log.wait(version, timeout=5.0))) for _ in range(8)]
+    for watcher in watchers:
+        watcher.start()
+    log.publish("ADDED", "vm0", "down")
+    for watcher in watchers:
+        watcher.join()
+    assert woken == [True] * 8
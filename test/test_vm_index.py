@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+from compute.vm_index import VMIndex
+
+def test_vm_index_filters_and_pages():
+    index = VMIndex()
+    for i in range(1000):
+        index.add(f"vm{i:04}", "running" if i % 2 else "down", {"pool": f"p{i % 4}"})
+
+    names, token = index.query(page_size=300)
+    pages = [names]
+    while token:
+        names, token = index.query(page_token=token, page_size=300)
+        pages.append(names)
+    assert [len(page) for page in pages] == [300, 300, 300, 100]
+    assert sum(pages, []) == [f"vm{i:04}" for i in range(1000)]
+
+    names, token = index.query(status="running", labels={"pool": "p1"}, page_size=0)
+    assert token == ""
+    assert names == [f"vm{i:04}" for i in range(1, 1000, 4)]
+    assert index.query(status="down", labels={"pool": "p1"}) == ([], "")
+
+def test_vm_index_follows_changes():
+    index = VMIndex()
+    index.add("vm0", "down", {"team": "a"})
+    index.add("vm1", "down")
+
+    index.set_status("vm0", "running")
+    index.set_labels("vm1", {"team": "a"})
+    index.set_status("vm2", "running")
+    assert index.query(status="running", page_size=0) == (["vm0"], "")
+    assert index.query(labels={"team": "a"}, page_size=0) == (["vm0", "vm1"], "")
+
+    index.remove("vm0")
+    index.remove("vm0")
+    assert index.query(status="running", page_size=0) == ([], "")
+    assert index.query(page_size=0) == (["vm1"], "")
+    assert index.get_labels("vm1") == {"team": "a"}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import os
+import tempfile
+
+from compute.vm_metrics import VMMetricsCollector, VMMetricsSampler, CLOCK_TICKS, PAGE_SIZE, read_process_stats
+
+class FakeBlockQMP:
+
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, cmd, arguments=None, timeout=5.0):
+        self.commands.append(cmd)
+        return [{"device": "virtio0", "stats": {"rd_bytes": 4096, "wr_bytes": 8192, "rd_operations": 1,
+            "wr_operations": 2, "flush_operations": 3}}]
+
+class FakeLink:
+
+    def __init__(self, name, stats):
+        self.attrs = {"IFLA_IFNAME": name, "IFLA_STATS64": stats}
+
+    def get_attr(self, name):
+        return self.attrs.get(name)
+
+class FakeIPRoute:
+
+    def __init__(self, links):
+        self.links = links
+        self.dumps = 0
+
+    def get_links(self):
+        self.dumps += 1
+        return self.links
+
+def write_stat(root, pid, utime, stime, rss_pages):
+    os.makedirs(f"{root}/{pid}", exist_ok=True)
+    fields = ["S"] + ["0"] * 10 + [str(utime), str(stime)] + ["0"] * 8 + [str(rss_pages)] + ["0"] * 20
+    with open(f"{root}/{pid}/stat", "w") as sf:
+        sf.write(f"{pid} (qemu-system-x86 (vm)) {' '.join(fields)}\n")
+
+def test_read_process_stats():
+    with tempfile.TemporaryDirectory() as root:
+        write_stat(root, 100, CLOCK_TICKS * 3, CLOCK_TICKS, 256)
+        assert read_process_stats(100, root) == {"cpu_seconds": 4.0, "rss_bytes": 256 * PAGE_SIZE}
+        assert read_process_stats(101, root) == None
+
+def test_sampler_reports_every_vm_in_one_pass():
+    with tempfile.TemporaryDirectory() as root:
+        qmps = {}
+        vms = []
+        links = [FakeLink("eth0", {})]
+        for i in range(3):
+            write_stat(root, 100 + i, CLOCK_TICKS * i, 0, 10)
+            qmps[f"vm{i}"] = FakeBlockQMP()
+            vms.append({"vm_name": f"vm{i}", "pid": 100 + i, "qmp": qmps[f"vm{i}"], "tap_intf": f"tap_vm{i}"})
+            links.append(FakeLink(f"tap_vm{i}", {"rx_bytes": 10 * i, "tx_bytes": 20 * i, "rx_packets": 1,
+                "tx_packets": 2, "rx_dropped": 0, "tx_dropped": 0}))
+        # A VM whose QEMU exited since it was listed is left out.
+        vms.append({"vm_name": "gone", "pid": 999, "qmp": FakeBlockQMP(), "tap_intf": "tap_gone"})
+
+        ipr = FakeIPRoute(links)
+        collector = VMMetricsCollector()
+        sampler = VMMetricsSampler(lambda: vms, proc_root=root, ipr=ipr, collector=collector)
+        collector.add(sampler)
+        sampler.sample()
+
+        assert ipr.dumps == 1
+        assert all(qmp.commands == ["query-blockstats"] for qmp in qmps.values())
+
+        families = {family.name: family for family in collector.collect()}
+        values = {(family_name, tuple(sample.labels.values())): sample.value
+            for family_name, family in families.items() for sample in family.samples}
+        assert values[("igs_vm_cpu_seconds", ("vm2",))] == 2.0
+        assert ("igs_vm_cpu_seconds", ("gone",)) not in values
+        assert values[("igs_vm_memory_rss_bytes", ("vm1",))] == 10 * PAGE_SIZE
+        assert values[("igs_vm_block_written_bytes", ("vm0", "virtio0"))] == 8192
+        assert values[("igs_vm_network_receive_bytes", ("vm2", "tap_vm2"))] == 40
+        assert values[("igs_vm_network_transmit_bytes", ("vm2", "tap_vm2"))] == 20
+
+        collector.remove(sampler)
+        assert all(len(family.samples) == 0 for family in collector.collect()
+            if family.name != "igs_vm_metrics_sample_seconds")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Copyright © 2025 InfraMatrix. All Rights Reserved.
+
+# SPDX-License-Identifier: BSD-3-Clause
+
+import pytest
+
+import threading
+import time
+
+from compute.warm_pool import WarmPool, parse_pool_targets
+
+class FakeVMManager:
+
+    def __init__(self, failures=0):
+        self.booted = []
+        self.failures = failures
+        self.lock = threading.Lock()
+
+    def provision_warm_vm(self, instance_type):
+        with self.lock:
+            if (self.failures > 0):
+                self.failures -= 1
+                raise Exception("no free tap")
+            vm_name = f"warm{len(self.booted)}"
+            self.booted.append(vm_name)
+        return {"vm_name": vm_name, "instance_type": instance_type, "booted": True}
+
+def wait_for_size(pool, instance_type, size, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = {entry["instance_type"]: entry for entry in pool.get_stats()}
+        if (stats[instance_type]["size"] == size):
+            return stats[instance_type]
+        time.sleep(0.01)
+    raise AssertionError(f"warm pool for {instance_type} did not reach {size} VMs")
+
+def test_parse_pool_targets():
+    assert parse_pool_targets("") == {}
+    assert parse_pool_targets("small=2, large = 1,") == {"small": 2, "large": 1}
+
+def test_claim_returns_a_pre_booted_vm_and_the_pool_refills():
+    manager = FakeVMManager()
+    pool = WarmPool(manager.provision_warm_vm, targets={"small": 2})
+    pool.start()
+    try:
+        wait_for_size(pool, "small", 2)
+        assert manager.booted == ["warm0", "warm1"]
+
+        ctx = pool.claim("small")
+        assert ctx["vm_name"] == "warm0"
+        assert ctx["booted"] == True
+
+        stats = wait_for_size(pool, "small", 2)
+        assert manager.booted == ["warm0", "warm1", "warm2"]
+        assert stats["target"] == 2
+        assert stats["hits"] == 1
+
+        # The pool stops at its target instead of booting more.
+        time.sleep(0.1)
+        assert len(manager.booted) == 3
+    finally:
+        pool.stop()
+
+def test_claim_misses_for_an_instance_type_without_a_pool():
+    manager = FakeVMManager()
+    pool = WarmPool(manager.provision_warm_vm, targets={"small": 1})
+
+    assert pool.claim("large") == None
+    assert pool.claim("small") == None
+    stats = {entry["instance_type"]: entry for entry in pool.get_stats()}
+    assert stats["large"]["misses"] == 1
+    assert stats["small"]["misses"] == 1
+    assert manager.booted == []
+
+def test_pool_retries_failed_provisioning():
+    manager = FakeVMManager(failures=2)
+    pool = WarmPool(manager.provision_warm_vm, targets={"small": 1}, retry_interval=0.01)
+    pool.start()
+    try:
+        wait_for_size(pool, "small", 1)
+        assert manager.failures == 0
+        assert pool.claim("small")["vm_name"] == "warm0"
+    finally:
+        pool.stop()